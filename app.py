@@ -2,44 +2,309 @@
 EHR Agent Web 应用
 Flask 后端服务器
 """
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
-from datetime import datetime
-from config import GOOGLE_API_KEY, GEMINI_MODEL
+import json
+import math
+import time
+import atexit
+import threading
+from config import (
+    GOOGLE_API_KEY, GEMINI_MODEL, REPORT_DB_PATH, REPORT_FSYNC_POLICY,
+    REPORT_QUEUE_SIZE, REPORT_BATCH_SIZE, REPORT_FLUSH_INTERVAL, REPORT_ENQUEUE_TIMEOUT,
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_CAPACITY, SEMANTIC_CACHE_MODEL,
+    EXAM_CATALOG_ENABLED, EXAM_CATALOG_PATH,
+    SPECULATIVE_ENABLED, SPECULATIVE_DEBOUNCE, REQUEST_LOG_ENABLED,
+    TRACE_EXPORT_PATH, TRACE_KEEP_RECENT, TRACE_MAX_BYTES, FLASK_DEBUG,
+    COMPRESS_ENABLED, COMPRESS_MIN_SIZE, COMPRESS_LEVEL,
+    LLM_COALESCE_ENABLED, LLM_COALESCE_DIR, LLM_MAX_CONCURRENCY, LLM_RESERVED_INTERACTIVE,
+    LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT, LLM_ADAPTIVE_CONCURRENCY, LLM_MIN_CONCURRENCY,
+    GOOGLE_API_KEYS, LLM_KEY_RPM, LLM_KEY_REVOKED_QUARANTINE,
+    SESSION_MAX_COUNT, SESSION_MAX_MB, SESSION_DIR, SESSION_TTL_HOURS
+)
 from soap_generator import SOAPGenerator
 from examination_recommender import ExaminationRecommender
 from drug_checker import DrugChecker
+from report_store import ReportStore
+from report_writer import ReportWriter, ReportQueueFull, ReportWriteFailed
+from semantic_cache import SemanticCache, create_embedder
+from exam_catalog import ExamCatalog
+from speculative import SpeculativeRecommender
+from http_cache import HttpCache
+from session_store import STAGES, ConsultationSession, SessionConflict, SessionStore
+import json_codec
+import llm_client
+from llm_scheduler import SchedulerOverloaded
+from cancellation import CancelToken, RequestCancelled, use_token, watch_disconnect
+import metrics
+import tracing
 
 # 获取应用根目录
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+tracing.configure(os.path.join(BASE_DIR, TRACE_EXPORT_PATH) if TRACE_EXPORT_PATH else None,
+                  keep_recent=TRACE_KEEP_RECENT, max_bytes=TRACE_MAX_BYTES)
+if tracing.tracer.exporter is not None:
+    atexit.register(tracing.tracer.exporter.close)
+llm_client.configure_coalescing(LLM_COALESCE_ENABLED,
+                               os.path.join(BASE_DIR, LLM_COALESCE_DIR) if LLM_COALESCE_DIR else None)
+llm_client.configure_scheduler(LLM_MAX_CONCURRENCY, LLM_RESERVED_INTERACTIVE, LLM_MAX_QUEUE,
+                               adaptive=LLM_ADAPTIVE_CONCURRENCY, min_concurrency=LLM_MIN_CONCURRENCY,
+                               deadline=LLM_QUEUE_TIMEOUT or None)
+llm_client.configure_credentials(GOOGLE_API_KEYS, rpm=LLM_KEY_RPM, revoked_quarantine=LLM_KEY_REVOKED_QUARANTINE)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    响应和请求体的 JSON 编解码使用 json_codec（安装 orjson 时更快），结果模型直接序列化；
+    调试模式下带缩进的输出仍由标准库处理
+    """
+
+    @staticmethod
+    def default(o):
+        if hasattr(o, 'to_dict'):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if 'indent' in kwargs or 'cls' in kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(obj, sort_keys=self.sort_keys, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
 app = Flask(__name__, 
             template_folder=os.path.join(BASE_DIR, 'templates'),
             static_folder=os.path.join(BASE_DIR, 'static'))
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # 延迟初始化组件（避免启动时出错）
 soap_generator = None
 exam_recommender = None
 drug_checker = None
+speculative_recommender = None
 
 def init_components():
     """初始化 AI 组件"""
-    global soap_generator, exam_recommender, drug_checker
+    global soap_generator, exam_recommender, drug_checker, speculative_recommender
     if soap_generator is None:
         try:
             print("正在初始化 AI 组件...")
             soap_generator = SOAPGenerator(GOOGLE_API_KEY, GEMINI_MODEL)
-            exam_recommender = ExaminationRecommender(GOOGLE_API_KEY, GEMINI_MODEL)
+            semantic_cache = None
+            if SEMANTIC_CACHE_ENABLED:
+                semantic_cache = SemanticCache(
+                    create_embedder(SEMANTIC_CACHE_MODEL),
+                    threshold=SEMANTIC_CACHE_THRESHOLD,
+                    capacity=SEMANTIC_CACHE_CAPACITY
+                )
+            catalog = None
+            if EXAM_CATALOG_ENABLED:
+                catalog = ExamCatalog.load(
+                    os.path.join(BASE_DIR, EXAM_CATALOG_PATH) if EXAM_CATALOG_PATH else None
+                )
+            exam_recommender = ExaminationRecommender(GOOGLE_API_KEY, GEMINI_MODEL,
+                                                      semantic_cache=semantic_cache, catalog=catalog)
             drug_checker = DrugChecker(GOOGLE_API_KEY, GEMINI_MODEL)
+            if SPECULATIVE_ENABLED:
+                speculative_recommender = SpeculativeRecommender(exam_recommender,
+                                                                 debounce=SPECULATIVE_DEBOUNCE)
             print("✅ AI 组件初始化成功")
         except Exception as e:
             print(f"⚠️  AI 组件初始化失败: {e}")
             print("   应用仍可运行，但 AI 功能可能不可用")
             # 不抛出异常，让应用继续运行
 
+session_store = SessionStore(
+    max_sessions=SESSION_MAX_COUNT,
+    max_bytes=SESSION_MAX_MB * 1024 * 1024,
+    directory=os.path.join(BASE_DIR, SESSION_DIR) if SESSION_DIR else None,
+    ttl=SESSION_TTL_HOURS * 3600
+)
+
+def consultation_session(data: dict) -> ConsultationSession:
+    """
+    请求对应的问诊会话：带 consultation_id 时取服务器上的会话并应用请求中的增量，
+    否则用请求中的完整内容构造临时会话（兼容只发送完整内容的调用方）
+
+    Raises:
+        SessionConflict: 增量无法应用，客户端需重新发送完整内容
+    """
+    consultation_id = data.get('consultation_id')
+    if not consultation_id:
+        session = ConsultationSession()
+        session.apply(data)
+        return session
+    return session_store.update(consultation_id, data)
+
+def save_soap(session: ConsultationSession, soap_data: dict, transcript) -> ConsultationSession:
+    """
+    保存生成的 SOAP 病历：在会话锁内基于最新的会话修改（生成期间其他请求可能已更新会话），
+    返回修改后的会话；临时会话或已结束的问诊只修改当前对象
+    """
+    if session.consultation_id:
+        saved = session_store.update(session.consultation_id,
+                                     lambda current: current.set_soap(soap_data, transcript), create=False)
+        if saved is not None:
+            return saved
+    session.set_soap(soap_data, transcript)
+    return session
+
+def save_stage_result(session: ConsultationSession, stage: str, value, for_soap_id):
+    """保存阶段结果，计算期间 SOAP 病历已变化（并发的生成请求）时丢弃"""
+    if session.consultation_id:
+        session_store.save_stage_result(session.consultation_id, stage, value, for_soap_id)
+
+def usable_drug_check(drug_check):
+    """客户端随报告发送的药物检查结果，检查失败（带 error）的结果不写入报告"""
+    if not drug_check or 'error' in drug_check:
+        return None
+    return drug_check
+
+def end_consultation(consultation_id):
+    """问诊结束（报告已保存或医生清空了问诊）后释放服务器上的会话和推测执行状态"""
+    if not consultation_id:
+        return
+    session_store.discard(consultation_id)
+    if speculative_recommender is not None:
+        speculative_recommender.discard(consultation_id)
+
+report_store = None
+report_writer = None
+_report_store_lock = threading.Lock()
+
+def get_report_store() -> ReportStore:
+    """获取报告库（首次调用时创建，相对路径以应用根目录为准）"""
+    global report_store
+    if report_store is None:
+        with _report_store_lock:
+            if report_store is None:
+                report_store = ReportStore(os.path.join(BASE_DIR, REPORT_DB_PATH),
+                                           fsync_policy=REPORT_FSYNC_POLICY)
+    return report_store
+
+def get_report_writer() -> ReportWriter:
+    """获取报告后台写入器（首次调用时启动）"""
+    global report_writer
+    if report_writer is None:
+        store = get_report_store()
+        with _report_store_lock:
+            if report_writer is None:
+                report_writer = ReportWriter(
+                    store,
+                    queue_size=REPORT_QUEUE_SIZE,
+                    batch_size=REPORT_BATCH_SIZE,
+                    flush_interval=REPORT_FLUSH_INTERVAL,
+                    enqueue_timeout=REPORT_ENQUEUE_TIMEOUT
+                )
+                # 进程退出前写完队列中的报告
+                atexit.register(report_writer.close)
+    return report_writer
+
+def overloaded_response(error: SchedulerOverloaded):
+    """LLM 调用过载时返回 503，Retry-After 为预计的排队时间"""
+    response = jsonify({'success': False, 'error': str(error), 'overloaded': True})
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response, 503
+
+def conflict_response(error: SessionConflict):
+    """服务器上的会话缺失或不一致时返回 409，客户端重新发送完整内容"""
+    return jsonify({'success': False, 'error': str(error), 'session_conflict': True}), 409
+
+def cancelled_response():
+    """客户端已断开，响应不会被读取，只用于记录指标和日志（499：客户端关闭请求）"""
+    return jsonify({'success': False, 'error': '请求已取消', 'cancelled': True}), 499
+
+# 不创建 trace 的路由（静态文件、Prometheus 抓取）
+UNTRACED_ENDPOINTS = frozenset({'static', 'prometheus_metrics'})
+
+@app.before_request
+def start_request_metrics():
+    """开始记录请求耗时和各阶段指标"""
+    g.request_started = time.perf_counter()
+    g.metrics_token = metrics.begin_request()
+    # 根 span 使用浏览器传入的请求 ID 作为 trace id，在 teardown 时结束；静态文件和指标抓取不追踪
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.trace_scope = tracing.start_span(
+            f'{request.method} {route}',
+            trace_id=tracing.normalize_trace_id(request.headers.get('X-Request-ID')),
+            **{'http.method': request.method, 'http.route': route}
+        )
+        g.trace_span = g.trace_scope.__enter__()
+    # API 的 POST 请求可被取消：客户端断开时取消仍在排队或执行中的 LLM/ASR 调用
+    if request.method == 'POST' and request.path.startswith('/api/'):
+        token = CancelToken()
+        g.cancel_scope = use_token(token)
+        g.cancel_scope.__enter__()
+        g.unwatch_disconnect = watch_disconnect(request.environ, token)
+
+@app.after_request
+def finish_request_metrics(response):
+    """记录 HTTP 指标，并为 API 请求输出一行 JSON 日志"""
+    started = g.get('request_started')
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    metrics.HTTP_LATENCY.observe(duration, method=request.method, route=route)
+    span = g.get('trace_span')
+    if span is not None:
+        span.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Request-ID'] = span.trace_id
+    if REQUEST_LOG_ENABLED and request.path.startswith('/api/'):
+        print(json.dumps({
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'request_id': span.trace_id if span is not None else None,
+            'method': request.method,
+            'route': route,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'stages': metrics.current_stages()
+        }, ensure_ascii=False), flush=True)
+    return response
+
+# 在指标记录之后注册，after_request 逆序执行，指标中记录的是 304 等最终状态码
+http_cache = HttpCache(app, compress=COMPRESS_ENABLED, min_size=COMPRESS_MIN_SIZE, level=COMPRESS_LEVEL)
+
+@app.teardown_request
+def end_request_metrics(exc):
+    unwatch = g.pop('unwatch_disconnect', None)
+    if unwatch is not None:
+        unwatch()
+    cancel_scope = g.pop('cancel_scope', None)
+    if cancel_scope is not None:
+        cancel_scope.__exit__(None, None, None)
+    scope = g.pop('trace_scope', None)
+    if scope is not None:
+        if exc is not None:
+            g.trace_span.status = 'ERROR'
+        scope.__exit__(None, None, None)
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.end_request(token)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/traces/slowest', methods=['GET'])
+def slowest_traces():
+    """最近请求中最慢的几个及其火焰图式耗时分解"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return jsonify({
+        'success': True,
+        'data': tracing.tracer.slowest(limit)
+    })
+
 @app.route('/')
 def index():
     """主页面"""
@@ -63,7 +328,11 @@ def health():
         'template_folder': app.template_folder,
         'static_folder': app.static_folder,
         'template_exists': os.path.exists(os.path.join(app.template_folder, 'index.html')),
-        'cwd': os.getcwd()
+        'cwd': os.getcwd(),
+        'llm_scheduler': llm_client.scheduler_stats(),
+        'llm_credentials': llm_client.credential_stats(),
+        'sessions': session_store.stats(),
+        'report_writer': report_writer.stats() if report_writer is not None else None
     })
 
 @app.errorhandler(404)
@@ -76,8 +345,12 @@ def not_found(error):
             '/',
             '/api/generate-soap',
             '/api/recommend-examinations',
+            '/api/speculate-examinations',
             '/api/check-drug-conflicts',
-            '/api/save-report'
+            '/api/save-report',
+            '/api/reports',
+            '/api/search',
+            '/api/traces/slowest'
         ]
     }), 404
 
@@ -90,19 +363,48 @@ def generate_soap():
             return jsonify({'error': 'AI 组件未初始化，请检查 API Key 配置'}), 500
         
         data = request.json
-        consultation_transcript = data.get('transcript', '')
-        patient_info = data.get('patient_info', {})
+        session = consultation_session(data)
         
-        if not consultation_transcript:
+        if not session.transcript:
             return jsonify({'error': '问诊记录不能为空'}), 400
         
-        # 生成 SOAP 病历
-        soap_data = soap_generator.generate_soap(consultation_transcript, patient_info)
+        # 生成期间其他请求可能更新会话，病历对应的是此时的问诊记录
+        transcript = session.transcript
+        previous = session.soap_data
+        base = session.soap_transcript
+        soap_data = None
+        incremental = False
+        if previous and 'error' not in previous and base is not None and not data.get('fresh'):
+            if transcript == base:
+                # 问诊记录没有变化，直接返回已有病历
+                metrics.record_cache_hit('soap', 'session')
+                soap_data = previous
+            elif transcript.startswith(base):
+                # 问诊记录只是追加了内容，用新增部分增量更新
+                soap_data = soap_generator.update_soap(previous, transcript[len(base):])
+                incremental = soap_data is not None
+        if soap_data is None:
+            soap_data = soap_generator.generate_soap(transcript, session.patient_info)
+        
+        if soap_data is not previous:
+            # 生成失败的病历不作为下次增量更新的基础；诊断或计划变化时依赖它们的阶段结果随之作废
+            session = save_soap(session, soap_data, None if 'error' in soap_data else transcript)
+        # 会话中仍保留（诊断、计划和患者信息都未变）的检查推荐和药物检查结果不需要重新计算
+        rerun = {stage: not session.stage_result(stage) for stage in STAGES}
         
         return jsonify({
             'success': True,
-            'data': soap_data
+            'data': soap_data,
+            'soap_id': session.soap_id,
+            'incremental': incremental,
+            'rerun': rerun
         })
+    except SessionConflict as e:
+        return conflict_response(e)
+    except SchedulerOverloaded as e:
+        return overloaded_response(e)
+    except RequestCancelled:
+        return cancelled_response()
     except Exception as e:
         return jsonify({
             'success': False,
@@ -118,19 +420,86 @@ def recommend_examinations():
             return jsonify({'error': 'AI 组件未初始化，请检查 API Key 配置'}), 500
         
         data = request.json
-        soap_data = data.get('soap_data', {})
-        consultation_transcript = data.get('transcript', '')
+        session = consultation_session(data)
+        soap_data, current_soap_id = session.soap_data, session.soap_id
         
         if not soap_data:
             return jsonify({'error': 'SOAP 数据不能为空'}), 400
         
-        # 推荐检查项目
-        examinations = exam_recommender.recommend_examinations(soap_data, consultation_transcript)
+        # 诊断和计划未变化时，会话中已有的推荐仍然有效
+        examinations = session.stage_result('examinations')
+        if examinations and not data.get('fresh'):
+            metrics.record_cache_hit('exams', 'session')
+            return jsonify({
+                'success': True,
+                'data': examinations,
+                'provisional': False,
+                'similarity': None
+            })
+        
+        # 问诊过程中推测执行的结果，诊断一致时先作为临时结果返回，前端随后取回完整推荐
+        if speculative_recommender is not None and not data.get('fresh'):
+            examinations = speculative_recommender.take(
+                data.get('consultation_id'), soap_data, session.transcript
+            )
+            if examinations is not None:
+                metrics.record_cache_hit('exams', 'speculative')
+                return jsonify({
+                    'success': True,
+                    'data': examinations,
+                    'provisional': True,
+                    'similarity': None,
+                    'source': 'speculative'
+                })
+        
+        # 推荐检查项目（相似病例可能先返回临时结果）
+        result = exam_recommender.recommend_with_cache(
+            soap_data,
+            session.transcript,
+            patient_info=session.patient_info,
+            fresh=bool(data.get('fresh'))
+        )
+        # 临时结果（含模型调用失败时只有基础检查的结果）不保存，之后的请求重新计算
+        if not result['provisional']:
+            save_stage_result(session, 'examinations', result['examinations'], current_soap_id)
         
         return jsonify({
             'success': True,
-            'data': examinations
+            'data': result['examinations'],
+            'provisional': result['provisional'],
+            'similarity': result['similarity'],
+            'source': result['source']
         })
+    except SessionConflict as e:
+        return conflict_response(e)
+    except SchedulerOverloaded as e:
+        return overloaded_response(e)
+    except RequestCancelled:
+        return cancelled_response()
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/speculate-examinations', methods=['POST'])
+def speculate_examinations():
+    """问诊进行中提交当前问诊记录，后台推测检查项目"""
+    try:
+        init_components()
+        if speculative_recommender is None:
+            return jsonify({'success': False, 'error': '推测执行未启用'}), 404
+        
+        data = request.json
+        consultation_id = data.get('consultation_id')
+        if not consultation_id:
+            return jsonify({'error': 'consultation_id 不能为空'}), 400
+        
+        session = consultation_session(data)
+        speculative_recommender.submit(consultation_id, session.transcript, session.patient_info)
+        return jsonify({'success': True, 'accepted': True}), 202
+    except SessionConflict as e:
+        return conflict_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -146,16 +515,36 @@ def check_drug_conflicts():
             return jsonify({'error': 'AI 组件未初始化，请检查 API Key 配置'}), 500
         
         data = request.json
-        plan_text = data.get('plan_text', '')
-        patient_info = data.get('patient_info', {})
+        session = consultation_session(data)
+        current_soap_id = session.soap_id
+        plan_text = data.get('plan_text') or session.soap_data.get('plan', '')
+        patient_info = session.patient_info
         
         if not plan_text:
             return jsonify({'error': '治疗计划不能为空'}), 400
         
-        # 提取药物
+        # 治疗计划和患者信息未变化时，会话中已有的检查结果仍然有效
+        drug_check = session.stage_result('drug_check')
+        if drug_check and not data.get('plan_text') and not data.get('fresh'):
+            metrics.record_cache_hit('drug_check', 'session')
+            check_results = {k: v for k, v in drug_check.items() if k != 'prescribed_drugs'}
+            return jsonify({
+                'success': True,
+                'data': check_results,
+                'prescribed_drugs': drug_check.get('prescribed_drugs', [])
+            })
+        
+        # 提取药物；提取失败不能当作"没有药物"，也不保存到会话
         prescribed_drugs = drug_checker.extract_drugs_from_plan(plan_text)
+        if prescribed_drugs is None:
+            return jsonify({'success': False, 'error': '提取治疗计划中的药物失败，请重试'}), 502
         
         if not prescribed_drugs:
+            save_stage_result(session, 'drug_check', {
+                'prescribed_drugs': [],
+                'has_conflicts': False,
+                'message': '未在治疗计划中发现药物'
+            }, current_soap_id)
             return jsonify({
                 'success': True,
                 'data': {
@@ -180,12 +569,22 @@ def check_drug_conflicts():
             current_medications=current_meds if current_meds else None,
             medical_history=patient_info.get('medical_history')
         )
+        # 检查失败的结果只返回给本次请求，重试时重新检查
+        if 'error' not in check_results:
+            save_stage_result(session, 'drug_check', dict({'prescribed_drugs': prescribed_drugs}, **check_results),
+                              current_soap_id)
         
         return jsonify({
             'success': True,
             'data': check_results,
             'prescribed_drugs': prescribed_drugs
         })
+    except SessionConflict as e:
+        return conflict_response(e)
+    except SchedulerOverloaded as e:
+        return overloaded_response(e)
+    except RequestCancelled:
+        return cancelled_response()
     except Exception as e:
         return jsonify({
             'success': False,
@@ -198,25 +597,116 @@ def save_report():
     try:
         data = request.json
         report_content = data.get('content', '')
+        # 检查推荐和药物检查结果未随请求发送时使用会话中保存的
+        session = consultation_session(data)
         
-        if not report_content:
+        if not report_content and not session.soap_data:
             return jsonify({'error': '报告内容不能为空'}), 400
         
-        # 确保输出目录存在
-        os.makedirs('output', exist_ok=True)
-        
-        # 保存文件
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"ehr_report_{timestamp}.txt"
-        filepath = os.path.join('output', filename)
+        # 等待所在批次提交后再确认，工作进程退出或重启不会丢失已确认的报告
+        report_id = get_report_writer().submit({
+            'content': report_content,
+            'patient_info': session.patient_info,
+            'transcript': session.transcript,
+            'soap_data': session.soap_data,
+            'examinations': data.get('examinations') or session.stage_result('examinations'),
+            'drug_check': usable_drug_check(data.get('drug_check')) or session.stage_result('drug_check')
+        }, wait=True)
+        # 报告已保存，问诊结束（之后再次保存时客户端会重新发送完整内容）
+        end_consultation(data.get('consultation_id'))
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(report_content)
+        return jsonify({
+            'success': True,
+            'report_id': report_id
+        })
+    except SessionConflict as e:
+        return conflict_response(e)
+    except ReportQueueFull as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.headers['Retry-After'] = str(int(e.retry_after))
+        return response, 503
+    except ReportWriteFailed as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/end-consultation', methods=['POST'])
+def end_consultation_route():
+    """医生清空问诊或开始新的问诊时释放服务器上的会话"""
+    data = request.json or {}
+    consultation_id = data.get('consultation_id')
+    if not consultation_id:
+        return jsonify({'error': 'consultation_id 不能为空'}), 400
+    end_consultation(consultation_id)
+    return jsonify({'success': True})
+
+@app.route('/api/reports', methods=['GET'])
+def list_reports():
+    """分页查询报告"""
+    try:
+        result = get_report_store().query(
+            patient=request.args.get('patient'),
+            diagnosis=request.args.get('diagnosis'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 20, type=int)
+        )
+        return jsonify({
+            'success': True,
+            'data': result['items'],
+            'next_cursor': result['next_cursor']
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'查询参数错误: {e}'}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/search', methods=['GET'])
+def search_reports():
+    """全文检索报告"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': '检索词不能为空'}), 400
         
+        result = get_report_store().search(
+            query,
+            limit=request.args.get('limit', 20, type=int),
+            offset=request.args.get('offset', 0, type=int)
+        )
+        return jsonify({
+            'success': True,
+            'data': result['items'],
+            'next_offset': result['next_offset']
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/reports/<report_id>', methods=['GET'])
+def get_report(report_id):
+    """获取单份报告"""
+    try:
+        report = get_report_store().get(report_id)
+        if report is None:
+            # 可能仍在写入队列中
+            pending = get_report_writer().get_pending(report_id)
+            if pending is not None:
+                report = {k: v for k, v in pending.items() if k != 'patient_key'}
+        if report is None:
+            return jsonify({'success': False, 'error': '报告不存在'}), 404
         return jsonify({
             'success': True,
-            'filename': filename,
-            'filepath': filepath
+            'data': report
         })
     except Exception as e:
         return jsonify({
@@ -317,7 +807,7 @@ if __name__ == '__main__':
     print("=" * 60)
     
     try:
-        app.run(debug=True, host='0.0.0.0', port=port, use_reloader=False)
+        app.run(debug=FLASK_DEBUG, host='0.0.0.0', port=port, use_reloader=False)
     except OSError as e:
         if "Address already in use" in str(e):
             print(f"\n❌ 错误: 端口 {port} 已被占用")
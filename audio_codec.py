@@ -0,0 +1,140 @@
+"""
+音频编解码模块
+支持 WAV/FLAC/Opus 的流式编码与分块解码（依赖可选的 soundfile 库）
+"""
+import os
+from typing import Iterator, Optional, Tuple
+
+from lazy_import import lazy_import
+
+try:
+    np = lazy_import("numpy")
+    sf = lazy_import("soundfile")
+except ImportError:  # 可选依赖，未安装时仅支持 WAV
+    np = None
+    sf = None
+
+# 存储格式 -> (soundfile 容器格式, 编码子类型, 文件扩展名)
+STORAGE_FORMATS = {
+    'wav': ('WAV', 'PCM_16', '.wav'),
+    'flac': ('FLAC', 'PCM_16', '.flac'),
+    'opus': ('OGG', 'OPUS', '.opus'),
+}
+
+# speech_recognition.AudioFile 可直接读取的格式
+NATIVE_EXTENSIONS = {'.wav', '.aif', '.aiff', '.aifc', '.flac'}
+
+
+def is_available() -> bool:
+    """是否可以使用压缩格式"""
+    return sf is not None
+
+
+def resolve_format(storage_format: str) -> str:
+    """
+    校验存储格式，压缩格式不可用时回退到 WAV
+
+    Args:
+        storage_format: wav / flac / opus
+
+    Returns:
+        实际使用的存储格式
+    """
+    storage_format = (storage_format or 'wav').lower()
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"不支持的录音存储格式: {storage_format}")
+    if storage_format != 'wav' and sf is None:
+        print(f"⚠️  未安装 soundfile，录音将以 WAV 格式保存（请求格式: {storage_format}）")
+        return 'wav'
+    return storage_format
+
+
+def with_extension(filepath: str, storage_format: str) -> str:
+    """将文件扩展名替换为存储格式对应的扩展名"""
+    return os.path.splitext(filepath)[0] + STORAGE_FORMATS[storage_format][2]
+
+
+class StreamEncoder:
+    """流式音频编码器，边录制边写入压缩文件"""
+
+    def __init__(self, filepath: str, sample_rate: int, channels: int = 1, storage_format: str = 'flac'):
+        if sf is None:
+            raise RuntimeError("流式编码需要安装 soundfile")
+        container, subtype, _ = STORAGE_FORMATS[storage_format]
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filepath = filepath
+        self.channels = channels
+        self.frames_written = 0
+        self._file = sf.SoundFile(filepath, mode='w', samplerate=sample_rate,
+                                  channels=channels, format=container, subtype=subtype)
+
+    def write(self, pcm: bytes):
+        """写入一块 16-bit 交错 PCM 数据"""
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels)
+        self._file.write(samples)
+        self.frames_written += len(samples)
+
+    def close(self):
+        """结束编码并关闭文件"""
+        if not self._file.closed:
+            self._file.close()
+
+
+def iter_pcm_blocks(filepath: str, block_frames: int = 16000) -> Tuple[int, Iterator[bytes]]:
+    """
+    分块解码音频文件为 16-bit 单声道 PCM，不一次性载入整个文件
+
+    Args:
+        filepath: 音频文件路径（soundfile 支持的任意格式）
+        block_frames: 每块的帧数
+
+    Returns:
+        (采样率, PCM 字节块迭代器)
+    """
+    if sf is None:
+        raise RuntimeError(f"解码 {os.path.splitext(filepath)[1]} 文件需要安装 soundfile")
+
+    sample_rate = sf.info(filepath).samplerate
+
+    def blocks() -> Iterator[bytes]:
+        for block in sf.blocks(filepath, blocksize=block_frames, dtype='int16', always_2d=True):
+            if block.shape[1] > 1:
+                block = block.mean(axis=1).astype(np.int16)
+            else:
+                block = block[:, 0]
+            yield block.tobytes()
+
+    return sample_rate, blocks()
+
+
+def save_pcm(filepath: str, pcm: bytes, sample_rate: int, channels: int = 1,
+             storage_format: Optional[str] = None) -> str:
+    """
+    将完整的 PCM 数据编码保存
+
+    Args:
+        filepath: 目标路径
+        pcm: 16-bit 交错 PCM 数据
+        sample_rate: 采样率
+        channels: 声道数
+        storage_format: 存储格式，None 时按扩展名推断
+
+    Returns:
+        实际写入的文件路径
+    """
+    if storage_format is None:
+        ext = os.path.splitext(filepath)[1].lower().lstrip('.')
+        storage_format = ext if ext in STORAGE_FORMATS else 'wav'
+    storage_format = resolve_format(storage_format)
+    filepath = with_extension(filepath, storage_format)
+
+    encoder = StreamEncoder(filepath, sample_rate, channels, storage_format)
+    try:
+        encoder.write(pcm)
+    finally:
+        encoder.close()
+    return filepath
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+离线基准测试
+用模拟延迟的本地 LLM 桩和录制好的问诊记录运行 SOAPGenerator、ExaminationRecommender、
+DrugChecker 和 Flask 路由，按并发数和工作进程数扫描，报告 p50/p95/p99 延迟、吞吐和内存，
+并与保存的基线比较，出现回退时以非零状态退出
+基线记录录制时的主机（可用 CPU 数、架构、Python 版本），与本机不同时只报告差异、不判定回退；
+工作进程数超过可用 CPU 的配置受调度争用影响波动大，同样只报告
+
+用法:
+    python benchmark.py                      # 运行并与基线比较
+    python benchmark.py --update-baseline    # 运行并保存为新基线
+    python benchmark.py --scenarios routes --concurrency 1,8 --workers 1,4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 基准测试不写日志和追踪文件，也不启用缓存和推测执行，只测量流水线本身
+os.environ.setdefault("REQUEST_LOG_ENABLED", "false")
+os.environ.setdefault("TRACE_EXPORT_PATH", "")
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+os.environ.setdefault("SPECULATIVE_ENABLED", "false")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_PATH = os.path.join(BASE_DIR, "benchmarks", "fixtures", "transcripts.json")
+BASELINE_PATH = os.path.join(BASE_DIR, "benchmarks", "baseline.json")
+
+SCENARIOS = ("soap", "exams", "drugs", "routes")
+
+# 按提示词中的特征文本识别阶段（推测执行的提示词也包含“推荐必要的检查项目”，需排在前面）
+_STAGE_MARKERS = (
+    ("SOAP格式病历", "soap"),
+    ("仍在进行中的问诊记录", "exams_speculative"),
+    ("推荐必要的检查项目", "exams"),
+    ("提取所有提到的药物名称", "extract_drugs"),
+    ("临床药师", "drug_check"),
+)
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> Dict:
+    """加载问诊记录和各阶段的模拟延迟"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class StubModel:
+    """
+    模拟 genai.GenerativeModel：按阶段的中位延迟（对数正态抖动）休眠后返回录制的 JSON
+
+    根据提示词中出现的问诊内容选择对应的病例，使整条流水线的输入输出保持一致
+    """
+
+    def __init__(self, fixtures: Dict, latency_scale: float = 0.02, seed: int = 0, jitter: float = 0.25):
+        self.cases = fixtures["cases"]
+        self.latency_ms = fixtures["latency_ms"]
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    @staticmethod
+    def _stage(prompt: str) -> str:
+        for marker, stage in _STAGE_MARKERS:
+            if marker in prompt:
+                return stage
+        raise ValueError("无法识别的提示词")
+
+    def _case(self, prompt: str) -> Dict:
+        for case in self.cases:
+            soap = case["soap"]
+            markers = (case["transcript"][:40], soap["chief_complaint"], soap["plan"][:30], ", ".join(case["drugs"]))
+            if any(marker in prompt for marker in markers):
+                return case
+        return self.cases[0]
+
+    def _payload(self, stage: str, case: Dict) -> Dict:
+        if stage == "soap":
+            return case["soap"]
+        if stage == "exams":
+            return {"examinations": case["examinations"]}
+        if stage == "exams_speculative":
+            return {"preliminary_diagnosis": case["soap"]["preliminary_diagnosis"],
+                    "examinations": case["examinations"]}
+        if stage == "extract_drugs":
+            return {"drugs": case["drugs"]}
+        return case["drug_check"]
+
+    def generate_content(self, prompt: str, generation_config=None):
+        stage = self._stage(prompt)
+        text = json.dumps(self._payload(stage, self._case(prompt)), ensure_ascii=False)
+        delay = self.latency_ms[stage] / 1000 * self.latency_scale * self._rng.lognormvariate(0, self.jitter)
+        time.sleep(delay)
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(prompt_token_count=len(prompt) // 2,
+                                           candidates_token_count=len(text) // 2)
+        )
+
+
+def build_context(fixtures: Dict, latency_scale: float, seed: int) -> SimpleNamespace:
+    """创建使用 LLM 桩的各生成器，并注入到 Flask 应用中"""
+    from config import GEMINI_MODEL
+    from soap_generator import SOAPGenerator
+    from examination_recommender import ExaminationRecommender
+    from drug_checker import DrugChecker
+    import app as web
+
+    stub = StubModel(fixtures, latency_scale=latency_scale, seed=seed)
+    soap = SOAPGenerator("benchmark", GEMINI_MODEL)
+    exams = ExaminationRecommender("benchmark", GEMINI_MODEL)
+    drugs = DrugChecker("benchmark", GEMINI_MODEL)
+    for component in (soap, exams, drugs):
+        component.model = stub
+
+    # init_components 只在组件为空时初始化，这里直接替换为使用桩的实例
+    web.soap_generator = soap
+    web.exam_recommender = exams
+    web.drug_checker = drugs
+    return SimpleNamespace(soap=soap, exams=exams, drugs=drugs, client=web.app.test_client())
+
+
+def _split_list(text: Optional[str]) -> Optional[List[str]]:
+    if not text or text == "无":
+        return None
+    return [item.strip() for item in text.split(",")]
+
+
+def run_scenario(name: str, ctx: SimpleNamespace, case: Dict) -> bool:
+    """
+    执行一次场景请求
+
+    Returns:
+        是否成功
+    """
+    patient_info = case["patient_info"]
+    if name == "soap":
+        return "error" not in ctx.soap.generate_soap(case["transcript"], patient_info)
+    if name == "exams":
+        return bool(ctx.exams.recommend_examinations(case["soap"], case["transcript"]))
+    if name == "drugs":
+        prescribed = ctx.drugs.extract_drugs_from_plan(case["soap"]["plan"])
+        if not prescribed:
+            return False
+        result = ctx.drugs.check_drug_conflicts(
+            prescribed_drugs=prescribed,
+            patient_allergies=_split_list(patient_info.get("allergies")),
+            current_medications=_split_list(patient_info.get("current_medications")),
+            medical_history=patient_info.get("medical_history")
+        )
+        return "error" not in result
+    if name == "routes":
+        response = ctx.client.post("/api/generate-soap", json={
+            "transcript": case["transcript"], "patient_info": patient_info
+        })
+        if response.status_code != 200:
+            return False
+        soap_data = response.get_json()["data"]
+        response = ctx.client.post("/api/recommend-examinations", json={
+            "soap_data": soap_data, "transcript": case["transcript"], "patient_info": patient_info
+        })
+        if response.status_code != 200:
+            return False
+        response = ctx.client.post("/api/check-drug-conflicts", json={
+            "plan_text": soap_data.get("plan", ""), "patient_info": patient_info
+        })
+        return response.status_code == 200
+    raise ValueError(f"未知场景: {name}")
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _worker(scenario: str, concurrency: int, requests: int, fixtures: Dict,
+            latency_scale: float, seed: int, results):
+    """工作进程：预热后以固定并发执行 requests 次请求"""
+    ctx = build_context(fixtures, latency_scale, seed)
+    cases = fixtures["cases"]
+    for case in cases:
+        run_scenario(scenario, ctx, case)
+
+    def timed(index: int):
+        started = time.perf_counter()
+        try:
+            ok = run_scenario(scenario, ctx, cases[index % len(cases)])
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    results.put({
+        "latencies": [latency for latency, _ in outcomes],
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "elapsed": elapsed,
+        "peak_rss_mb": _peak_rss_mb(),
+    })
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_benchmark(scenario: str, workers: int, concurrency: int, requests: int,
+                  fixtures: Dict, latency_scale: float, seed: int) -> Dict:
+    """
+    以 workers 个进程、每进程 concurrency 个线程运行一个场景
+
+    Returns:
+        p50/p95/p99 延迟（毫秒）、吞吐（请求/秒）、错误数和峰值内存（MB，各进程中的最大值）
+    """
+    methods = multiprocessing.get_all_start_methods()
+    mp = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    results = mp.Queue()
+    processes = [
+        mp.Process(target=_worker,
+                   args=(scenario, concurrency, requests, fixtures, latency_scale, seed + i, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    outputs = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [latency for output in outputs for latency in output["latencies"]]
+    return {
+        "requests": len(latencies),
+        "errors": sum(output["errors"] for output in outputs),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "rps": round(sum(len(o["latencies"]) / o["elapsed"] for o in outputs), 2),
+        "peak_rss_mb": round(max(output["peak_rss_mb"] for output in outputs), 1),
+    }
+
+
+def compare_to_baseline(results: Dict, baseline: Dict, tolerance: float, memory_tolerance: float) -> List[str]:
+    """
+    与基线比较
+
+    Returns:
+        回退说明列表，为空表示没有回退
+    """
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if current["errors"] > base.get("errors", 0):
+            regressions.append(f"{key}: 错误数 {base.get('errors', 0)} -> {current['errors']}")
+        for metric in ("p95_ms", "p99_ms"):
+            if current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{key}: {metric} {base[metric]} -> {current[metric]}")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{key}: rps {base['rps']} -> {current['rps']}")
+        if base["peak_rss_mb"] and current["peak_rss_mb"] > base["peak_rss_mb"] * (1 + memory_tolerance):
+            regressions.append(f"{key}: peak_rss_mb {base['peak_rss_mb']} -> {current['peak_rss_mb']}")
+    return regressions
+
+
+# 基线与本次运行需一致才判定回退的主机信息
+HOST_KEYS = ("cpus", "machine", "python")
+
+
+def available_cpus() -> int:
+    """当前进程可用的 CPU 数（容器或 taskset 限制时小于物理核数）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS、Windows 上没有 sched_getaffinity
+        return os.cpu_count() or 1
+
+
+def _print_lines(title: str, lines: List[str]):
+    print(f"\n{title}")
+    for line in lines:
+        print(f"   {line}")
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(item) for item in text.split(",") if item.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EHR Agent 离线基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16], help="每个进程的并发线程数列表")
+    parser.add_argument("--workers", type=_int_list, default=[1, 2], help="工作进程数列表")
+    parser.add_argument("--requests", type=int, default=64, help="每个进程执行的请求数")
+    parser.add_argument("--latency-scale", type=float, default=0.02,
+                        help="模拟 LLM 延迟的缩放系数（1 为真实延迟）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="延迟和吞吐允许的回退比例")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="内存允许的增长比例")
+    parser.add_argument("--output", help="将本次结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    fixtures = load_fixtures()
+    # 在父进程中预先导入，fork 出的工作进程无需重复导入
+    build_context(fixtures, args.latency_scale, args.seed)
+
+    meta = {
+        "latency_scale": args.latency_scale,
+        "requests_per_worker": args.requests,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": available_cpus(),
+    }
+    print("=" * 86)
+    print(f"EHR Agent 基准测试（模拟延迟缩放 {args.latency_scale}，每进程 {args.requests} 次请求）")
+    print("=" * 86)
+    print(f"{'场景':<10}{'进程':>6}{'并发':>6}{'p50(ms)':>12}{'p95(ms)':>12}{'p99(ms)':>12}"
+          f"{'rps':>10}{'错误':>6}{'内存(MB)':>12}")
+
+    results = {}
+    # 工作进程数超过可用 CPU 的配置
+    oversubscribed = set()
+    for scenario in scenarios:
+        for workers in args.workers:
+            for concurrency in args.concurrency:
+                result = run_benchmark(scenario, workers, concurrency, args.requests,
+                                       fixtures, args.latency_scale, args.seed)
+                key = f"{scenario}/w{workers}/c{concurrency}"
+                results[key] = result
+                if workers > meta["cpus"]:
+                    oversubscribed.add(key)
+                print(f"{scenario:<10}{workers:>6}{concurrency:>6}{result['p50_ms']:>12}{result['p95_ms']:>12}"
+                      f"{result['p99_ms']:>12}{result['rps']:>10}{result['errors']:>6}{result['peak_rss_mb']:>12}")
+
+    report = {"meta": meta, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n✅ 基线已保存: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\n⚠️  基线不存在: {args.baseline}（使用 --update-baseline 创建）")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    base_meta = baseline.get("meta", {})
+    if (base_meta.get("latency_scale") != args.latency_scale
+            or base_meta.get("requests_per_worker") != args.requests):
+        print("\n⚠️  本次参数与基线不同，跳过比较")
+        return 0
+
+    base_results = baseline.get("results", {})
+    host_changes = [f"{key} {base_meta.get(key, '未记录')} -> {meta[key]}"
+                    for key in HOST_KEYS if base_meta.get(key) != meta[key]]
+    if host_changes:
+        # 延迟和吞吐的绝对值取决于主机，换了主机的比较没有意义
+        differences = compare_to_baseline(results, base_results, args.tolerance, args.memory_tolerance)
+        print(f"\n⚠️  基线录制于不同的主机（{', '.join(host_changes)}），只报告差异、不判定回退"
+              f"（在本机用 --update-baseline 重新录制基线）")
+        if differences:
+            _print_lines("⚠️  与基线的差异:", differences)
+        return 0
+
+    checked = {key: result for key, result in results.items() if key not in oversubscribed}
+    regressions = compare_to_baseline(checked, base_results, args.tolerance, args.memory_tolerance)
+    differences = compare_to_baseline({key: results[key] for key in oversubscribed}, base_results,
+                                      args.tolerance, args.memory_tolerance)
+    if differences:
+        _print_lines(f"⚠️  工作进程数超过可用 CPU（{meta['cpus']}）的配置波动大，只报告、不判定回退:",
+                     differences)
+    if regressions:
+        _print_lines("❌ 性能回退:", regressions)
+        return 1
+    print("\n✅ 与基线相比没有回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+取消传播模块
+浏览器中止请求或离开页面时，服务器检测到连接断开，取消该请求仍在排队或执行中的 LLM/ASR 调用：
+- CancelToken 随上下文（contextvars）传递，调度器排队、请求合并等待、模型调用都会检查
+- DisconnectMonitor 在后台线程中轮询请求的 socket，对端关闭时取消对应的 token
+- 模型调用在后台事件循环中以异步任务执行，取消 token 时取消任务（即取消上游请求）
+"""
+import asyncio
+import contextvars
+import select
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+_current_token: contextvars.ContextVar[Optional['CancelToken']] = contextvars.ContextVar(
+    'cancel_token', default=None
+)
+
+
+class RequestCancelled(Exception):
+    """等待结果的客户端已离开，调用被取消"""
+
+
+class CancelToken:
+    """取消标记，可注册取消时执行的回调"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = 'cancelled'):
+        """取消，并依次执行已注册的回调（只执行一次）"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️  取消回调失败: {e}")
+
+    def add_callback(self, callback: Callable[[], None]):
+        """注册回调，已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+
+def current_token() -> Optional[CancelToken]:
+    """当前上下文的取消标记，不在可取消的请求中时为 None"""
+    return _current_token.get()
+
+
+@contextmanager
+def use_token(token: Optional[CancelToken]):
+    """在该上下文内的调用使用指定的取消标记"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def check_cancelled():
+    """当前上下文已取消时抛出 RequestCancelled"""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def wait_event(event: threading.Event, timeout: Optional[float] = None) -> bool:
+    """
+    等待事件，期间当前上下文被取消时抛出 RequestCancelled
+
+    取消通过 token 回调唤醒等待（回调会 set 该事件），因此 event 只能由一个等待方使用，
+    其他线程通过各自的状态区分真正的完成与取消
+
+    Returns:
+        事件是否已发生（False 表示超时）
+    """
+    token = _current_token.get()
+    if token is None:
+        return event.wait(timeout)
+    token.add_callback(event.set)
+    try:
+        happened = event.wait(timeout)
+    finally:
+        token.remove_callback(event.set)
+    token.raise_if_cancelled()
+    return happened
+
+
+def wait_future(future: Future):
+    """等待 Future 的结果，当前上下文被取消时取消 Future 并抛出 RequestCancelled"""
+    token = _current_token.get()
+    if token is None:
+        return future.result()
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+    try:
+        wait_event(done)
+    except RequestCancelled:
+        future.cancel()
+        raise
+    return future.result()
+
+
+def submit(executor, fn: Callable, *args, **kwargs) -> Future:
+    """提交到线程池，任务中沿用当前上下文（包括取消标记）"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class _AsyncRunner:
+    """在后台线程中运行事件循环，供同步代码执行可取消的协程"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # 首次使用时创建（gunicorn 预加载后 fork 的工作进程各自创建）
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='cancellable-async', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coroutine):
+        """执行协程并等待结果，当前上下文被取消时取消协程"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+        return wait_future(future)
+
+
+_runner = _AsyncRunner()
+
+
+def run_coroutine(coroutine):
+    """在后台事件循环中执行协程，当前上下文被取消时取消该协程并抛出 RequestCancelled"""
+    token = _current_token.get()
+    if token is not None and token.cancelled:
+        coroutine.close()
+        token.raise_if_cancelled()
+    return _runner.run(coroutine)
+
+
+def _peer_closed(sock: socket.socket) -> bool:
+    """对端是否已关闭连接（只窥视数据，不消费）"""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+class DisconnectMonitor:
+    """轮询请求连接，客户端断开时取消对应的 token"""
+
+    def __init__(self, interval: float = 0.25):
+        """
+        Args:
+            interval: 检查间隔（秒）
+        """
+        self.interval = interval
+        self._watched: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, sock: socket.socket, token: CancelToken) -> Callable[[], None]:
+        """
+        开始监视连接
+
+        Returns:
+            停止监视的函数（请求结束时调用）
+        """
+        key = id(token)
+        with self._lock:
+            self._watched[key] = (sock, token)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='disconnect-monitor', daemon=True)
+                self._thread.start()
+
+        def unwatch():
+            with self._lock:
+                self._watched.pop(key, None)
+        return unwatch
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            if not watched:
+                continue
+            try:
+                readable, _, errored = select.select([s for _, (s, _) in watched], [], [s for _, (s, _) in watched], 0)
+            except (OSError, ValueError):
+                # 某个 socket 已关闭，逐个检查
+                readable, errored = [s for _, (s, _) in watched], []
+            suspects = set(readable) | set(errored)
+            for key, (sock, token) in watched:
+                if sock in suspects and _peer_closed(sock):
+                    with self._lock:
+                        self._watched.pop(key, None)
+                    token.cancel('client disconnected')
+
+
+_monitor = DisconnectMonitor()
+
+
+def request_socket(environ: Dict) -> Optional[socket.socket]:
+    """WSGI 环境中的客户端连接（gunicorn 和 werkzeug 开发服务器会提供）"""
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    return sock if isinstance(sock, socket.socket) else None
+
+
+def watch_disconnect(environ: Dict, token: CancelToken) -> Callable[[], None]:
+    """客户端断开时取消 token，返回停止监视的函数；无法获取连接时不监视"""
+    sock = request_socket(environ)
+    if sock is None:
+        return lambda: None
+    return _monitor.watch(sock, token)
@@ -0,0 +1,99 @@
+"""
+紧凑输出格式
+模型输出的 token 数决定了生成耗时，提示词要求模型使用短键名和枚举代码输出 JSON，
+返回后在本地展开为原有的字段名和中文取值（format_soap_text、format_recommendations、
+format_check_results 及前端使用的结构不变）。模型仍返回完整键名时原样接受；
+检查项目和药物冲突检查结果展开后构造为 models 中的结果模型，由模型统一校验
+"""
+from typing import Dict, List
+
+from models import DrugCheckResult, Examination
+
+SOAP_KEYS = {
+    'cc': 'chief_complaint',
+    's': 'subjective',
+    'o': 'objective',
+    'a': 'assessment',
+    'p': 'plan',
+    'dx': 'preliminary_diagnosis',
+}
+
+EXAM_KEYS = {'n': 'name', 't': 'type', 'r': 'reason', 'p': 'priority'}
+EXAM_TYPES = {'R': '常规', 'B': '生化', 'I': '影像', 'S': '特殊'}
+
+DRUG_CHECK_KEYS = {
+    'c': 'has_conflicts',
+    'al': 'allergy_warnings',
+    'ix': 'drug_interactions',
+    'ci': 'contraindications',
+    'dw': 'dosage_warnings',
+    'rec': 'recommendations',
+    'sv': 'severity',
+}
+INTERACTION_KEYS = {'d': 'drugs', 'x': 'description'}
+
+LEVELS = {'H': '高', 'M': '中', 'L': '低', 'N': '无'}
+
+# 提示词中的格式说明
+SOAP_FORMAT = """只返回一个JSON对象，使用以下短键名：
+cc=主诉（简要）, s=主观资料, o=客观资料, a=评估, p=计划, dx=初步诊断（字符串列表）"""
+
+EXAM_ITEM_FORMAT = """n=检查名称, t=类型代码（R常规/B生化/I影像/S特殊）, r=推荐理由（不超过20字）, p=优先级代码（H高/M中/L低）"""
+
+DRUG_CHECK_FORMAT = """只返回一个JSON对象，使用以下短键名：
+c=是否存在冲突（0或1）, al=过敏警告列表, ix=药物相互作用列表（每项 d=药物对, x=说明）,
+ci=禁忌症列表, dw=剂量警告列表, rec=建议列表, sv=总体严重程度代码（H高/M中/L低/N无）；
+每条内容不超过30字，没有的项目返回空列表"""
+
+
+def _rename(data: Dict, keys: Dict[str, str]) -> Dict:
+    """短键名换成完整键名，未知的键原样保留"""
+    return {keys.get(k, k): v for k, v in data.items()}
+
+
+def _level(code) -> str:
+    return LEVELS.get(code, code) if isinstance(code, str) else code
+
+
+def expand_soap(data: Dict) -> Dict:
+    """展开 SOAP 病历（也用于增量更新中只含部分字段的修改），不是 JSON 对象时原样返回，由 SOAPNote 报错"""
+    if not isinstance(data, dict):
+        return data
+    soap = _rename(data, SOAP_KEYS)
+    diagnosis = soap.get('preliminary_diagnosis')
+    if isinstance(diagnosis, str):
+        soap['preliminary_diagnosis'] = [diagnosis]
+    return soap
+
+
+def expand_examinations(items) -> List[Examination]:
+    """展开检查项目列表，丢弃没有名称的项目"""
+    examinations = []
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        exam = _rename(item, EXAM_KEYS)
+        if isinstance(exam.get('type'), str):
+            exam['type'] = EXAM_TYPES.get(exam['type'], exam['type'])
+        exam['priority'] = _level(exam.get('priority'))
+        examination = Examination.from_dict(exam)
+        if examination is not None:
+            examinations.append(examination)
+    return examinations
+
+
+def expand_drug_check(data: Dict) -> DrugCheckResult:
+    """
+    展开药物冲突检查结果
+
+    Raises:
+        SchemaError: data 不是 JSON 对象
+    """
+    if isinstance(data, dict):
+        data = _rename(data, DRUG_CHECK_KEYS)
+        data['severity'] = _level(data.get('severity', '无'))
+        data['drug_interactions'] = [
+            _rename(item, INTERACTION_KEYS) if isinstance(item, dict) else item
+            for item in data.get('drug_interactions') or []
+        ]
+    return DrugCheckResult.from_dict(data)
@@ -8,8 +8,72 @@ load_dotenv()
 
 # Google API配置（用于 Gemini AI 和语音识别）
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
+# 多个 Key 分担 LLM 调用（逗号分隔，"项目名:Key" 表示所属项目，同一项目的 Key 共享配额）
+GOOGLE_API_KEYS = [k.strip() for k in os.getenv("GOOGLE_API_KEYS", "").split(",") if k.strip()]
+if not GOOGLE_API_KEY and GOOGLE_API_KEYS:
+    # 语音识别和模型初始化仍使用单个 Key
+    GOOGLE_API_KEY = GOOGLE_API_KEYS[0].rpartition(":")[2]
+LLM_KEY_RPM = int(os.getenv("LLM_KEY_RPM", "0"))  # 每个项目每分钟的请求数配额，0 表示未知
+LLM_KEY_REVOKED_QUARANTINE = float(os.getenv("LLM_KEY_REVOKED_QUARANTINE", "3600"))  # 秒
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")  # 使用 gemini-2.5-flash 或 gemini-2.5-pro
 
+# 检查推荐语义缓存（相似病例先返回历史推荐，后台刷新）
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "5000"))
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "")  # sentence-transformers 模型名，留空使用哈希向量化
+
+# 检查项目目录：常见诊断的基础检查直接给出，模型只补充其他检查；可用 JSON 文件补充或覆盖内置目录
+EXAM_CATALOG_ENABLED = os.getenv("EXAM_CATALOG_ENABLED", "true").lower() == "true"
+EXAM_CATALOG_PATH = os.getenv("EXAM_CATALOG_PATH", "")
+
+# 推测执行：问诊进行中按语句边界提前推荐检查项目
+SPECULATIVE_ENABLED = os.getenv("SPECULATIVE_ENABLED", "true").lower() == "true"
+SPECULATIVE_DEBOUNCE = float(os.getenv("SPECULATIVE_DEBOUNCE", "1.5"))  # 秒
+
+# 服务器端问诊会话：保存问诊记录和各阶段结果，请求只发送增量
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))  # 每个工作进程
+SESSION_MAX_MB = int(os.getenv("SESSION_MAX_MB", "64"))
+# 会话目录：每次更新写入，多个工作进程通过它共享会话（权限 0700，相对路径基于应用目录）；
+# 留空则会话只保存在各工作进程的内存中，此时只能使用单个工作进程，否则请求会因会话缺失返回 409 并重新发送完整内容
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.join("output", "sessions"))
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "12"))  # 会话目录中超过该时间未更新的会话被删除
+
+# 每个 API 请求输出一行 JSON 日志（含各阶段耗时与 token 用量）
+REQUEST_LOG_ENABLED = os.getenv("REQUEST_LOG_ENABLED", "true").lower() == "true"
+
+# 请求追踪：span 以 OTLP JSON 写入该文件（留空则不写文件），内存中保留最近的请求
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", os.path.join("output", "traces.jsonl"))
+TRACE_KEEP_RECENT = int(os.getenv("TRACE_KEEP_RECENT", "500"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))  # 导出文件超过该大小时轮转为 .1，0 表示不轮转
+
+# 生产部署（gunicorn.conf.py），留空时按 CPU 核数计算
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY", "")  # 工作进程数
+WEB_THREADS = int(os.getenv("WEB_THREADS", "16"))  # 每个工作进程的线程数，LLM 调用期间线程只在等待网络
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "120"))  # 秒，需大于最慢的 LLM 调用
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "75"))  # 秒，需大于前端负载均衡的空闲超时
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "2000"))  # 处理该数量请求后重启工作进程，0 表示不重启
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"  # 仅用于 python app.py 开发服务器
+
+# 合并相同输入的并发 LLM 调用；锁文件目录（相对路径基于应用目录，权限 0700）用于同一台机器上的
+# 多个工作进程之间合并，留空则只在进程内合并
+LLM_COALESCE_ENABLED = os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "true"
+LLM_COALESCE_DIR = os.getenv("LLM_COALESCE_DIR", os.path.join("output", "singleflight"))
+
+# LLM 调用调度：按优先级（interactive / speculative / batch）排队，低优先级不能占用为 interactive 保留的槽位
+# 并发上限按上游延迟自适应，预计排队超过 LLM_QUEUE_TIMEOUT 时返回 503 + Retry-After
+LLM_ADAPTIVE_CONCURRENCY = os.getenv("LLM_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # 每个工作进程
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "2"))
+LLM_RESERVED_INTERACTIVE = int(os.getenv("LLM_RESERVED_INTERACTIVE", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))  # 秒，0 表示一直等待
+
+# HTTP 响应压缩（brotli 需要安装 brotli 库，否则使用 gzip）
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # 字节
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+
 # 语音识别配置
 MICROPHONE_INDEX = None  # None表示使用默认麦克风
 SAMPLE_RATE = 16000
@@ -17,7 +81,27 @@ CHUNK_SIZE = 1024
 RECORD_TIMEOUT = 1.0  # 秒
 PHRASE_TIMEOUT = 3.0  # 秒
 
+# 语音活动检测（识别前切除静音并按语句并行识别）
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() == "true"
+VAD_USE_MODEL = os.getenv("VAD_USE_MODEL", "false").lower() == "true"  # 需要安装 webrtcvad
+ASR_MAX_WORKERS = int(os.getenv("ASR_MAX_WORKERS", "4"))
+
+# 长音频分段转录
+LONG_AUDIO_CHUNK_SECONDS = float(os.getenv("LONG_AUDIO_CHUNK_SECONDS", "20"))
+LONG_AUDIO_MAX_CHUNK_SECONDS = float(os.getenv("LONG_AUDIO_MAX_CHUNK_SECONDS", "45"))
+
+# 录音存储格式：wav / flac / opus（压缩格式需要安装 soundfile）
+RECORDING_FORMAT = os.getenv("RECORDING_FORMAT", "wav")
+
 # 文件路径
 RECORDINGS_DIR = "recordings"
 OUTPUT_DIR = "output"
+REPORT_DB_PATH = os.getenv("REPORT_DB_PATH", os.path.join(OUTPUT_DIR, "reports.db"))
+
+# 报告异步写入
+REPORT_FSYNC_POLICY = os.getenv("REPORT_FSYNC_POLICY", "always")  # always / normal / off
+REPORT_QUEUE_SIZE = int(os.getenv("REPORT_QUEUE_SIZE", "1000"))
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "64"))
+REPORT_FLUSH_INTERVAL = float(os.getenv("REPORT_FLUSH_INTERVAL", "0.05"))  # 秒
+REPORT_ENQUEUE_TIMEOUT = float(os.getenv("REPORT_ENQUEUE_TIMEOUT", "0.5"))  # 秒
 
@@ -0,0 +1,310 @@
+"""
+API Key 池
+多个 API Key（可分属不同项目）分担 LLM 调用，总吞吐量随 Key 数量增加：
+- 按所属项目的剩余配额（每分钟请求数）、平均延迟和进行中的调用数选择 Key
+- 返回 429 / 配额耗尽的项目暂时隔离（指数退避，错误中给出重试时间时优先使用）
+- 返回 403、Key 无效或已泄露的 Key 长时间隔离，其余 Key 继续服务
+"""
+import copy
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+
+from cancellation import RequestCancelled
+from llm_scheduler import SchedulerOverloaded
+from metrics import LLM_KEY_CALLS, LLM_KEY_QUARANTINED
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # 未安装 Google SDK 时只按状态码和错误信息判断
+    google_exceptions = None
+
+# 配额按分钟计算
+_RATE_WINDOW = 60.0
+
+_REVOKED_STATUS = (401, 403)
+_RATE_LIMITED_STATUS = (429,)
+# Key 无效时 API 返回 400（InvalidArgument），只能从错误原因区分
+_REVOKED_REASONS = ('API_KEY_INVALID', 'API_KEY_EXPIRED', 'API_KEY_SERVICE_BLOCKED')
+# 无法识别异常类型和状态码时的后备判断
+_REVOKED_MARKERS = ('permissiondenied', 'permission denied', 'api key not valid', 'api key expired',
+                    'api_key_invalid', 'api key was reported as leaked')
+_RATE_LIMITED_MARKERS = ('resourceexhausted', 'resource exhausted', 'quota exceeded', 'rate limit exceeded',
+                         'too many requests')
+# 按单个 Key 创建客户端依赖 google.generativeai 的内部接口（_ClientManager、模型的 _client），
+# 只在验证过的版本范围内使用，其他版本退回全局配置
+_CLIENT_MANAGER_VERSIONS = ((0, 3), (0, 9))
+# 例如 "Please retry in 37.5s" 或 "retry_delay { seconds: 37 }"
+_RETRY_DELAY = re.compile(r'retry(?:_delay)?\s*(?:in|\{\s*seconds:)\s*([\d.]+)', re.IGNORECASE)
+
+
+class NoCredentialAvailable(SchedulerOverloaded):
+    """所有 Key 都被隔离或所属项目的配额已用完"""
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """
+    判断异常是否与 Key 本身有关
+
+    Returns:
+        'revoked'（Key 无效、无权限或已泄露）、'rate_limited'（配额耗尽）或 None（与 Key 无关）
+    """
+    if isinstance(error, (SchedulerOverloaded, RequestCancelled)):
+        return None
+    status = _status_code(error)
+    if status in _RATE_LIMITED_STATUS:
+        return 'rate_limited'
+    if status in _REVOKED_STATUS:
+        return 'revoked'
+    if google_exceptions is not None and isinstance(error, google_exceptions.GoogleAPICallError):
+        reason = getattr(error, 'reason', None) or ''
+        message = str(error)
+        if reason in _REVOKED_REASONS or any(r in message for r in _REVOKED_REASONS):
+            return 'revoked'
+        # 其他 API 错误（参数错误、服务端错误等）与 Key 无关
+        return None
+    text = f'{type(error).__name__} {error}'.lower()
+    if any(marker in text for marker in _RATE_LIMITED_MARKERS):
+        return 'rate_limited'
+    if any(marker in text for marker in _REVOKED_MARKERS):
+        return 'revoked'
+    return None
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """异常对应的 HTTP 状态码（google.api_core 异常的 code，或 HTTP 客户端异常的 response.status_code）"""
+    if google_exceptions is not None and isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code if isinstance(error.code, int) else None
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_delay(error: BaseException) -> Optional[float]:
+    match = _RETRY_DELAY.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class Credential:
+    """池中的一个 API Key"""
+
+    def __init__(self, api_key: str, project: str):
+        self.api_key = api_key
+        self.project = project
+        # 指标和 /health 中只显示项目名和 Key 末尾 4 位
+        self.label = f'{project}/…{api_key[-4:]}'
+        self.inflight = 0
+        self.latency: Optional[float] = None
+        self.quarantined_until = 0.0
+        self._clients = None
+        self._models: Dict[str, object] = {}
+
+
+class _Project:
+    """同一项目的 Key 共享配额"""
+
+    def __init__(self):
+        self.requests: Deque[float] = deque()
+        self.quarantined_until = 0.0
+        self.backoff = 0.0
+
+
+class CredentialPool:
+    """按健康状况和剩余配额分配 API Key"""
+
+    def __init__(self, entries: List[str], rpm: int = 0, rate_limit_backoff: float = 5.0,
+                 max_backoff: float = 300.0, revoked_quarantine: float = 3600.0):
+        """
+        Args:
+            entries: Key 列表，"项目名:Key" 表示所属项目（同一项目的 Key 共享配额），
+                     只写 Key 时自成一个项目
+            rpm: 每个项目每分钟的请求数配额，0 表示未知（不按配额限制）
+            rate_limit_backoff: 项目首次被限流时的隔离时间（秒），连续限流时翻倍
+            max_backoff: 限流隔离时间的上限（秒）
+            revoked_quarantine: Key 无效或无权限时的隔离时间（秒）
+        """
+        self.credentials: List[Credential] = []
+        for index, entry in enumerate(entries):
+            project, sep, api_key = entry.strip().rpartition(':')
+            if not api_key:
+                continue
+            self.credentials.append(Credential(api_key, project if sep else f'key{index + 1}'))
+        if not self.credentials:
+            raise ValueError("API Key 池为空")
+        self.rpm = rpm
+        self.rate_limit_backoff = rate_limit_backoff
+        self.max_backoff = max_backoff
+        self.revoked_quarantine = revoked_quarantine
+        self._projects: Dict[str, _Project] = {c.project: _Project() for c in self.credentials}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.credentials)
+
+    def _remaining(self, project: _Project, now: float) -> Optional[int]:
+        """项目在当前分钟内的剩余请求数（需持有锁），配额未知时返回 None"""
+        while project.requests and now - project.requests[0] >= _RATE_WINDOW:
+            project.requests.popleft()
+        if not self.rpm:
+            return None
+        return self.rpm - len(project.requests)
+
+    def _available_at(self, credential: Credential, now: float) -> float:
+        """Key 可以再次使用的时间（需持有锁）"""
+        project = self._projects[credential.project]
+        available_at = max(credential.quarantined_until, project.quarantined_until)
+        remaining = self._remaining(project, now)
+        if remaining is not None and remaining <= 0:
+            available_at = max(available_at, project.requests[0] + _RATE_WINDOW)
+        return available_at
+
+    def _cost(self, credential: Credential, now: float, default_latency: float) -> float:
+        """预计代价：平均延迟 × 进行中的调用数，剩余配额越少代价越高"""
+        latency = credential.latency or default_latency
+        remaining = self._remaining(self._projects[credential.project], now)
+        share = 1.0 if remaining is None else max(0.05, remaining / self.rpm)
+        # 少量随机扰动，代价相同时轮流使用
+        return latency * (credential.inflight + 1) / share * random.uniform(1.0, 1.1)
+
+    def acquire(self) -> Credential:
+        """
+        选择一个 Key，调用结束后必须 release
+
+        Raises:
+            NoCredentialAvailable: 没有可用的 Key，retry_after 为最早恢复的时间
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [c for c in self.credentials if self._available_at(c, now) <= now]
+            if not candidates:
+                wait = min(self._available_at(c, now) for c in self.credentials) - now
+                raise NoCredentialAvailable("所有 API Key 均被隔离或配额已用完", max(1.0, wait))
+            known = [c.latency for c in self.credentials if c.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            credential = min(candidates, key=lambda c: self._cost(c, now, default_latency))
+            credential.inflight += 1
+            self._projects[credential.project].requests.append(now)
+            return credential
+
+    def release(self, credential: Credential, latency: Optional[float] = None,
+                error: Optional[BaseException] = None):
+        """
+        记录一次调用的结果
+
+        Args:
+            credential: acquire 返回的 Key
+            latency: 成功时的耗时（秒），被取消时为 None
+            error: 失败时的异常
+        """
+        kind = classify_error(error) if error is not None else None
+        with self._lock:
+            now = time.monotonic()
+            credential.inflight -= 1
+            project = self._projects[credential.project]
+            if error is None and latency is not None:
+                credential.latency = latency if credential.latency is None \
+                    else 0.8 * credential.latency + 0.2 * latency
+                project.backoff = 0.0
+            elif kind == 'revoked':
+                credential.quarantined_until = now + self.revoked_quarantine
+            elif kind == 'rate_limited':
+                project.backoff = min(self.max_backoff, project.backoff * 2 or self.rate_limit_backoff)
+                delay = _retry_delay(error) or project.backoff
+                project.quarantined_until = max(project.quarantined_until, now + delay)
+        if error is None:
+            LLM_KEY_CALLS.inc(credential=credential.label, outcome='ok' if latency is not None else 'cancelled')
+            return
+        LLM_KEY_CALLS.inc(credential=credential.label, outcome=kind or 'error')
+        if kind is not None:
+            LLM_KEY_QUARANTINED.inc(credential=credential.label, reason=kind)
+            target = credential.label if kind == 'revoked' else f'项目 {credential.project}'
+            print(f"⚠️  API Key 已隔离（{target}，{kind}）: {error}")
+
+    @contextmanager
+    def use(self):
+        """在上下文中占用一个 Key，并按调用结果更新其状态"""
+        credential = self.acquire()
+        started = time.monotonic()
+        try:
+            yield credential
+        except RequestCancelled:
+            self.release(credential)
+            raise
+        except BaseException as e:
+            self.release(credential, error=e)
+            raise
+        self.release(credential, latency=time.monotonic() - started)
+
+    def bind(self, model, credential: Credential):
+        """
+        返回使用该 Key 的模型副本（按模型名缓存）
+
+        genai.configure 是进程级的全局设置，这里为每个 Key 单独创建客户端并替换到模型副本上；
+        非 genai 模型（如基准测试中的模拟模型）原样返回
+        """
+        if not hasattr(model, '_client'):
+            return model
+        name = getattr(model, 'model_name', '')
+        with self._lock:
+            bound = credential._models.get(name)
+            if bound is not None:
+                return bound
+            if credential._clients is None:
+                # 创建失败时记为空元组，不再重试
+                credential._clients = _make_clients(credential.api_key) or ()
+            if not credential._clients:
+                return model
+            bound = copy.copy(model)
+            bound._client, bound._async_client = credential._clients
+            credential._models[name] = bound
+            return bound
+
+    def stats(self) -> List[Dict]:
+        """各 Key 的状态（不含 Key 本身）"""
+        with self._lock:
+            now = time.monotonic()
+            stats = []
+            for c in self.credentials:
+                project = self._projects[c.project]
+                stats.append({
+                    'credential': c.label,
+                    'inflight': c.inflight,
+                    'latency': round(c.latency, 3) if c.latency is not None else None,
+                    'remaining': self._remaining(project, now),
+                    'available_in': round(max(0.0, self._available_at(c, now) - now), 1),
+                })
+            return stats
+
+
+def _sdk_version() -> Optional[tuple]:
+    """google.generativeai 的版本号（主、次），未安装或无法解析时返回 None"""
+    try:
+        import google.generativeai as genai
+        major, minor = genai.__version__.split('.')[:2]
+        return int(major), int(minor)
+    except (ImportError, AttributeError, ValueError):
+        return None
+
+
+def _make_clients(api_key: str):
+    """为单个 Key 创建同步和异步客户端，SDK 版本不在验证范围内或创建失败时返回 None"""
+    version = _sdk_version()
+    low, high = _CLIENT_MANAGER_VERSIONS
+    if version is None or not low <= version < high:
+        print(f"⚠️  google.generativeai 版本 {version} 不在已验证的范围内，"
+              f"无法为 API Key 单独创建客户端，使用全局配置")
+        return None
+    try:
+        from google.generativeai import client as genai_client
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        return manager.get_default_client('generative'), manager.get_default_client('generative_async')
+    except Exception as e:
+        print(f"⚠️  无法为 API Key 单独创建客户端，使用全局配置: {e}")
+        return None
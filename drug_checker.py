@@ -1,14 +1,20 @@
 """
 药物冲突检查模块
 """
-import google.generativeai as genai
 from typing import List, Dict, Optional
-import json
+from collections.abc import Mapping
+
+from llm_client import generate_json
+from compact_schema import DRUG_CHECK_FORMAT, expand_drug_check
+from models import DrugCheckResult
+from cancellation import RequestCancelled
+from llm_scheduler import SchedulerOverloaded
 
 class DrugChecker:
     """药物冲突检查器"""
     
     def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
         self.model_name = model
@@ -17,7 +23,7 @@ class DrugChecker:
                             prescribed_drugs: List[str],
                             patient_allergies: Optional[List[str]] = None,
                             current_medications: Optional[List[str]] = None,
-                            medical_history: Optional[str] = None) -> Dict:
+                            medical_history: Optional[str] = None) -> DrugCheckResult:
         """
         检查药物冲突
         
@@ -28,7 +34,7 @@ class DrugChecker:
             medical_history: 患者病史（可选）
             
         Returns:
-            包含冲突检查结果的字典
+            冲突检查结果（失败时 error 为错误信息）
         """
         allergies_text = "无" if not patient_allergies else ", ".join(patient_allergies)
         current_meds_text = "无" if not current_medications else ", ".join(current_medications)
@@ -52,14 +58,7 @@ class DrugChecker:
 4. 药物与疾病冲突：处方药物是否与患者病史冲突
 5. 剂量合理性：药物剂量是否合理
 
-请以JSON格式返回，包含：
-- has_conflicts: 是否存在冲突（布尔值）
-- allergy_warnings: 过敏警告列表
-- drug_interactions: 药物相互作用列表（包含药物对和说明）
-- contraindications: 禁忌症列表
-- dosage_warnings: 剂量警告列表
-- recommendations: 建议列表
-- severity: 总体严重程度（高/中/低/无）
+{DRUG_CHECK_FORMAT}
 """
         
         try:
@@ -74,14 +73,11 @@ class DrugChecker:
                 "response_mime_type": "application/json",
             }
             
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=generation_config
-            )
-            
-            result = json.loads(response.text)
-            return result
+            result = generate_json(self.model, full_prompt, generation_config, stage='drug_check')
+            return expand_drug_check(result)
             
+        except (SchedulerOverloaded, RequestCancelled):
+            raise
         except Exception as e:
             error_msg = str(e)
             if "403" in error_msg or "leaked" in error_msg.lower() or "API key" in error_msg:
@@ -90,18 +86,9 @@ class DrugChecker:
                 print("   获取新 API Key: https://makersuite.google.com/app/apikey")
             else:
                 print(f"药物冲突检查错误: {e}")
-            return {
-                "error": error_msg,
-                "has_conflicts": False,
-                "allergy_warnings": [],
-                "drug_interactions": [],
-                "contraindications": [],
-                "dosage_warnings": [],
-                "recommendations": [],
-                "severity": "未知"
-            }
+            return DrugCheckResult(severity="未知", error=error_msg)
     
-    def extract_drugs_from_plan(self, plan_text: str) -> List[str]:
+    def extract_drugs_from_plan(self, plan_text: str) -> Optional[List[str]]:
         """
         从治疗计划中提取药物名称
         
@@ -109,7 +96,7 @@ class DrugChecker:
             plan_text: 治疗计划文本
             
         Returns:
-            药物名称列表
+            药物名称列表，提取失败时返回None（与"没有药物"的空列表区分）
         """
         prompt = f"""
 请从以下治疗计划中提取所有提到的药物名称。
@@ -117,7 +104,7 @@ class DrugChecker:
 治疗计划：
 {plan_text}
 
-请以JSON格式返回，包含一个drugs数组，每个元素是药物名称。
+请以JSON格式返回：{{"d": [药物名称]}}。
 只提取明确的药物名称，不包括检查项目或其他非药物内容。
 """
         
@@ -133,14 +120,11 @@ class DrugChecker:
                 "response_mime_type": "application/json",
             }
             
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=generation_config
-            )
-            
-            result = json.loads(response.text)
-            return result.get('drugs', [])
+            result = generate_json(self.model, full_prompt, generation_config, stage='extract_drugs')
+            return result.get('d', result.get('drugs', []))
             
+        except (SchedulerOverloaded, RequestCancelled):
+            raise
         except Exception as e:
             error_msg = str(e)
             if "403" in error_msg or "leaked" in error_msg.lower() or "API key" in error_msg:
@@ -148,7 +132,7 @@ class DrugChecker:
                 print("   请检查您的 Google API Key 是否有效，或需要更换新的 API Key")
             else:
                 print(f"提取药物名称错误: {e}")
-            return []
+            return None
     
     def format_check_results(self, check_results: Dict) -> str:
         """
@@ -191,7 +175,7 @@ class DrugChecker:
         if drug_interactions:
             text += "【药物相互作用】\n"
             for interaction in drug_interactions:
-                if isinstance(interaction, dict):
+                if isinstance(interaction, Mapping):
                     drugs = interaction.get('drugs', '未知')
                     description = interaction.get('description', '未提供')
                     text += f"⚠️ {drugs}: {description}\n"
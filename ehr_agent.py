@@ -4,23 +4,23 @@ EHR Agent 主程序
 """
 import os
 import time
-from datetime import datetime
 from typing import Optional, Dict, List
+# rich 保持直接导入：命令行启动后立即用它输出，延迟导入只会推迟而不会省去这部分耗时
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt, Confirm
-from rich.live import Live
-from rich.text import Text
 
 from config import (
-    GOOGLE_API_KEY, GEMINI_MODEL, RECORDINGS_DIR, OUTPUT_DIR,
-    MICROPHONE_INDEX
+    GOOGLE_API_KEY, GEMINI_MODEL, RECORDINGS_DIR, OUTPUT_DIR, REPORT_DB_PATH,
+    MICROPHONE_INDEX, VAD_ENABLED, VAD_USE_MODEL, ASR_MAX_WORKERS,
+    LONG_AUDIO_CHUNK_SECONDS, LONG_AUDIO_MAX_CHUNK_SECONDS, RECORDING_FORMAT
 )
 from voice_recorder import VoiceRecorder
 from speech_to_text import SpeechToText
 from soap_generator import SOAPGenerator
 from examination_recommender import ExaminationRecommender
 from drug_checker import DrugChecker
+from report_store import ReportStore
 
 console = Console()
 
@@ -41,8 +41,15 @@ class EHRAgent:
             console.print("[yellow]警告: API Key 格式可能不正确，请确认您的 API Key 完整有效[/yellow]")
         
         # 初始化组件
-        self.voice_recorder = VoiceRecorder()
-        self.speech_to_text = SpeechToText(google_api_key=GOOGLE_API_KEY)
+        self.voice_recorder = VoiceRecorder(storage_format=RECORDING_FORMAT)
+        self.speech_to_text = SpeechToText(
+            google_api_key=GOOGLE_API_KEY,
+            use_vad=VAD_ENABLED,
+            vad_use_model=VAD_USE_MODEL,
+            max_workers=ASR_MAX_WORKERS,
+            chunk_seconds=LONG_AUDIO_CHUNK_SECONDS,
+            max_chunk_seconds=LONG_AUDIO_MAX_CHUNK_SECONDS
+        )
         self.soap_generator = SOAPGenerator(GOOGLE_API_KEY, GEMINI_MODEL)
         self.exam_recommender = ExaminationRecommender(GOOGLE_API_KEY, GEMINI_MODEL)
         self.drug_checker = DrugChecker(GOOGLE_API_KEY, GEMINI_MODEL)
@@ -51,6 +58,8 @@ class EHRAgent:
         self.consultation_transcript = ""
         self.patient_info = {}
         self.soap_data = {}
+        self.examinations = None
+        self.drug_check_results = None
         
         # 创建输出目录
         os.makedirs(RECORDINGS_DIR, exist_ok=True)
@@ -142,6 +151,8 @@ class EHRAgent:
             self.consultation_transcript
         )
         
+        self.examinations = examinations
+        
         # 显示推荐
         exam_text = self.exam_recommender.format_recommendations(examinations)
         console.print(Panel(exam_text, title="检查项目推荐", border_style="green"))
@@ -156,8 +167,14 @@ class EHRAgent:
         plan_text = self.soap_data.get('plan', '')
         prescribed_drugs = self.drug_checker.extract_drugs_from_plan(plan_text)
         
+        if prescribed_drugs is None:
+            console.print("[red]提取治疗计划中的药物失败，未完成药物冲突检查[/red]")
+            self.drug_check_results = {}
+            return {}
+        
         if not prescribed_drugs:
             console.print("[yellow]未在治疗计划中发现药物，跳过药物冲突检查[/yellow]")
+            self.drug_check_results = {}
             return {}
         
         console.print(f"[dim]检测到药物: {', '.join(prescribed_drugs)}[/dim]")
@@ -179,6 +196,9 @@ class EHRAgent:
             medical_history=self.patient_info.get('medical_history')
         )
         
+        check_results = dict(check_results, prescribed_drugs=prescribed_drugs)
+        self.drug_check_results = check_results
+        
         # 显示结果
         check_text = self.drug_checker.format_check_results(check_results)
         console.print(Panel(check_text, title="药物冲突检查", border_style="yellow"))
@@ -186,58 +206,49 @@ class EHRAgent:
         return check_results
     
     def save_results(self):
-        """保存所有结果到文件"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"ehr_report_{timestamp}.txt"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write("="*60 + "\n")
-            f.write("EHR Agent 问诊报告\n")
-            f.write("="*60 + "\n\n")
-            
-            # 患者信息
-            f.write("【患者信息】\n")
-            for key, value in self.patient_info.items():
-                f.write(f"{key}: {value}\n")
-            f.write("\n")
-            
-            # 问诊记录
-            f.write("【问诊记录】\n")
-            f.write(self.consultation_transcript + "\n\n")
-            
-            # SOAP病历
-            f.write(self.soap_generator.format_soap_text(self.soap_data))
-            f.write("\n")
-            
-            # 检查推荐
-            examinations = self.exam_recommender.recommend_examinations(
+        """保存所有结果到报告库"""
+        # 未执行过的步骤在保存前补做
+        if self.examinations is None:
+            self.examinations = self.exam_recommender.recommend_examinations(
                 self.soap_data, self.consultation_transcript
             )
-            f.write(self.exam_recommender.format_recommendations(examinations))
-            f.write("\n")
-            
-            # 药物冲突检查
-            plan_text = self.soap_data.get('plan', '')
-            prescribed_drugs = self.drug_checker.extract_drugs_from_plan(plan_text)
-            if prescribed_drugs:
-                allergies = []
-                if self.patient_info.get('allergies') and self.patient_info['allergies'] != '无':
-                    allergies = [a.strip() for a in self.patient_info['allergies'].split(',')]
-                current_meds = []
-                if self.patient_info.get('current_medications') and self.patient_info['current_medications'] != '无':
-                    current_meds = [m.strip() for m in self.patient_info['current_medications'].split(',')]
-                
-                check_results = self.drug_checker.check_drug_conflicts(
-                    prescribed_drugs=prescribed_drugs,
-                    patient_allergies=allergies if allergies else None,
-                    current_medications=current_meds if current_meds else None,
-                    medical_history=self.patient_info.get('medical_history')
-                )
-                f.write(self.drug_checker.format_check_results(check_results))
-        
-        console.print(f"\n[green]报告已保存至: {filepath}[/green]")
-        return filepath
+        if self.drug_check_results is None:
+            self.check_drug_conflicts()
+        
+        lines = ["="*60, "EHR Agent 问诊报告", "="*60, ""]
+        
+        # 患者信息
+        lines.append("【患者信息】")
+        for key, value in self.patient_info.items():
+            lines.append(f"{key}: {value}")
+        lines.append("")
+        
+        # 问诊记录
+        lines.append("【问诊记录】")
+        lines.append(self.consultation_transcript + "\n")
+        
+        # SOAP病历
+        lines.append(self.soap_generator.format_soap_text(self.soap_data))
+        
+        # 检查推荐
+        lines.append(self.exam_recommender.format_recommendations(self.examinations))
+        
+        # 药物冲突检查
+        if self.drug_check_results:
+            lines.append(self.drug_checker.format_check_results(self.drug_check_results))
+        
+        store = ReportStore(REPORT_DB_PATH)
+        report_id = store.save({
+            'content': "\n".join(lines),
+            'patient_info': self.patient_info,
+            'transcript': self.consultation_transcript,
+            'soap_data': self.soap_data,
+            'examinations': self.examinations,
+            'drug_check': self.drug_check_results
+        })
+        
+        console.print(f"\n[green]报告已保存: {report_id}（{REPORT_DB_PATH}）[/green]")
+        return report_id
     
     def run(self):
         """运行主流程"""
@@ -0,0 +1,343 @@
+"""
+检查项目目录
+常见诊断的基础检查相对固定（如胸痛：心电图、肌钙蛋白、胸部X线），本地保存标准检查名称、类型和常用优先级，
+以及从归一化诊断名到基础检查的索引：诊断都在索引中时可立即给出基础检查，模型只需补充与病例相关的其他检查，
+补充结果按标准名称与基础检查合并去重
+"""
+import json
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import Examination, normalize_diagnosis
+
+PRIORITY_RANK = {'高': 0, '中': 1, '低': 2}
+
+# 标准检查：名称 -> (类型, 常用优先级, 别名)
+EXAMS: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {
+    '血常规': ('常规', '中', ('全血细胞计数', '血细胞分析', 'cbc')),
+    '尿常规': ('常规', '中', ('尿液分析', '尿液常规')),
+    '便常规': ('常规', '中', ('粪便常规', '大便常规', '便常规+潜血', '粪便潜血')),
+    '肝功能': ('生化', '中', ('肝功', '肝功能检查')),
+    '肾功能': ('生化', '中', ('肾功', '肾功能检查', '血肌酐', '肌酐')),
+    '电解质': ('生化', '中', ('血电解质', '电解质检查')),
+    '空腹血糖': ('生化', '中', ('血糖', '空腹血糖检测')),
+    '糖化血红蛋白': ('生化', '中', ('hba1c',)),
+    '血脂': ('生化', '中', ('血脂四项', '血脂全套', '血脂检查')),
+    '尿酸': ('生化', '中', ('血尿酸',)),
+    '心肌酶谱': ('生化', '中', ('心肌酶', 'ck-mb', '肌酸激酶同工酶')),
+    '肌钙蛋白': ('生化', '高', ('心肌肌钙蛋白', '高敏肌钙蛋白', '肌钙蛋白i', '肌钙蛋白t', 'ctni', 'ctnt', 'hs-ctn')),
+    '脑钠肽': ('生化', '高', ('bnp', 'nt-probnp', 'n末端脑钠肽前体')),
+    'D-二聚体': ('生化', '高', ('d二聚体', 'd-dimer')),
+    'C反应蛋白': ('生化', '中', ('crp', 'c-反应蛋白', '超敏c反应蛋白')),
+    '降钙素原': ('生化', '中', ('pct',)),
+    '血淀粉酶': ('生化', '高', ('淀粉酶', '血清淀粉酶')),
+    '血脂肪酶': ('生化', '高', ('脂肪酶', '血清脂肪酶')),
+    '甲状腺功能': ('生化', '中', ('甲功', '甲状腺功能五项', '甲状腺功能检查')),
+    '凝血功能': ('生化', '中', ('凝血四项', '凝血功能检查')),
+    '血清铁蛋白': ('生化', '中', ('铁蛋白', '铁代谢')),
+    '血气分析': ('生化', '高', ('动脉血气分析', '动脉血气')),
+    '尿微量白蛋白': ('生化', '低', ('尿微量白蛋白/肌酐比值', '尿白蛋白肌酐比')),
+    '胸部X线': ('影像', '中', ('胸片', '胸部x光', '胸部正侧位片', '胸部dr')),
+    '胸部CT': ('影像', '中', ('胸部ct平扫', '肺部ct')),
+    'CT肺动脉造影': ('影像', '高', ('ctpa', '肺动脉cta')),
+    '头颅CT': ('影像', '高', ('头部ct', '颅脑ct', '头颅ct平扫')),
+    '头颅MRI': ('影像', '中', ('头部mri', '颅脑mri', '头颅磁共振')),
+    '腹部超声': ('影像', '中', ('腹部b超', '腹部彩超', '肝胆胰脾超声')),
+    '泌尿系超声': ('影像', '低', ('泌尿系b超', '泌尿系彩超')),
+    '心脏超声': ('影像', '中', ('超声心动图', '心脏彩超')),
+    '甲状腺超声': ('影像', '中', ('甲状腺b超', '甲状腺彩超')),
+    '下肢血管超声': ('影像', '中', ('下肢静脉超声', '下肢血管彩超')),
+    '心电图': ('特殊', '高', ('常规心电图', '12导联心电图', '十二导联心电图', 'ecg', 'ekg')),
+    '动态心电图': ('特殊', '中', ('holter', '24小时动态心电图')),
+    '肺功能': ('特殊', '中', ('肺功能检查', '肺通气功能')),
+    '胃镜': ('特殊', '中', ('电子胃镜', '胃镜检查')),
+    '幽门螺杆菌检测': ('特殊', '中', ('碳13呼气试验', 'c13呼气试验', '13c呼气试验', '碳14呼气试验', 'hp检测')),
+    '尿培养': ('特殊', '中', ('尿培养+药敏', '中段尿培养')),
+    '痰培养': ('特殊', '低', ('痰培养+药敏',)),
+    '眼底检查': ('特殊', '低', ('眼底照相',)),
+}
+
+# 诊断索引：诊断名 -> (别名, 基础检查 [(标准名称, 优先级, 理由)])
+DIAGNOSES: Dict[str, Tuple[Tuple[str, ...], Tuple[Tuple[str, str, str], ...]]] = {
+    '胸痛': (('chest pain',), (
+        ('心电图', '高', '排查急性冠脉综合征'),
+        ('肌钙蛋白', '高', '排查心肌损伤'),
+        ('胸部X线', '中', '排查肺部及纵隔病变'),
+        ('D-二聚体', '中', '排查肺栓塞、主动脉夹层'),
+    )),
+    '冠心病': (('心绞痛', '冠状动脉粥样硬化性心脏病', '急性冠脉综合征', 'coronary artery disease', 'angina'), (
+        ('心电图', '高', '评估心肌缺血'),
+        ('肌钙蛋白', '高', '排查心肌损伤'),
+        ('心肌酶谱', '中', '评估心肌损伤'),
+        ('血脂', '中', '评估动脉粥样硬化危险因素'),
+        ('心脏超声', '中', '评估心脏结构和功能'),
+    )),
+    '心肌梗死': (('心梗', 'myocardial infarction'), (
+        ('心电图', '高', '明确梗死部位和范围'),
+        ('肌钙蛋白', '高', '确认心肌损伤'),
+        ('心肌酶谱', '高', '评估心肌损伤'),
+        ('凝血功能', '高', '再灌注治疗前评估'),
+        ('电解质', '中', '排查电解质紊乱'),
+        ('心脏超声', '中', '评估室壁运动和心功能'),
+    )),
+    '心力衰竭': (('心衰', 'heart failure'), (
+        ('脑钠肽', '高', '诊断和评估心衰严重程度'),
+        ('心脏超声', '高', '评估射血分数和心脏结构'),
+        ('心电图', '高', '排查心律失常和心肌缺血'),
+        ('胸部X线', '中', '评估肺淤血和胸腔积液'),
+        ('肾功能', '中', '评估肾功能，指导用药'),
+        ('电解质', '中', '利尿治疗前后监测'),
+    )),
+    '心房颤动': (('房颤', '心律失常', 'atrial fibrillation', 'arrhythmia'), (
+        ('心电图', '高', '明确心律失常类型'),
+        ('动态心电图', '中', '评估发作频率和心室率'),
+        ('心脏超声', '中', '评估心房大小和心功能'),
+        ('甲状腺功能', '中', '排查甲亢'),
+        ('电解质', '中', '排查电解质紊乱'),
+    )),
+    '高血压': (('hypertension',), (
+        ('心电图', '中', '评估左心室肥厚'),
+        ('肾功能', '中', '评估靶器官损害'),
+        ('电解质', '中', '排查继发性高血压'),
+        ('血脂', '中', '评估心血管危险因素'),
+        ('空腹血糖', '中', '评估心血管危险因素'),
+        ('尿常规', '中', '评估肾脏损害'),
+        ('尿微量白蛋白', '低', '早期肾损害筛查'),
+        ('心脏超声', '低', '评估心脏结构'),
+    )),
+    '糖尿病': (('diabetes',), (
+        ('空腹血糖', '高', '评估血糖水平'),
+        ('糖化血红蛋白', '高', '评估近期血糖控制'),
+        ('血脂', '中', '评估心血管危险因素'),
+        ('肾功能', '中', '评估糖尿病肾病'),
+        ('尿常规', '中', '筛查尿糖、尿蛋白'),
+        ('尿微量白蛋白', '中', '早期糖尿病肾病筛查'),
+        ('眼底检查', '低', '筛查糖尿病视网膜病变'),
+    )),
+    '脑梗死': (('脑卒中', '缺血性卒中', '中风', 'stroke', 'cerebral infarction'), (
+        ('头颅CT', '高', '排除脑出血'),
+        ('空腹血糖', '高', '排除低血糖'),
+        ('凝血功能', '高', '溶栓治疗前评估'),
+        ('心电图', '中', '排查房颤等心源性栓塞'),
+        ('头颅MRI', '中', '明确梗死部位和范围'),
+        ('血脂', '中', '评估危险因素'),
+    )),
+    '肺栓塞': (('pulmonary embolism',), (
+        ('D-二聚体', '高', '排查血栓形成'),
+        ('CT肺动脉造影', '高', '明确诊断'),
+        ('血气分析', '高', '评估低氧血症'),
+        ('心电图', '中', '评估右心负荷'),
+        ('下肢血管超声', '中', '排查深静脉血栓'),
+    )),
+    '上呼吸道感染': (('感冒', '上感', '急性咽炎', 'upper respiratory infection', 'common cold'), (
+        ('血常规', '中', '鉴别细菌或病毒感染'),
+        ('C反应蛋白', '低', '评估炎症程度'),
+    )),
+    '支气管炎': (('急性支气管炎', 'bronchitis'), (
+        ('血常规', '中', '评估感染类型'),
+        ('C反应蛋白', '中', '评估炎症程度'),
+        ('胸部X线', '中', '排除肺炎'),
+    )),
+    '肺炎': (('pneumonia',), (
+        ('胸部X线', '高', '明确肺部病变'),
+        ('血常规', '高', '评估感染程度'),
+        ('C反应蛋白', '高', '评估炎症程度'),
+        ('降钙素原', '中', '鉴别细菌感染，指导抗生素使用'),
+        ('痰培养', '中', '明确病原体'),
+    )),
+    '支气管哮喘': (('哮喘', 'asthma'), (
+        ('肺功能', '高', '明确气流受限及可逆性'),
+        ('血常规', '中', '评估嗜酸性粒细胞'),
+        ('胸部X线', '中', '排除其他肺部疾病'),
+    )),
+    '慢性阻塞性肺疾病': (('慢阻肺', 'copd'), (
+        ('肺功能', '高', '明确诊断和分级'),
+        ('胸部X线', '中', '排除其他肺部疾病'),
+        ('血气分析', '中', '评估呼吸衰竭'),
+        ('血常规', '中', '评估感染'),
+    )),
+    '急性胃肠炎': (('胃肠炎', '腹泻', 'gastroenteritis'), (
+        ('血常规', '高', '评估感染'),
+        ('便常规', '高', '鉴别感染类型'),
+        ('电解质', '中', '评估脱水和电解质紊乱'),
+    )),
+    '胃炎': (('慢性胃炎', '消化性溃疡', '胃溃疡', '十二指肠溃疡', 'gastritis', 'peptic ulcer'), (
+        ('幽门螺杆菌检测', '高', '明确幽门螺杆菌感染'),
+        ('胃镜', '中', '明确黏膜病变'),
+        ('血常规', '中', '排查贫血'),
+        ('便常规', '低', '排查消化道出血'),
+    )),
+    '急性胰腺炎': (('胰腺炎', 'pancreatitis'), (
+        ('血淀粉酶', '高', '诊断胰腺炎'),
+        ('血脂肪酶', '高', '诊断胰腺炎'),
+        ('腹部超声', '高', '排查胆源性病因'),
+        ('血常规', '高', '评估炎症程度'),
+        ('肝功能', '中', '评估胆道梗阻'),
+        ('电解质', '中', '评估电解质和血钙'),
+    )),
+    '胆囊炎': (('胆石症', '胆囊结石', 'cholecystitis'), (
+        ('腹部超声', '高', '明确胆囊病变'),
+        ('血常规', '高', '评估感染'),
+        ('肝功能', '中', '评估胆道梗阻'),
+        ('血淀粉酶', '中', '排除胰腺炎'),
+    )),
+    '尿路感染': (('泌尿系感染', '膀胱炎', '肾盂肾炎', 'urinary tract infection'), (
+        ('尿常规', '高', '明确尿路感染'),
+        ('尿培养', '中', '明确病原体，指导抗生素使用'),
+        ('血常规', '中', '评估全身感染'),
+    )),
+    '甲状腺功能亢进': (('甲亢', 'hyperthyroidism'), (
+        ('甲状腺功能', '高', '明确诊断'),
+        ('甲状腺超声', '中', '评估甲状腺形态'),
+        ('心电图', '中', '排查心动过速、房颤'),
+        ('肝功能', '低', '抗甲状腺药物治疗前评估'),
+    )),
+    '缺铁性贫血': (('iron deficiency anemia',), (
+        ('血常规', '高', '明确贫血程度和类型'),
+        ('血清铁蛋白', '中', '评估铁储备'),
+        ('便常规', '中', '排查消化道出血'),
+    )),
+    '痛风': (('高尿酸血症', 'gout'), (
+        ('尿酸', '高', '评估血尿酸水平'),
+        ('肾功能', '中', '评估肾脏损害'),
+        ('血常规', '低', '评估炎症'),
+    )),
+}
+
+# 诊断名中不改变基础检查的限定词：去掉后与索引中的诊断名相同即视为匹配（如"2型糖尿病"、"高血压2级"）。
+# 只接受这些明确的前后缀，"非心源性胸痛"、"再生障碍性贫血"等不会被较短的诊断名匹配
+DIAGNOSIS_PREFIXES = ('急性', '慢性', '原发性', '1型', '2型', 'type1', 'type2', '轻度', '中度', '重度')
+DIAGNOSIS_SUFFIXES = ('病', '1级', '2级', '3级', '急性发作', '急性加重期', '稳定期')
+
+# 检查名称比较时忽略空白和括号中的说明，如"心电图（ECG）"
+_EXAM_NOISE = re.compile(r'[（(][^）)]*[）)]|\s')
+
+
+def normalize_exam_name(name: str) -> str:
+    """归一化检查名称"""
+    return _EXAM_NOISE.sub('', str(name)).lower()
+
+
+class ExamCatalog:
+    """检查项目目录和诊断索引"""
+
+    def __init__(self, exams: Optional[Dict] = None, diagnoses: Optional[Dict] = None):
+        """
+        Args:
+            exams: 标准检查，格式同 EXAMS，默认使用内置目录
+            diagnoses: 诊断索引，格式同 DIAGNOSES，默认使用内置索引
+        """
+        self.exams = dict(EXAMS if exams is None else exams)
+        self._names: Dict[str, str] = {}
+        for name, (_, _, aliases) in self.exams.items():
+            for alias in (name,) + tuple(aliases):
+                self._names[normalize_exam_name(alias)] = name
+        self._index: Dict[str, Tuple[Tuple[str, str, str], ...]] = {}
+        for diagnosis, (aliases, exams_for) in (DIAGNOSES if diagnoses is None else diagnoses).items():
+            for alias in (diagnosis,) + tuple(aliases):
+                key = normalize_diagnosis(alias)
+                if key:
+                    self._index[key] = tuple(exams_for)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'ExamCatalog':
+        """
+        内置目录，可用 JSON 文件补充或覆盖
+
+        Args:
+            path: JSON 文件路径，格式为
+                  {"exams": {名称: [类型, 优先级, [别名]]}, "diagnoses": {诊断: [[别名], [[检查, 优先级, 理由]]]}}
+
+        Raises:
+            OSError / ValueError: 文件无法读取或格式错误
+        """
+        if not path:
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        exams = dict(EXAMS)
+        for name, (exam_type, priority, aliases) in (data.get('exams') or {}).items():
+            exams[name] = (exam_type, priority, tuple(aliases))
+        diagnoses = dict(DIAGNOSES)
+        for diagnosis, (aliases, exams_for) in (data.get('diagnoses') or {}).items():
+            diagnoses[diagnosis] = (tuple(aliases), tuple(tuple(item) for item in exams_for))
+        return cls(exams, diagnoses)
+
+    def canonical_name(self, name: str) -> Optional[str]:
+        """检查名称对应的标准名称，不在目录中时返回 None"""
+        return self._names.get(normalize_exam_name(name))
+
+    def lookup(self, diagnosis: str) -> Optional[Tuple[Tuple[str, str, str], ...]]:
+        """
+        诊断对应的基础检查：归一化后与索引中的诊断名或别名相同，
+        或去掉 DIAGNOSIS_PREFIXES / DIAGNOSIS_SUFFIXES 中的限定词后相同（如"2型糖尿病"匹配"糖尿病"）
+        """
+        key = normalize_diagnosis(diagnosis)
+        if not key:
+            return None
+        for candidate in self._candidates(key):
+            if candidate in self._index:
+                return self._index[candidate]
+        return None
+
+    @staticmethod
+    def _candidates(key: str) -> List[str]:
+        """原诊断名，以及去掉一个前缀和/或依次去掉后缀（如"高血压病2级"→"高血压病"→"高血压"）后的诊断名"""
+        prefixed = [key] + [key[len(p):] for p in DIAGNOSIS_PREFIXES if key.startswith(p) and len(key) > len(p)]
+        candidates = []
+        for name in prefixed:
+            candidates.append(name)
+            while True:
+                suffix = next((s for s in DIAGNOSIS_SUFFIXES if name.endswith(s) and len(name) > len(s)), None)
+                if suffix is None:
+                    break
+                name = name[:-len(suffix)]
+                candidates.append(name)
+        return candidates
+
+    def baseline(self, diagnoses: Iterable[str]) -> Tuple[List[Examination], bool]:
+        """
+        诊断列表对应的基础检查（多个诊断的检查合并去重，取较高的优先级）
+
+        Returns:
+            (基础检查, 是否所有诊断都在索引中)
+        """
+        exams: Dict[str, Examination] = {}
+        covered = True
+        any_diagnosis = False
+        for diagnosis in diagnoses or []:
+            any_diagnosis = True
+            exams_for = self.lookup(diagnosis)
+            if exams_for is None:
+                covered = False
+                continue
+            for name, priority, reason in exams_for:
+                self._add(exams, Examination(name, self.exams[name][0] if name in self.exams else '',
+                                             reason, priority))
+        return list(exams.values()), covered and any_diagnosis
+
+    def merge(self, baseline: List[Examination], extras: Iterable[Examination]) -> List[Examination]:
+        """
+        基础检查与模型补充的检查合并：名称按目录归一化，重复的检查保留基础检查并取较高的优先级
+
+        Args:
+            baseline: baseline 返回的基础检查
+            extras: 模型推荐的检查
+        """
+        exams: Dict[str, Examination] = {}
+        for exam in baseline:
+            self._add(exams, exam)
+        for exam in extras:
+            name = self.canonical_name(exam.name)
+            if name is not None:
+                exam = Examination(name, self.exams[name][0], exam.reason, exam.priority, exam.provisional)
+            self._add(exams, exam)
+        return list(exams.values())
+
+    def _add(self, exams: Dict[str, Examination], exam: Examination):
+        key = normalize_exam_name(exam.name)
+        existing = exams.get(key)
+        if existing is None:
+            exams[key] = exam
+        elif PRIORITY_RANK.get(exam.priority, 1) < PRIORITY_RANK.get(existing.priority, 1):
+            existing.priority = exam.priority
@@ -1,19 +1,181 @@
 """
 检查项目推荐模块
 """
-import google.generativeai as genai
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+import hashlib
+import threading
+
+from llm_client import generate_json
+from compact_schema import EXAM_ITEM_FORMAT, expand_examinations
+from models import Examination
+from cancellation import RequestCancelled, check_cancelled, submit, use_token, wait_future
+from llm_scheduler import SchedulerOverloaded
+from metrics import record_cache_hit
+import llm_scheduler
 
 class ExaminationRecommender:
     """检查项目推荐器"""
     
-    def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
+    def __init__(self, api_key: str, model: str = "gemini-2.5-flash", semantic_cache=None, catalog=None):
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
         self.model_name = model
+        # 语义相似缓存（可选），命中时先返回临时结果，后台刷新
+        self.semantic_cache = semantic_cache
+        # 检查项目目录（可选），常见诊断的基础检查直接给出，模型只补充其他检查
+        self.catalog = catalog
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="exam-refresh")
+        self._pending: Dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+    
+    @staticmethod
+    def _cache_text(soap_data: Dict, consultation_transcript: str, patient_info: Optional[Dict] = None) -> str:
+        """用于相似度比较的文本：患者背景 + 主诉 + 诊断 + 问诊记录"""
+        patient_info = patient_info or {}
+        diagnosis = soap_data.get('preliminary_diagnosis', [])
+        if isinstance(diagnosis, list):
+            diagnosis = ', '.join(str(d) for d in diagnosis)
+        return "\n".join([
+            f"年龄：{patient_info.get('age', '')} 性别：{patient_info.get('gender', '')}",
+            f"既往史：{patient_info.get('medical_history', '')}",
+            f"主诉：{soap_data.get('chief_complaint', '')}",
+            f"诊断：{diagnosis}",
+            consultation_transcript[:1000],
+        ])
+    
+    def _refresh(self, key: str, text: str, soap_data: Dict, consultation_transcript: str,
+                 priority: str) -> Tuple[List[Examination], bool]:
+        """重新计算推荐并写回缓存（模型调用失败时的基础检查不写入）"""
+        try:
+            with llm_scheduler.priority(priority):
+                examinations, ok = self._recommend(soap_data, consultation_transcript)
+            if ok and examinations and self.semantic_cache is not None:
+                self.semantic_cache.add(text, examinations)
+            return examinations, ok
+        finally:
+            with self._pending_lock:
+                self._pending.pop(key, None)
+    
+    def _background_refresh(self, key: str, text: str, soap_data: Dict, consultation_transcript: str):
+        """后台刷新：沿用提交时的上下文（追踪、指标），但不随发起请求的取消而取消"""
+        with use_token(None):
+            return self._refresh(key, text, soap_data, consultation_transcript, 'batch')
+    
+    def _submit_refresh(self, key: str, text: str, soap_data: Dict, consultation_transcript: str) -> Future:
+        """命中临时结果后在后台以 batch 类别重新计算，同一输入只保留一个计算"""
+        with self._pending_lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = submit(self._refresh_executor, self._background_refresh,
+                                key, text, soap_data, consultation_transcript)
+                self._pending[key] = future
+            return future
+    
+    def _compute(self, key: str, text: str, soap_data: Dict,
+                 consultation_transcript: str) -> Tuple[List[Examination], bool]:
+        """
+        医生等待的计算：在请求线程中以请求的调度类别执行；
+        相同输入已有计算（后台刷新或其他请求）时等待其结果
+
+        Returns:
+            (检查项目, 模型调用是否成功)
+
+        Raises:
+            RequestCancelled: 本请求被取消（只停止等待，其他请求发起的计算继续）
+        """
+        while True:
+            with self._pending_lock:
+                future = self._pending.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    # 标记为运行中，等待方取消时不会取消这个 Future
+                    future.set_running_or_notify_cancel()
+                    self._pending[key] = future
+            if not leader:
+                try:
+                    return wait_future(future)
+                except RequestCancelled:
+                    # 本请求被取消时抛出；发起计算的请求被取消时重新计算
+                    check_cancelled()
+                    continue
+            try:
+                result = self._refresh(key, text, soap_data, consultation_transcript,
+                                       llm_scheduler.current_priority())
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            future.set_result(result)
+            return result
     
-    def recommend_examinations(self, soap_data: Dict, consultation_transcript: str) -> List[Dict]:
+    def recommend_with_cache(self, soap_data: Dict, consultation_transcript: str,
+                             patient_info: Optional[Dict] = None, fresh: bool = False) -> Dict:
+        """
+        带语义缓存的检查项目推荐
+        
+        诊断都在检查项目目录中时立即返回基础检查，相似病例命中缓存时立即返回缓存结果，
+        两者都标记为临时并在后台重新计算；fresh=True 时等待最新结果（如已有后台计算则直接复用）
+        
+        Args:
+            soap_data: SOAP病历数据
+            consultation_transcript: 问诊转录文本
+            patient_info: 患者基本信息（可选）
+            fresh: 是否跳过缓存、等待最新结果
+            
+        Returns:
+            包含 examinations、provisional（是否为临时结果）、similarity（命中相似度）、
+            source（临时结果的来源：catalog / semantic，模型调用失败时只有基础检查为 fallback）的字典
+        """
+        if self.semantic_cache is None and self.catalog is None:
+            return self._final(*self._recommend(soap_data, consultation_transcript))
+        
+        text = self._cache_text(soap_data, consultation_transcript, patient_info)
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        
+        if not fresh and self.catalog is not None:
+            baseline, covered = self.catalog.baseline(soap_data.get('preliminary_diagnosis', []))
+            if covered:
+                record_cache_hit('exams', 'catalog')
+                self._submit_refresh(key, text, soap_data, consultation_transcript)
+                return {
+                    'examinations': self._provisional(baseline),
+                    'provisional': True,
+                    'similarity': None,
+                    'source': 'catalog'
+                }
+        
+        if not fresh and self.semantic_cache is not None:
+            hit = self.semantic_cache.lookup(text)
+            if hit is not None:
+                cached, similarity = hit
+                record_cache_hit('exams', 'semantic')
+                self._submit_refresh(key, text, soap_data, consultation_transcript)
+                return {
+                    'examinations': self._provisional(cached),
+                    'provisional': True,
+                    'similarity': similarity,
+                    'source': 'semantic'
+                }
+        
+        return self._final(*self._compute(key, text, soap_data, consultation_transcript))
+    
+    def _final(self, examinations: List[Examination], ok: bool) -> Dict:
+        """等待模型得到的结果；模型调用失败时的基础检查标记为临时结果，调用方不应保存"""
+        return {
+            'examinations': examinations if ok else self._provisional(examinations),
+            'provisional': not ok,
+            'similarity': None,
+            'source': None if ok else 'fallback'
+        }
+    
+    @staticmethod
+    def _provisional(examinations: List[Examination]) -> List[Examination]:
+        """标记为临时结果的副本（缓存中的对象不修改）"""
+        return [Examination.from_dict(dict(exam, provisional=True)) for exam in examinations]
+    
+    def recommend_examinations(self, soap_data: Dict, consultation_transcript: str) -> List[Examination]:
         """
         根据SOAP病历和问诊记录推荐检查项目
         
@@ -22,8 +184,32 @@ class ExaminationRecommender:
             consultation_transcript: 问诊转录文本
             
         Returns:
-            推荐的检查项目列表，每个项目包含名称、类型、理由
+            推荐的检查项目列表，每个项目包含名称、类型、理由；
+            设置了检查项目目录时，包括诊断对应的基础检查和模型补充的检查（模型调用失败时只有基础检查）
+        """
+        return self._recommend(soap_data, consultation_transcript)[0]
+    
+    def _recommend(self, soap_data: Dict, consultation_transcript: str) -> Tuple[List[Examination], bool]:
+        """
+        推荐检查项目
+
+        Returns:
+            (检查项目, 模型调用是否成功)；失败时检查项目只有目录中的基础检查
         """
+        baseline: List[Examination] = []
+        if self.catalog is not None:
+            baseline, _ = self.catalog.baseline(soap_data.get('preliminary_diagnosis', []))
+        if baseline:
+            # 基础检查不再让模型重复生成，只要求补充，输出更短
+            request_text = f"""以下基础检查已列入推荐，不要重复：{'、'.join(exam.name for exam in baseline)}。
+请只补充针对本病例情况还需要的其他检查项目，没有需要补充的返回空列表。"""
+        else:
+            request_text = """请推荐必要的检查项目，包括：
+1. 常规检查（血常规、尿常规等）
+2. 生化检查（肝肾功能、血糖等）
+3. 影像学检查（X光、CT、MRI、超声等）
+4. 特殊检查（根据病情需要）"""
+        
         prompt = f"""
 你是一位经验丰富的临床医生。请根据以下SOAP病历和问诊记录，推荐必要的检查项目。
 
@@ -35,23 +221,10 @@ SOAP病历摘要：
 问诊记录：
 {consultation_transcript[:1000]}...
 
-请推荐必要的检查项目，包括：
-1. 常规检查（血常规、尿常规等）
-2. 生化检查（肝肾功能、血糖等）
-3. 影像学检查（X光、CT、MRI、超声等）
-4. 特殊检查（根据病情需要）
-
-对于每个推荐的检查项目，请说明：
-- 检查名称
-- 检查类型（常规/生化/影像/特殊）
-- 推荐理由
-- 优先级（高/中/低）
-
-请以JSON格式返回，包含一个examinations数组，每个元素包含：
-- name: 检查名称
-- type: 检查类型
-- reason: 推荐理由
-- priority: 优先级
+{request_text}
+
+只返回一个JSON对象：{{"e": [检查项目]}}，每个检查项目使用以下短键名：
+{EXAM_ITEM_FORMAT}
 """
         
         try:
@@ -66,14 +239,14 @@ SOAP病历摘要：
                 "response_mime_type": "application/json",
             }
             
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=generation_config
-            )
-            
-            result = json.loads(response.text)
-            return result.get('examinations', [])
+            result = generate_json(self.model, full_prompt, generation_config, stage='exams')
+            examinations = expand_examinations(result.get('e', result.get('examinations')))
+            if self.catalog is not None:
+                examinations = self.catalog.merge(baseline, examinations)
+            return examinations, True
             
+        except (SchedulerOverloaded, RequestCancelled):
+            raise
         except Exception as e:
             error_msg = str(e)
             if "403" in error_msg or "leaked" in error_msg.lower() or "API key" in error_msg:
@@ -82,7 +255,66 @@ SOAP病历摘要：
                 print("   获取新 API Key: https://makersuite.google.com/app/apikey")
             else:
                 print(f"推荐检查项目错误: {e}")
-            return []
+            # 模型不可用时至少返回基础检查
+            return baseline, False
+    
+    def recommend_from_partial(self, partial_transcript: str, patient_info: Optional[Dict] = None) -> Dict:
+        """
+        根据尚未结束的问诊记录推测诊断并推荐检查项目（推测执行）
+        
+        Args:
+            partial_transcript: 截至目前的问诊转录文本
+            patient_info: 患者基本信息（可选）
+            
+        Returns:
+            包含 preliminary_diagnosis（推测诊断列表）和 examinations 的字典
+        """
+        patient_info = patient_info or {}
+        prompt = f"""
+你是一位经验丰富的临床医生。以下是一段仍在进行中的问诊记录，请根据目前掌握的信息推测最可能的初步诊断，并推荐必要的检查项目。
+
+患者信息：
+- 年龄：{patient_info.get('age', '未知')}
+- 性别：{patient_info.get('gender', '未知')}
+- 既往史：{patient_info.get('medical_history', '无')}
+
+问诊记录（截至目前）：
+{partial_transcript[-1500:]}
+
+只返回一个JSON对象：{{"dx": [初步诊断], "e": [检查项目]}}，每个检查项目使用以下短键名：
+{EXAM_ITEM_FORMAT}
+"""
+        
+        try:
+            full_prompt = f"""你是一位专业的临床医生，擅长根据病情推荐合适的检查项目。
+
+{prompt}
+
+请确保返回有效的JSON格式。"""
+            
+            generation_config = {
+                "temperature": 0.3,
+                "response_mime_type": "application/json",
+            }
+            
+            result = generate_json(self.model, full_prompt, generation_config, stage='exams_speculative')
+            diagnosis = result.get('dx', result.get('preliminary_diagnosis', []))
+            if isinstance(diagnosis, str):
+                diagnosis = [diagnosis]
+            examinations = expand_examinations(result.get('e', result.get('examinations')))
+            if self.catalog is not None:
+                # 与 recommend_examinations 的结果一致：基础检查在前，名称按目录归一化
+                examinations = self.catalog.merge(self.catalog.baseline(diagnosis)[0], examinations)
+            return {
+                'preliminary_diagnosis': diagnosis,
+                'examinations': examinations
+            }
+            
+        except (SchedulerOverloaded, RequestCancelled):
+            raise
+        except Exception as e:
+            print(f"推测检查项目错误: {e}")
+            return {'preliminary_diagnosis': [], 'examinations': []}
     
     def format_recommendations(self, examinations: List[Dict]) -> str:
         """
@@ -0,0 +1,66 @@
+"""
+gunicorn 生产配置
+gunicorn 启动时会自动读取当前目录下的本文件：
+
+    gunicorn app:app
+
+每次 LLM 调用会占用请求线程数秒，但期间只在等待网络，
+因此使用 gthread 工作进程：进程数按 CPU 核数，每个进程多个线程并发处理问诊。
+应用在主进程中预加载（依赖只导入一次，工作进程通过 fork 共享内存），
+AI 组件在每个工作进程 fork 之后初始化，避免在进程间共享网络连接和后台线程。
+问诊会话通过 SESSION_DIR 在工作进程之间共享；SESSION_DIR 留空时会话只在单个进程的内存中，
+未指定 WEB_CONCURRENCY 时只启动一个工作进程
+"""
+import os
+
+from config import SESSION_DIR, WEB_CONCURRENCY, WEB_THREADS, WEB_TIMEOUT, WEB_KEEPALIVE, WEB_MAX_REQUESTS
+
+
+def _cpu_count() -> int:
+    """容器内可用的 CPU 核数"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = "gthread"
+if WEB_CONCURRENCY:
+    workers = int(WEB_CONCURRENCY)
+else:
+    workers = max(2, _cpu_count()) if SESSION_DIR else 1
+if workers > 1 and not SESSION_DIR:
+    print("⚠️  SESSION_DIR 为空时各工作进程的会话互不可见，请求会频繁重新发送完整内容")
+threads = WEB_THREADS
+
+preload_app = True
+
+timeout = WEB_TIMEOUT
+graceful_timeout = 30
+keepalive = WEB_KEEPALIVE
+
+# 定期重启工作进程以限制内存增长，加抖动避免同时重启
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS // 10
+
+# 心跳文件放在内存文件系统，避免容器磁盘 IO 阻塞导致工作进程被误杀
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def post_worker_init(worker):
+    """工作进程启动后预热 AI 组件，第一个请求无需等待初始化"""
+    import app as ehr_app
+    ehr_app.init_components()
+
+
+def worker_exit(server, worker):
+    """工作进程退出前写完队列中的报告"""
+    import app as ehr_app
+    if ehr_app.report_writer is not None:
+        ehr_app.report_writer.close()
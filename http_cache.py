@@ -0,0 +1,180 @@
+"""
+HTTP 压缩与缓存模块
+- 静态资源 URL 带内容哈希（?v=...），带哈希的请求使用一年期 immutable 缓存
+- GET 响应计算 ETag，客户端缓存未变化时返回 304
+- 超过大小阈值的文本/JSON 响应按 Accept-Encoding 使用 brotli（可选依赖）或 gzip 压缩
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时仅使用 gzip
+    brotli = None
+
+# 值得压缩的内容类型（图片、音频等已压缩格式不再压缩）
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class HttpCache:
+    """为 Flask 应用注册静态资源版本号、ETag 和响应压缩"""
+
+    def __init__(self, app=None, compress: bool = True, min_size: int = 1024,
+                 level: int = 6, static_cache_size: int = 64):
+        """
+        Args:
+            app: Flask 应用（也可稍后调用 init_app）
+            compress: 是否压缩响应
+            min_size: 小于该字节数的响应不压缩
+            level: 动态响应的压缩级别（gzip 1-9，brotli 取 level 对应的 quality）
+            static_cache_size: 缓存的静态资源压缩结果数量
+        """
+        self.compress = compress
+        self.min_size = min_size
+        self.level = level
+        self.static_folder = None
+        self._asset_hashes: Dict[str, Tuple[float, str]] = {}
+        self._compressed: 'OrderedDict[Tuple[str, str, str], bytes]' = OrderedDict()
+        self._static_cache_size = static_cache_size
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        注册到应用。after_request 按注册的逆序执行，
+        应在其他 after_request（如指标记录）之后调用，使它们看到最终的状态码
+        """
+        self.static_folder = app.static_folder
+        app.url_defaults(self._add_static_version)
+        app.after_request(self._process_response)
+
+    def asset_hash(self, filename: str) -> Optional[str]:
+        """静态文件的内容哈希（文件修改后重新计算），文件不存在时返回 None"""
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self._asset_hashes.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        self._asset_hashes[filename] = (mtime, digest)
+        return digest
+
+    def _add_static_version(self, endpoint: str, values: Dict):
+        """url_for('static', filename=...) 自动附加内容哈希"""
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            digest = self.asset_hash(values['filename'])
+            if digest is not None:
+                values['v'] = digest
+
+    def _process_response(self, response):
+        if request.endpoint == 'static':
+            self._set_static_cache_headers(response)
+        elif request.method in ('GET', 'HEAD'):
+            self._make_conditional(response)
+        if self.compress:
+            self._compress(response)
+        return response
+
+    def _set_static_cache_headers(self, response):
+        """带当前内容哈希的 URL 永久缓存，其他情况每次向服务器验证"""
+        filename = request.view_args.get('filename') if request.view_args else None
+        version = request.args.get('v')
+        if version and filename and version == self.asset_hash(filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        else:
+            response.cache_control.no_cache = True
+
+    @staticmethod
+    def _make_conditional(response):
+        """为 GET 响应添加 ETag，If-None-Match 命中时改为 304"""
+        if (response.status_code != 200 or response.is_streamed
+                or response.direct_passthrough or 'ETag' in response.headers):
+            return
+        response.add_etag()
+        # 报告含患者信息，只允许浏览器缓存，每次使用前验证
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+
+    def _choose_encoding(self) -> Optional[str]:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _encode(self, data: bytes, encoding: str, level: int) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(data, quality=min(11, level))
+        return gzip.compress(data, compresslevel=min(9, level), mtime=0)
+
+    def _compress(self, response):
+        """按 Accept-Encoding 压缩响应体"""
+        # send_file 的文件流也算 is_streamed，但长度已知，可以压缩
+        streamed = response.is_streamed and not response.direct_passthrough
+        if (response.status_code != 200 or streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return
+        if response.content_length is not None and response.content_length < self.min_size:
+            return
+        response.vary.add('Accept-Encoding')
+        encoding = self._choose_encoding()
+        if encoding is None:
+            return
+
+        etag, _ = response.get_etag()
+        cache_key = (request.path, etag, encoding) if request.endpoint == 'static' and etag else None
+        compressed = None
+        if cache_key is not None:
+            with self._lock:
+                compressed = self._compressed.get(cache_key)
+                if compressed is not None:
+                    self._compressed.move_to_end(cache_key)
+
+        if compressed is None:
+            # send_file 返回文件流，读入内存后再压缩（静态资源较小，且压缩结果会缓存）
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return
+            # 静态资源只压缩一次，使用最高压缩级别
+            compressed = self._encode(data, encoding, 11 if cache_key is not None else self.level)
+            if cache_key is not None:
+                with self._lock:
+                    self._compressed[cache_key] = compressed
+                    while len(self._compressed) > self._static_cache_size:
+                        self._compressed.popitem(last=False)
+        else:
+            # 命中缓存时不读取文件，直接关闭文件流
+            close = getattr(response.response, 'close', None)
+            if close is not None:
+                close()
+            response.direct_passthrough = False
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        # 压缩后的表示与原始字节不同，改用弱 ETag（If-None-Match 按弱比较仍能命中）
+        if etag:
+            response.set_etag(etag, weak=True)
+
@@ -0,0 +1,47 @@
+"""
+JSON 编解码
+安装了 orjson 时使用 orjson（可选依赖），否则使用标准库 json；
+结果模型（models.py）等带 to_dict 的对象可直接序列化
+"""
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时使用标准库
+    orjson = None
+
+
+def to_jsonable(obj: Any):
+    """序列化时无法直接处理的对象"""
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is not None:
+        return to_dict()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def dumps(obj: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """
+    序列化为 JSON 字符串（非 ASCII 字符不转义）
+
+    Args:
+        obj: 要序列化的对象
+        sort_keys: 是否按键排序
+        default: 无法直接序列化的对象的转换函数，默认使用 to_jsonable
+    """
+    default = default or to_jsonable
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        try:
+            return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            # orjson 不支持的情况（如超过 64 位的整数、非字符串键），交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, default=default)
+
+
+def loads(data) -> Any:
+    """解析 JSON 字符串或字节串"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,38 @@
+"""
+延迟导入
+重量级依赖（pyaudio、speech_recognition 等）在模块导入时只登记，
+第一次访问其属性时才真正执行，缩短 Web 工作进程和命令行的启动时间
+"""
+import importlib.util
+import sys
+import types
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    返回延迟加载的模块
+
+    模块不存在时立即抛出 ImportError（与普通 import 一致），
+    模块代码在第一次访问属性时执行
+
+    Args:
+        name: 模块名
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def is_loaded(name: str) -> bool:
+    """模块是否已真正执行（延迟模块在首次访问前不算已加载）"""
+    module = sys.modules.get(name)
+    return module is not None and type(module) is types.ModuleType
@@ -0,0 +1,139 @@
+"""
+LLM 调用模块
+所有 Gemini 调用的统一入口，负责埋点、追踪、优先级调度、相同请求合并、取消、API Key 分配和 JSON 解析
+"""
+import json
+from typing import Dict, List, Optional
+
+from cancellation import current_token, run_coroutine
+from credential_pool import CredentialPool, NoCredentialAvailable, classify_error
+from metrics import track_stage, record_cache_hit, record_retry
+from llm_scheduler import LLMScheduler
+from singleflight import SingleFlight, make_key
+from tracing import start_span
+
+# 默认只在进程内合并，Web 应用通过 configure_coalescing 启用跨进程合并
+_single_flight: Optional[SingleFlight] = SingleFlight()
+_scheduler = LLMScheduler()
+# 未配置 Key 池时使用各模型自身的（genai.configure 设置的）Key
+_credential_pool: Optional[CredentialPool] = None
+
+
+def configure_coalescing(enabled: bool = True, lock_dir: Optional[str] = None):
+    """
+    配置相同请求合并
+
+    Args:
+        enabled: 是否合并进行中的相同调用
+        lock_dir: 跨进程锁表目录，None 表示只在进程内合并
+    """
+    global _single_flight
+    _single_flight = SingleFlight(lock_dir) if enabled else None
+
+
+def configure_scheduler(max_concurrency: int, reserved_interactive: int, max_queue: int,
+                        adaptive: bool = True, min_concurrency: int = 1,
+                        deadline: Optional[float] = None):
+    """
+    配置 LLM 调用调度器
+
+    Args:
+        max_concurrency: 同时进行的 LLM 调用上限（自适应时为上限的最大值）
+        reserved_interactive: 为 interactive 保留的槽位数
+        max_queue: 排队中的调用总数上限
+        adaptive: 是否根据上游延迟自适应调整并发上限
+        min_concurrency: 自适应时并发上限的最小值
+        deadline: 最长排队时间（秒），预计超过时立即拒绝，None 表示一直等待
+    """
+    global _scheduler
+    _scheduler = LLMScheduler(max_concurrency, reserved_interactive, max_queue,
+                              adaptive=adaptive, min_concurrency=min_concurrency, deadline=deadline)
+
+
+def scheduler_stats():
+    """调度器的并发上限，以及各优先级类别的运行中和排队中调用数"""
+    return _scheduler.stats()
+
+
+def configure_credentials(entries: List[str], rpm: int = 0, revoked_quarantine: float = 3600.0):
+    """
+    配置 API Key 池，调用分散到多个 Key 上
+
+    Args:
+        entries: Key 列表，"项目名:Key" 表示所属项目（同一项目的 Key 共享配额）
+        rpm: 每个项目每分钟的请求数配额，0 表示未知
+        revoked_quarantine: Key 无效或无权限时的隔离时间（秒）
+    """
+    global _credential_pool
+    _credential_pool = CredentialPool(entries, rpm=rpm, revoked_quarantine=revoked_quarantine) if entries else None
+
+
+def credential_stats() -> Optional[List[Dict]]:
+    """各 API Key 的状态，未配置 Key 池时返回 None"""
+    pool = _credential_pool
+    return pool.stats() if pool is not None else None
+
+
+def _generate_content(model, prompt: str, generation_config: Dict):
+    """请求模型；在可取消的上下文中使用异步接口，取消时中止上游请求"""
+    if current_token() is not None and hasattr(model, 'generate_content_async'):
+        return run_coroutine(model.generate_content_async(prompt, generation_config=generation_config))
+    return model.generate_content(prompt, generation_config=generation_config)
+
+
+def _request(model, prompt: str, generation_config: Dict, stage: str):
+    """从 Key 池中选择 Key 请求模型；Key 被限流或失效时换一个 Key 重试"""
+    pool = _credential_pool
+    if pool is None:
+        return _generate_content(model, prompt, generation_config)
+    for attempt in range(pool.size):
+        try:
+            with pool.use() as credential:
+                return _generate_content(pool.bind(model, credential), prompt, generation_config)
+        except NoCredentialAvailable:
+            raise
+        except Exception as e:
+            if classify_error(e) is None or attempt == pool.size - 1:
+                raise
+            record_retry(stage)
+
+
+def generate_json(model, prompt: str, generation_config: Dict, stage: str) -> Dict:
+    """
+    调用模型生成 JSON 并解析
+
+    Args:
+        model: genai.GenerativeModel 实例
+        prompt: 完整提示词
+        generation_config: 生成配置
+        stage: 阶段名（soap / exams / extract_drugs / drug_check 等），用于指标
+
+    Returns:
+        解析后的 JSON 对象
+
+    Raises:
+        调用或解析失败时抛出原异常，由调用方处理；
+        预计排队超过期限、排队超时或被淘汰时抛出 SchedulerOverloaded；
+        等待结果的请求都已取消时抛出 RequestCancelled；
+        配置了 Key 池且没有可用的 Key 时抛出 NoCredentialAvailable（SchedulerOverloaded 的子类）
+    """
+    with start_span(f'llm.{stage}', stage=stage) as span:
+        def call() -> str:
+            # 合并后只有实际请求模型的调用占用槽位
+            with _scheduler.slot(stage=stage), track_stage(stage) as record:
+                response = _request(model, prompt, generation_config, stage)
+                record.record_usage(response)
+            span.set_attribute('llm.input_tokens', record.input_tokens)
+            span.set_attribute('llm.output_tokens', record.output_tokens)
+            return response.text
+
+        single_flight = _single_flight
+        if single_flight is None:
+            return json.loads(call())
+        # 同一输入（双击、多个标签页提交同一问诊）的并发调用只请求一次模型
+        key = make_key(getattr(model, 'model_name', ''), stage, prompt, generation_config)
+        text, shared = single_flight.do(key, call)
+        if shared:
+            span.set_attribute('llm.coalesced', True)
+            record_cache_hit(stage, 'coalesced')
+        return json.loads(text)
@@ -0,0 +1,296 @@
+"""
+LLM 调用调度模块
+所有 LLM 调用在发出前向调度器申请执行槽位，按优先级类别排队：
+- interactive：医生正在等待的请求（默认）
+- speculative：问诊进行中的推测执行
+- batch：后台刷新、批量回填等
+各类别之间按权重公平排队（加权公平队列），低优先级类别不能占用为 interactive 保留的槽位，
+队列满时优先淘汰排队中的低优先级任务
+
+并发上限按上游延迟自适应调整（AIMD）：延迟正常且槽位用满时每轮加一，
+延迟明显高于基线或上游限流/超时时按比例下调。预计排队时间超过期限时立即拒绝，
+由调用方返回 503 + Retry-After，而不是在队列里等到超时。排队期间请求被取消（客户端断开）时立即出队
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from cancellation import RequestCancelled, wait_event
+from metrics import LLM_QUEUE_WAIT, LLM_PREEMPTED, LLM_SHED
+
+PRIORITIES = ('interactive', 'speculative', 'batch')
+DEFAULT_WEIGHTS = {'interactive': 8, 'speculative': 2, 'batch': 1}
+
+_current_priority: ContextVar[str] = ContextVar('llm_priority', default='interactive')
+
+
+class SchedulerOverloaded(Exception):
+    """LLM 调用无法在期限内开始执行"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SchedulerPreempted(SchedulerOverloaded):
+    """排队中的调用被更高优先级的调用淘汰，或队列已满"""
+
+
+# 表示上游过载的异常（google.api_core 的异常类名，或错误信息中的状态码）
+_CONGESTION_NAMES = ('ResourceExhausted', 'DeadlineExceeded', 'ServiceUnavailable', 'TooManyRequests', 'Timeout')
+_CONGESTION_CODES = ('429', '503', '504')
+
+
+def is_congestion_error(error: BaseException) -> bool:
+    """异常是否表示上游过载（而不是请求本身的问题）"""
+    name = type(error).__name__
+    if any(n in name for n in _CONGESTION_NAMES):
+        return True
+    message = str(error)
+    return any(code in message for code in _CONGESTION_CODES)
+
+
+@contextmanager
+def priority(name: str):
+    """在该上下文内发出的 LLM 调用使用指定的优先级类别"""
+    if name not in PRIORITIES:
+        raise ValueError(f"未知的优先级类别: {name}")
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> str:
+    """当前上下文的优先级类别"""
+    return _current_priority.get()
+
+
+class _Waiter:
+    """排队中的一次调用"""
+
+    __slots__ = ('priority', 'event', 'granted', 'preempted')
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.event = threading.Event()
+        self.granted = False
+        self.preempted = False
+
+
+class LLMScheduler:
+    """按优先级类别加权公平排队、并发上限自适应的限制器"""
+
+    def __init__(self, max_concurrency: int = 8, reserved_interactive: int = 2,
+                 max_queue: int = 200, weights: Optional[Dict[str, int]] = None,
+                 adaptive: bool = True, min_concurrency: int = 1,
+                 deadline: Optional[float] = None, latency_tolerance: float = 2.0,
+                 backoff: float = 0.75):
+        """
+        Args:
+            max_concurrency: 同时进行的 LLM 调用上限（自适应时为上限的最大值）
+            reserved_interactive: 为 interactive 保留的槽位数，其他类别最多使用其余槽位
+            max_queue: 排队中的调用总数上限，超出时淘汰排队中优先级最低、最晚加入的调用
+            weights: 各类别的权重，权重越大分到的槽位越多
+            adaptive: 是否根据上游延迟自适应调整并发上限
+            min_concurrency: 自适应时并发上限的最小值
+            deadline: 最长排队时间（秒），预计超过时立即拒绝，None 表示一直等待
+            latency_tolerance: 延迟超过基线的该倍数时视为上游变慢
+            backoff: 上游变慢时并发上限的缩减比例
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = min(max(1, min_concurrency), self.max_concurrency)
+        self.reserved_interactive = max(0, reserved_interactive)
+        self.max_queue = max_queue
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.adaptive = adaptive
+        self.deadline = deadline
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        # 自适应从上限的一半开始探测
+        self._limit = float(max(self.min_concurrency, self.max_concurrency // 2)) if adaptive \
+            else float(self.max_concurrency)
+        # 各阶段的延迟基线（正常样本的指数移动平均）和整体平均执行时间
+        self._baseline: Dict[str, float] = {}
+        self._service_time = 0.0
+        self._last_decrease = 0.0
+        self._queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self._running: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        # 加权公平队列的虚拟时间：每分配一个槽位，该类别前进 1/权重
+        self._pass: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        """当前并发上限"""
+        return int(self._limit)
+
+    def _class_limit(self, priority: str) -> int:
+        """该类别可使用的槽位数，上限很小时仍给低优先级类别留一个槽位"""
+        if priority == 'interactive':
+            return self.limit
+        return max(1, self.limit - self.reserved_interactive)
+
+    def _can_run(self, priority: str) -> bool:
+        total = sum(self._running.values())
+        if total >= self.limit:
+            return False
+        if priority == 'interactive':
+            return True
+        background = total - self._running['interactive']
+        return background < self._class_limit(priority)
+
+    def _estimated_wait(self, priority: str) -> float:
+        """排在前面（同级及更高优先级）的调用执行完所需的大致时间"""
+        rank = PRIORITIES.index(priority)
+        ahead = sum(len(self._queues[p]) for p in PRIORITIES[:rank + 1])
+        return (ahead + 1) * self._service_time / self._class_limit(priority)
+
+    def _grant(self, priority: str):
+        self._running[priority] += 1
+        self._pass[priority] = max(self._pass[priority], self._virtual_time) + 1.0 / self.weights[priority]
+        self._virtual_time = self._pass[priority]
+
+    def _dispatch(self):
+        """把空闲槽位分配给虚拟时间最小、且允许运行的类别的队首（需持有锁）"""
+        while True:
+            candidates = [p for p in PRIORITIES if self._queues[p] and self._can_run(p)]
+            if not candidates:
+                return
+            # 长时间空闲的类别不能积攒额度
+            chosen = min(candidates, key=lambda p: max(self._pass[p], self._virtual_time))
+            waiter = self._queues[chosen].popleft()
+            self._grant(chosen)
+            waiter.granted = True
+            waiter.event.set()
+
+    def _preempt_for(self, priority: str) -> bool:
+        """队列已满时淘汰一个优先级更低的排队调用，返回是否腾出了位置"""
+        rank = PRIORITIES.index(priority)
+        for lower in reversed(PRIORITIES[rank + 1:]):
+            if self._queues[lower]:
+                waiter = self._queues[lower].pop()
+                waiter.preempted = True
+                waiter.event.set()
+                LLM_PREEMPTED.inc(priority=lower)
+                return True
+        return False
+
+    def _acquire(self, priority: str):
+        started = time.perf_counter()
+        with self._lock:
+            queued = sum(len(q) for q in self._queues.values())
+            if queued == 0 and self._can_run(priority):
+                self._grant(priority)
+                LLM_QUEUE_WAIT.observe(0.0, priority=priority)
+                return
+            estimated_wait = self._estimated_wait(priority)
+            if self.deadline is not None and estimated_wait > self.deadline:
+                LLM_SHED.inc(priority=priority)
+                raise SchedulerOverloaded(f"LLM 调用预计排队 {estimated_wait:.0f}s，超过期限", estimated_wait)
+            if queued >= self.max_queue and not self._preempt_for(priority):
+                LLM_PREEMPTED.inc(priority=priority)
+                raise SchedulerPreempted(f"LLM 调用队列已满（{priority}）", estimated_wait)
+            waiter = _Waiter(priority)
+            self._queues[priority].append(waiter)
+            self._dispatch()
+
+        cancelled = None
+        try:
+            wait_event(waiter.event, self.deadline)
+        except RequestCancelled as e:
+            cancelled = e
+        with self._lock:
+            if not waiter.granted and not waiter.preempted:
+                self._queues[priority].remove(waiter)
+                if cancelled is not None:
+                    raise cancelled
+                LLM_SHED.inc(priority=priority)
+                raise SchedulerOverloaded(f"LLM 调用排队超时（{priority}）", self._estimated_wait(priority))
+            if waiter.granted and cancelled is not None:
+                # 取消与分配同时发生，归还刚分配的槽位
+                self._running[priority] -= 1
+                self._dispatch()
+                raise cancelled
+            retry_after = self._estimated_wait(priority)
+        if waiter.preempted:
+            raise SchedulerPreempted(f"排队中的 LLM 调用被更高优先级的调用淘汰（{priority}）", retry_after)
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - started, priority=priority)
+
+    def _adjust(self, stage: str, latency: float, congested: bool, saturated: bool):
+        """根据一次调用的结果调整并发上限（需持有锁）"""
+        self._service_time = latency if not self._service_time else 0.8 * self._service_time + 0.2 * latency
+        baseline = self._baseline.get(stage)
+        slow = baseline is not None and latency > self.latency_tolerance * baseline
+        if baseline is None:
+            self._baseline[stage] = latency
+        elif not congested:
+            # 基线跟随正常样本；慢样本只以很小的权重计入，持续变慢时逐步接受新的延迟水平
+            weight = 0.005 if slow else 0.05
+            self._baseline[stage] = (1 - weight) * baseline + weight * latency
+        if not self.adaptive:
+            return
+        now = time.monotonic()
+        if congested or slow:
+            # 每个往返最多缩减一次，避免同一批慢调用把上限压到最小
+            if now - self._last_decrease > (baseline or latency):
+                self._limit = max(float(self.min_concurrency), self._limit * self.backoff)
+                self._last_decrease = now
+        elif saturated:
+            # 只有槽位用满时才增加，空闲时上限不会无限增长
+            self._limit = min(float(self.max_concurrency), self._limit + 1.0 / self._limit)
+
+    def _release(self, priority: str, stage: str, latency: Optional[float], congested: bool):
+        with self._lock:
+            saturated = sum(self._running.values()) >= self.limit
+            self._running[priority] -= 1
+            # 被取消的调用没有完整的耗时，不参与调整
+            if latency is not None:
+                self._adjust(stage, latency, congested, saturated)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, stage: str = ''):
+        """
+        占用一个执行槽位，并用本次调用的耗时调整并发上限
+
+        Args:
+            priority: 优先级类别，默认使用当前上下文的类别
+            stage: 阶段名，各阶段分别计算延迟基线
+
+        Raises:
+            SchedulerOverloaded: 预计排队时间超过期限，或排队超时
+            SchedulerPreempted: 排队中被淘汰或队列已满
+            RequestCancelled: 排队中请求被取消
+        """
+        priority = priority or current_priority()
+        self._acquire(priority)
+        started = time.monotonic()
+        congested = False
+        cancelled = False
+        try:
+            yield
+        except RequestCancelled:
+            cancelled = True
+            raise
+        except BaseException as e:
+            congested = is_congestion_error(e)
+            raise
+        finally:
+            self._release(priority, stage, None if cancelled else time.monotonic() - started, congested)
+
+    def stats(self) -> Dict:
+        """当前并发上限、平均执行时间，以及各类别的运行中和排队中调用数"""
+        with self._lock:
+            stats = {
+                p: {'running': self._running[p], 'queued': len(self._queues[p])}
+                for p in PRIORITIES
+            }
+            stats['limit'] = self.limit
+            stats['service_time'] = round(self._service_time, 3)
+            return stats
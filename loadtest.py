@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+负载测试
+模拟繁忙门诊，对运行中的 app.py 回放问诊会话：
+/api/generate-soap → /api/recommend-examinations → /api/check-drug-conflicts → /api/save-report，
+步骤之间有医生的思考时间
+
+开环模式（默认）按泊松过程以固定到达率发起会话，延迟从计划发起时间算起，
+服务变慢时不会因为客户端跟着变慢而低估延迟（coordinated omission）；
+闭环模式以固定数量的虚拟用户循环执行会话，用于对比
+
+用法:
+    python loadtest.py --url http://localhost:5000 --rate 2 --duration 120
+    python loadtest.py --mode closed --users 20 --duration 60
+    python loadtest.py --rate 5 --hgrm-dir output/loadtest   # 输出 HDR 百分位分布文件
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_PATH = os.path.join(BASE_DIR, "benchmarks", "fixtures", "transcripts.json")
+
+STEPS = ("generate-soap", "recommend-examinations", "check-drug-conflicts", "save-report")
+
+
+class HdrHistogram:
+    """
+    HDR 直方图：对数-线性分桶，在整个量程内保持固定的有效数字精度
+
+    记录整数值（本工具中为微秒），内存与样本数无关
+    """
+
+    def __init__(self, highest_trackable: int = 3_600_000_000, significant_figures: int = 3):
+        """
+        Args:
+            highest_trackable: 可记录的最大值，超出的值按最大值记录
+            significant_figures: 有效数字位数（1-5）
+        """
+        self.highest_trackable = highest_trackable
+        self.significant_figures = significant_figures
+        largest_single_unit = 2 * 10 ** significant_figures
+        self.sub_bucket_bits = math.ceil(math.log2(largest_single_unit))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self._counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+        self._sum = 0
+        self._sum_squares = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value: int) -> int:
+        bucket = max(0, value.bit_length() - self.sub_bucket_bits)
+        sub_bucket = value >> bucket
+        return bucket * self.sub_bucket_half + sub_bucket
+
+    def _highest_equivalent(self, index: int) -> int:
+        """桶内可区分的最大值"""
+        if index < self.sub_bucket_count:
+            return index
+        bucket = (index - self.sub_bucket_count) // self.sub_bucket_half + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.sub_bucket_half + self.sub_bucket_half
+        return (sub_bucket << bucket) + (1 << bucket) - 1
+
+    def record(self, value: int, count: int = 1):
+        value = max(0, min(int(value), self.highest_trackable))
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] = self._counts.get(index, 0) + count
+            self.total_count += count
+            self.min_value = value if self.min_value is None else min(self.min_value, value)
+            self.max_value = max(self.max_value, value)
+            self._sum += value * count
+            self._sum_squares += value * value * count
+
+    def add(self, other: 'HdrHistogram'):
+        """合并另一个直方图"""
+        with other._lock:
+            counts = dict(other._counts)
+            total, low, high = other.total_count, other.min_value, other.max_value
+            total_sum, total_squares = other._sum, other._sum_squares
+        with self._lock:
+            for index, count in counts.items():
+                self._counts[index] = self._counts.get(index, 0) + count
+            self.total_count += total
+            if low is not None:
+                self.min_value = low if self.min_value is None else min(self.min_value, low)
+            self.max_value = max(self.max_value, high)
+            self._sum += total_sum
+            self._sum_squares += total_squares
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self.total_count if self.total_count else 0.0
+
+    @property
+    def stddev(self) -> float:
+        if not self.total_count:
+            return 0.0
+        variance = self._sum_squares / self.total_count - self.mean ** 2
+        return math.sqrt(max(0.0, variance))
+
+    def value_at_percentile(self, percentile: float) -> int:
+        """百分位对应的值（桶内最大等价值，与 HdrHistogram 一致）"""
+        if not self.total_count:
+            return 0
+        target = max(1, math.ceil(percentile / 100 * self.total_count))
+        seen = 0
+        with self._lock:
+            for index in sorted(self._counts):
+                seen += self._counts[index]
+                if seen >= target:
+                    return min(self._highest_equivalent(index), self.max_value)
+        return self.max_value
+
+    def percentile_distribution(self, scale: float = 1000.0, ticks_per_half_distance: int = 5) -> str:
+        """
+        输出 HdrHistogram 的 .hgrm 百分位分布文本，可直接用 HdrHistogram 绘图工具打开
+
+        Args:
+            scale: 输出值的除数（微秒 / 1000 = 毫秒）
+            ticks_per_half_distance: 每逼近 100% 一半距离输出的行数
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}", ""]
+        with self._lock:
+            items = sorted(self._counts.items())
+        seen = 0
+        percentile_to_report = 0.0
+        for index, count in items:
+            seen += count
+            value = min(self._highest_equivalent(index), self.max_value) / scale
+            reached = seen / self.total_count * 100
+            # 最后一个桶只输出结尾的 100% 行，否则百分位逼近 100% 时不会终止
+            while percentile_to_report <= reached and seen < self.total_count:
+                inverse = 1 / (1 - percentile_to_report / 100)
+                lines.append(f"{value:12.3f} {percentile_to_report / 100:14.12f} {seen:10d} {inverse:14.2f}")
+                half_distance = 2 ** int(math.log2(100 / (100 - percentile_to_report)) + 1)
+                percentile_to_report += 100 / (half_distance * ticks_per_half_distance)
+        if items:
+            lines.append(f"{self.max_value / scale:12.3f} {1.0:14.12f} {self.total_count:10d}")
+        lines.append(f"#[Mean    = {self.mean / scale:12.3f}, StdDeviation   = {self.stddev / scale:12.3f}]")
+        lines.append(f"#[Max     = {self.max_value / scale:12.3f}, Total count    = {self.total_count:12d}]")
+        lines.append(f"#[Buckets = {len(items):12d}, SubBuckets     = {self.sub_bucket_count:12d}]")
+        return "\n".join(lines) + "\n"
+
+
+class StepStats:
+    """单个步骤的统计"""
+
+    def __init__(self):
+        # 从计划发起时间算起（包含客户端排队），用于容量规划
+        self.latency = HdrHistogram()
+        # 从实际发出请求算起，仅服务端耗时
+        self.service = HdrHistogram()
+        self.errors = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def record(self, intended: float, sent: float, finished: float, status: Optional[int]):
+        self.latency.record(int((finished - intended) * 1e6))
+        self.service.record(int((finished - sent) * 1e6))
+        with self._lock:
+            if status == 503:
+                self.rejected += 1
+            elif status is None or status >= 400:
+                self.errors += 1
+
+
+class LoadTest:
+    """问诊会话回放器"""
+
+    def __init__(self, base_url: str, fixtures: Dict, think_time: float, timeout: float, seed: int = 0):
+        """
+        Args:
+            base_url: 应用地址
+            fixtures: 问诊记录（benchmarks/fixtures/transcripts.json）
+            think_time: 步骤之间的平均思考时间（秒，指数分布）
+            timeout: 单个请求的超时时间（秒）
+            seed: 随机种子
+        """
+        self.base_url = base_url.rstrip("/")
+        self.cases = fixtures["cases"]
+        self.think_time = think_time
+        self.timeout = timeout
+        self.stats = {step: StepStats() for step in STEPS}
+        self.sessions_started = 0
+        self.sessions_completed = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _post(self, step: str, payload: Dict) -> Tuple[Optional[int], Dict]:
+        request = urllib.request.Request(
+            f"{self.base_url}/api/{step}",
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json", "X-Request-ID": uuid.uuid4().hex},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+        except (urllib.error.URLError, OSError, ValueError):
+            return None, {}
+
+    def _step(self, step: str, intended: float, payload: Dict) -> Tuple[Optional[int], Dict]:
+        delay = intended - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.monotonic()
+        status, body = self._post(step, payload)
+        self.stats[step].record(intended, sent, time.monotonic(), status)
+        return status, body
+
+    def _think(self) -> float:
+        with self._lock:
+            return self._rng.expovariate(1 / self.think_time) if self.think_time > 0 else 0.0
+
+    def run_session(self, intended_start: float):
+        """
+        执行一次问诊会话，任一步骤失败即结束
+
+        Args:
+            intended_start: 计划发起时间（time.monotonic）
+        """
+        with self._lock:
+            self.sessions_started += 1
+            case = self.cases[self._rng.randrange(len(self.cases))]
+        patient_info = case["patient_info"]
+        transcript = case["transcript"]
+        consultation_id = uuid.uuid4().hex
+
+        status, body = self._step("generate-soap", intended_start, {
+            "transcript": transcript, "patient_info": patient_info
+        })
+        if status != 200:
+            return
+        soap_data = body.get("data", {})
+
+        status, body = self._step("recommend-examinations", time.monotonic() + self._think(), {
+            "soap_data": soap_data, "transcript": transcript,
+            "patient_info": patient_info, "consultation_id": consultation_id
+        })
+        if status != 200:
+            return
+        examinations = body.get("data", [])
+
+        status, body = self._step("check-drug-conflicts", time.monotonic() + self._think(), {
+            "plan_text": soap_data.get("plan", ""), "patient_info": patient_info
+        })
+        if status != 200:
+            return
+        drug_check = body.get("data", {})
+
+        status, _ = self._step("save-report", time.monotonic() + self._think(), {
+            "content": f"{soap_data.get('chief_complaint', '')}\n{soap_data.get('plan', '')}",
+            "patient_info": patient_info, "transcript": transcript, "soap_data": soap_data,
+            "examinations": examinations, "drug_check": drug_check
+        })
+        if status == 200:
+            with self._lock:
+                self.sessions_completed += 1
+
+    def run_open(self, rate: float, duration: float, max_sessions: int):
+        """开环：按泊松到达率发起会话，直到 duration 结束，再等待进行中的会话完成"""
+        started = time.monotonic()
+        arrival = started
+        with ThreadPoolExecutor(max_workers=max_sessions) as executor:
+            while True:
+                arrival += self._rng.expovariate(rate)
+                if arrival - started > duration:
+                    break
+                delay = arrival - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                # 线程池满时会话在队列中等待，等待时间计入第一步的延迟
+                executor.submit(self.run_session, arrival)
+
+    def run_closed(self, users: int, duration: float):
+        """闭环：users 个虚拟用户循环执行会话"""
+        deadline = time.monotonic() + duration
+
+        def user_loop():
+            while time.monotonic() < deadline:
+                self.run_session(time.monotonic())
+
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            for _ in range(users):
+                executor.submit(user_loop)
+
+
+def print_report(test: LoadTest, elapsed: float):
+    """打印各步骤的延迟分布和吞吐"""
+    print("\n" + "=" * 96)
+    print(f"会话: 发起 {test.sessions_started}，完成 {test.sessions_completed}，"
+          f"耗时 {elapsed:.1f}s，完成速率 {test.sessions_completed / elapsed:.2f} 会话/秒")
+    print("=" * 96)
+    print(f"{'步骤':<24}{'请求':>7}{'错误':>6}{'503':>6}{'p50':>9}{'p90':>9}{'p99':>9}"
+          f"{'p99.9':>9}{'max':>9}{'服务p99':>10}  (ms)")
+    overall = HdrHistogram()
+    for step in STEPS:
+        stats = test.stats[step]
+        latency = stats.latency
+        overall.add(latency)
+        values = [latency.value_at_percentile(p) / 1000 for p in (50, 90, 99, 99.9)]
+        print(f"{step:<24}{latency.total_count:>7}{stats.errors:>6}{stats.rejected:>6}"
+              + "".join(f"{v:>9.0f}" for v in values)
+              + f"{latency.max_value / 1000:>9.0f}{stats.service.value_at_percentile(99) / 1000:>10.0f}")
+    values = [overall.value_at_percentile(p) / 1000 for p in (50, 90, 99, 99.9)]
+    print(f"{'全部':<24}{overall.total_count:>7}{'':>12}" + "".join(f"{v:>9.0f}" for v in values)
+          + f"{overall.max_value / 1000:>9.0f}")
+
+
+def write_hgrm(test: LoadTest, directory: str):
+    """每个步骤输出一个 .hgrm 文件（毫秒）"""
+    os.makedirs(directory, exist_ok=True)
+    for step in STEPS:
+        for kind in ("latency", "service"):
+            histogram = getattr(test.stats[step], kind)
+            path = os.path.join(directory, f"{step}.{kind}.hgrm")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(histogram.percentile_distribution())
+    print(f"\n✅ HDR 百分位分布已写入: {directory}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EHR Agent 负载测试")
+    parser.add_argument("--url", default="http://localhost:5000", help="应用地址")
+    parser.add_argument("--mode", choices=("open", "closed"), default="open")
+    parser.add_argument("--rate", type=float, default=1.0, help="开环模式的会话到达率（会话/秒）")
+    parser.add_argument("--users", type=int, default=10, help="闭环模式的虚拟用户数")
+    parser.add_argument("--duration", type=float, default=60.0, help="发起会话的时长（秒）")
+    parser.add_argument("--think-time", type=float, default=3.0, help="步骤之间的平均思考时间（秒）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求的超时时间（秒）")
+    parser.add_argument("--max-sessions", type=int, default=1000, help="开环模式同时进行的会话上限")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hgrm-dir", help="输出 .hgrm 百分位分布文件的目录")
+    args = parser.parse_args()
+
+    with open(FIXTURES_PATH, "r", encoding="utf-8") as f:
+        fixtures = json.load(f)
+    test = LoadTest(args.url, fixtures, think_time=args.think_time, timeout=args.timeout, seed=args.seed)
+
+    if args.mode == "open":
+        print(f"开环负载: {args.rate} 会话/秒，持续 {args.duration}s -> {args.url}")
+    else:
+        print(f"闭环负载: {args.users} 个虚拟用户，持续 {args.duration}s -> {args.url}")
+    started = time.monotonic()
+    try:
+        if args.mode == "open":
+            test.run_open(args.rate, args.duration, args.max_sessions)
+        else:
+            test.run_closed(args.users, args.duration)
+    except KeyboardInterrupt:
+        print("\n⚠️  已中断，输出目前的结果")
+    print_report(test, time.monotonic() - started)
+    if args.hgrm_dir:
+        write_hgrm(test, args.hgrm_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+指标采集模块
+记录各阶段（LLM / 语音识别）的延迟、token 用量、缓存命中、重试和错误，
+以 Prometheus 文本格式导出
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# 延迟直方图的桶边界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+# 当前请求内各阶段的记录，用于每个请求输出一行结构化日志
+_request_stages: ContextVar[Optional[List[Dict]]] = ContextVar('request_stages', default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """计数器"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """直方图"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # key -> [各桶计数..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound:g}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative:g}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {state[-1]:g}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]:g}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]:g}")
+        return lines
+
+
+STAGE_LATENCY = Histogram('ehr_stage_latency_seconds', '各阶段调用耗时', ('stage', 'outcome'))
+STAGE_ERRORS = Counter('ehr_stage_errors_total', '各阶段错误数（按异常类型）', ('stage', 'error'))
+INPUT_TOKENS = Counter('ehr_llm_input_tokens_total', 'LLM 输入 token 数', ('stage',))
+OUTPUT_TOKENS = Counter('ehr_llm_output_tokens_total', 'LLM 输出 token 数', ('stage',))
+CACHE_HITS = Counter('ehr_cache_hits_total', '缓存命中数', ('stage', 'cache'))
+RETRIES = Counter('ehr_retries_total', '重试次数', ('stage',))
+LLM_QUEUE_WAIT = Histogram('ehr_llm_queue_wait_seconds', 'LLM 调用排队等待时间', ('priority',))
+LLM_PREEMPTED = Counter('ehr_llm_preempted_total', '被淘汰的排队中 LLM 调用数', ('priority',))
+LLM_SHED = Counter('ehr_llm_shed_total', '预计排队超过期限而拒绝的 LLM 调用数', ('priority',))
+LLM_KEY_CALLS = Counter('ehr_llm_key_calls_total', '各 API Key 的调用数（按结果）', ('credential', 'outcome'))
+LLM_KEY_QUARANTINED = Counter('ehr_llm_key_quarantined_total', 'API Key 被隔离的次数', ('credential', 'reason'))
+HTTP_REQUESTS = Counter('ehr_http_requests_total', 'HTTP 请求数', ('method', 'route', 'status'))
+HTTP_LATENCY = Histogram('ehr_http_request_duration_seconds', 'HTTP 请求耗时', ('method', 'route'))
+
+_ALL_METRICS = [STAGE_LATENCY, STAGE_ERRORS, INPUT_TOKENS, OUTPUT_TOKENS, CACHE_HITS, RETRIES,
+                LLM_QUEUE_WAIT, LLM_PREEMPTED, LLM_SHED, LLM_KEY_CALLS, LLM_KEY_QUARANTINED,
+                HTTP_REQUESTS, HTTP_LATENCY]
+
+
+class StageRecord:
+    """一次阶段调用的记录"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.outcome = 'ok'
+        self.error: Optional[str] = None
+        self.latency = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def record_usage(self, response):
+        """从 Gemini 响应的 usage_metadata 中读取 token 用量"""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        self.input_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        self.output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        INPUT_TOKENS.inc(self.input_tokens, stage=self.stage)
+        OUTPUT_TOKENS.inc(self.output_tokens, stage=self.stage)
+
+    def to_dict(self) -> Dict:
+        record = {
+            'stage': self.stage,
+            'outcome': self.outcome,
+            'latency_ms': round(self.latency * 1000, 1),
+        }
+        if self.input_tokens or self.output_tokens:
+            record['input_tokens'] = self.input_tokens
+            record['output_tokens'] = self.output_tokens
+        if self.error:
+            record['error'] = self.error
+        return record
+
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    记录一次阶段调用的耗时与结果，异常会记录后继续抛出
+
+    用法:
+        with track_stage('soap') as record:
+            response = model.generate_content(...)
+            record.record_usage(response)
+    """
+    record = StageRecord(stage)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.outcome = 'error'
+        record.error = type(e).__name__
+        STAGE_ERRORS.inc(stage=stage, error=record.error)
+        raise
+    finally:
+        record.latency = time.perf_counter() - started
+        STAGE_LATENCY.observe(record.latency, stage=stage, outcome=record.outcome)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append(record.to_dict())
+
+
+def record_cache_hit(stage: str, cache: str):
+    """记录一次缓存命中"""
+    CACHE_HITS.inc(stage=stage, cache=cache)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append({'stage': stage, 'outcome': 'cache_hit', 'cache': cache})
+
+
+def record_retry(stage: str):
+    """记录一次重试"""
+    RETRIES.inc(stage=stage)
+
+
+def begin_request():
+    """开始收集当前请求的阶段记录"""
+    return _request_stages.set([])
+
+
+def current_stages() -> List[Dict]:
+    """当前请求已记录的阶段"""
+    return list(_request_stages.get() or [])
+
+
+def end_request(token):
+    """结束收集当前请求的阶段记录"""
+    _request_stages.reset(token)
+
+
+def render_prometheus() -> str:
+    """导出 Prometheus 文本格式"""
+    lines = []
+    for metric in _ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,245 @@
+"""
+流水线结果模型
+SOAP 病历、检查项目和药物冲突检查结果在模型输出解析时统一校验和规范化（类型、列表、枚举取值），
+之后以紧凑的 __slots__ 对象在各层之间传递。模型实现只读的 Mapping 接口，
+原有按字典读取（.get、in、dict(...)）的代码无需修改；序列化使用 to_dict 或 json_codec。
+诊断名称的归一化也在这里，推测执行和检查项目目录按同样的规则比较诊断
+"""
+import re
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LEVELS = ('高', '中', '低')
+SEVERITIES = ('高', '中', '低', '无')
+
+
+# 比较诊断时忽略括号中的说明（如"（阵发性）"）、标点和不确定的修饰词
+_DIAGNOSIS_NOISE = re.compile(r'[（(][^）)]*[）)]|[\s,，。;；:：?？()（）]|待查|可能|疑似|考虑')
+
+
+def normalize_diagnosis(diagnosis: str) -> str:
+    """归一化诊断名称"""
+    return _DIAGNOSIS_NOISE.sub('', str(diagnosis)).lower()
+
+
+class SchemaError(ValueError):
+    """模型输出的结构无法解析"""
+
+
+def _text(value) -> str:
+    """字段内容规范化为字符串（模型有时把段落返回为对象或列表）"""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return '\n'.join(f'{k}: {_text(v)}' for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return '\n'.join(_text(v) for v in value)
+    return str(value)
+
+
+def _text_list(value) -> List[str]:
+    if value is None or value == '':
+        return []
+    if isinstance(value, (list, tuple)):
+        return [_text(v) for v in value if v not in (None, '')]
+    return [_text(value)]
+
+
+def _require_mapping(data, name: str):
+    if not isinstance(data, Mapping):
+        raise SchemaError(f"{name} 应为 JSON 对象，实际为 {type(data).__name__}")
+
+
+class _Model(Mapping):
+    """只读 Mapping 接口的基类，值为 None 的可选字段视为不存在"""
+
+    __slots__ = ()
+    # (字段名, 是否可选)
+    _fields: Tuple[Tuple[str, bool], ...] = ()
+
+    def __getitem__(self, key: str):
+        for name, optional in self._fields:
+            if name == key:
+                value = getattr(self, name)
+                if optional and value is None:
+                    break
+                return value
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for name, optional in self._fields:
+            if not optional or getattr(self, name) is not None:
+                yield name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+    def to_dict(self) -> Dict:
+        result = {}
+        for name in self:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = [v.to_dict() if isinstance(v, _Model) else v for v in value]
+            result[name] = value
+        return result
+
+
+class SOAPNote(_Model):
+    """SOAP 病历"""
+
+    __slots__ = ('chief_complaint', 'subjective', 'objective', 'assessment', 'plan',
+                 'preliminary_diagnosis', 'generated_at', 'updated_fields', 'error')
+    _fields = (('chief_complaint', False), ('subjective', False), ('objective', False),
+               ('assessment', False), ('plan', False), ('preliminary_diagnosis', False),
+               ('generated_at', True), ('updated_fields', True), ('error', True))
+
+    def __init__(self, chief_complaint: str = '', subjective: str = '', objective: str = '',
+                 assessment: str = '', plan: str = '', preliminary_diagnosis: Optional[List[str]] = None,
+                 generated_at: Optional[str] = None, updated_fields: Optional[List[str]] = None,
+                 error: Optional[str] = None):
+        self.chief_complaint = chief_complaint
+        self.subjective = subjective
+        self.objective = objective
+        self.assessment = assessment
+        self.plan = plan
+        self.preliminary_diagnosis = preliminary_diagnosis or []
+        self.generated_at = generated_at
+        self.updated_fields = updated_fields
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> 'SOAPNote':
+        """
+        由模型输出（已展开为完整键名）或存储的字典构造
+
+        Raises:
+            SchemaError: data 不是 JSON 对象
+        """
+        _require_mapping(data, 'SOAP 病历')
+        return cls(
+            chief_complaint=_text(data.get('chief_complaint')),
+            subjective=_text(data.get('subjective')),
+            objective=_text(data.get('objective')),
+            assessment=_text(data.get('assessment')),
+            plan=_text(data.get('plan')),
+            preliminary_diagnosis=_text_list(data.get('preliminary_diagnosis')),
+            generated_at=data.get('generated_at'),
+            updated_fields=data.get('updated_fields'),
+            error=data.get('error'),
+        )
+
+    def replace(self, **changes) -> 'SOAPNote':
+        """返回修改了部分字段的副本（字段值按 from_dict 的规则规范化）"""
+        data = self.to_dict()
+        data.update(changes)
+        return SOAPNote.from_dict(data)
+
+
+class Examination(_Model):
+    """推荐的检查项目"""
+
+    __slots__ = ('name', 'type', 'reason', 'priority', 'provisional')
+    _fields = (('name', False), ('type', False), ('reason', False), ('priority', False),
+               ('provisional', True))
+
+    def __init__(self, name: str, type: str = '', reason: str = '', priority: str = '中',
+                 provisional: Optional[bool] = None):
+        self.name = name
+        self.type = type
+        self.reason = reason
+        self.priority = priority
+        self.provisional = provisional
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> Optional['Examination']:
+        """构造检查项目，没有名称的项目返回None；未知的优先级按"中"处理（前端按高/中/低分组展示）"""
+        if not isinstance(data, Mapping):
+            return None
+        name = _text(data.get('name')).strip()
+        if not name:
+            return None
+        priority = _text(data.get('priority')).strip()
+        return cls(
+            name=name,
+            type=_text(data.get('type')),
+            reason=_text(data.get('reason')),
+            priority=priority if priority in LEVELS else '中',
+            provisional=data.get('provisional'),
+        )
+
+    @classmethod
+    def list_from(cls, items) -> List['Examination']:
+        """构造检查项目列表，丢弃无法识别的项目"""
+        if not isinstance(items, (list, tuple)):
+            return []
+        return [exam for exam in (cls.from_dict(item) for item in items) if exam is not None]
+
+
+class DrugInteraction(_Model):
+    """药物相互作用"""
+
+    __slots__ = ('drugs', 'description')
+    _fields = (('drugs', False), ('description', False))
+
+    def __init__(self, drugs: str, description: str = ''):
+        self.drugs = drugs
+        self.description = description
+
+
+class DrugCheckResult(_Model):
+    """药物冲突检查结果"""
+
+    __slots__ = ('has_conflicts', 'allergy_warnings', 'drug_interactions', 'contraindications',
+                 'dosage_warnings', 'recommendations', 'severity', 'message', 'error')
+    _fields = (('has_conflicts', False), ('allergy_warnings', False), ('drug_interactions', False),
+               ('contraindications', False), ('dosage_warnings', False), ('recommendations', False),
+               ('severity', False), ('message', True), ('error', True))
+
+    def __init__(self, has_conflicts: bool = False, allergy_warnings: Optional[List[str]] = None,
+                 drug_interactions: Optional[List] = None, contraindications: Optional[List[str]] = None,
+                 dosage_warnings: Optional[List[str]] = None, recommendations: Optional[List[str]] = None,
+                 severity: str = '无', message: Optional[str] = None, error: Optional[str] = None):
+        self.has_conflicts = has_conflicts
+        self.allergy_warnings = allergy_warnings or []
+        self.drug_interactions = drug_interactions or []
+        self.contraindications = contraindications or []
+        self.dosage_warnings = dosage_warnings or []
+        self.recommendations = recommendations or []
+        self.severity = severity
+        self.message = message
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> 'DrugCheckResult':
+        """
+        由模型输出（已展开为完整键名）或存储的字典构造
+
+        Raises:
+            SchemaError: data 不是 JSON 对象
+        """
+        _require_mapping(data, '药物冲突检查结果')
+        interactions = []
+        for item in data.get('drug_interactions') or []:
+            if isinstance(item, Mapping):
+                interactions.append(DrugInteraction(_text(item.get('drugs')) or '未知',
+                                                    _text(item.get('description'))))
+            elif item:
+                # 模型有时只返回一句说明
+                interactions.append(_text(item))
+        severity = _text(data.get('severity')).strip() or '无'
+        return cls(
+            has_conflicts=bool(data.get('has_conflicts')),
+            allergy_warnings=_text_list(data.get('allergy_warnings')),
+            drug_interactions=interactions,
+            contraindications=_text_list(data.get('contraindications')),
+            dosage_warnings=_text_list(data.get('dosage_warnings')),
+            recommendations=_text_list(data.get('recommendations')),
+            severity=severity,
+            message=data.get('message'),
+            error=data.get('error'),
+        )
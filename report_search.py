@@ -0,0 +1,186 @@
+"""
+报告全文检索模块
+基于 SQLite FTS5 的倒排索引，中文按二元组（bigram）切分，另外索引单字以支持单字检索
+"""
+import json
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+# 中日韩文字连续片段，或字母数字单词
+_TOKEN_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[0-9A-Za-zÀ-ɏ]+')
+_CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+
+# 索引版本，结构变化时递增以触发重建
+INDEX_VERSION = 2
+
+_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+    report_id UNINDEXED,
+    transcript,
+    soap,
+    diagnosis,
+    drugs,
+    tokenize = 'unicode61'
+);
+"""
+
+
+def _run_tokens(run: str) -> List[str]:
+    """将一个连续片段切分为词元：中文为二元组，其他为小写单词"""
+    if not _CJK_PATTERN.match(run):
+        return [run.lower()]
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def _index_tokens(run: str) -> List[str]:
+    """
+    建立索引用的词元：二元组之后再附加单字，单字检索（如"咳"）也能命中较长片段中的字；
+    单字放在二元组之后，多字检索的二元组短语仍保持相邻
+    """
+    tokens = _run_tokens(run)
+    if len(run) > 1 and _CJK_PATTERN.match(run):
+        tokens.extend(run)
+    return tokens
+
+
+def segment_text(text: Optional[str]) -> str:
+    """
+    将文本切分为以空格分隔的词元，供 unicode61 分词器建立索引
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        切分后的文本
+    """
+    if not text:
+        return ''
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(str(text)):
+        tokens.extend(_index_tokens(run))
+    return ' '.join(tokens)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    将用户输入转换为 FTS5 查询，每个连续片段作为一个短语，片段之间为 AND
+
+    Args:
+        query: 用户输入
+
+    Returns:
+        FTS5 MATCH 表达式，无有效词元时返回None
+    """
+    phrases = []
+    for run in _TOKEN_PATTERN.findall(query or ''):
+        tokens = _run_tokens(run)
+        phrases.append('"' + ' '.join(t.replace('"', '""') for t in tokens) + '"')
+    return ' AND '.join(phrases) if phrases else None
+
+
+def _join(values) -> str:
+    if not values:
+        return ''
+    if isinstance(values, str):
+        return values
+    return ' '.join(str(v) for v in values)
+
+
+def document_fields(record: Dict) -> Dict[str, str]:
+    """从报告记录中提取需要索引的字段"""
+    soap_data = record.get('soap_data') or {}
+    drug_check = record.get('drug_check') or {}
+    soap_text = ' '.join(str(soap_data.get(key) or '') for key in
+                         ('chief_complaint', 'subjective', 'objective', 'assessment', 'plan'))
+    return {
+        'transcript': segment_text(record.get('transcript')),
+        'soap': segment_text(soap_text),
+        'diagnosis': segment_text(_join(record.get('diagnoses'))),
+        'drugs': segment_text(_join(drug_check.get('prescribed_drugs'))),
+    }
+
+
+class ReportSearchIndex:
+    """报告全文索引，与报告库共用同一个 SQLite 数据库"""
+
+    def __init__(self):
+        self.available = True
+
+    def ensure_schema(self, conn: sqlite3.Connection):
+        """创建索引表，首次创建或版本变化时从已有报告回填"""
+        try:
+            conn.executescript(_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"⚠️  SQLite 不支持 FTS5，报告全文检索不可用: {e}")
+            self.available = False
+            return
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= INDEX_VERSION:
+            return
+        with conn:
+            conn.execute("DELETE FROM reports_fts")
+            for row in conn.execute("SELECT id FROM reports").fetchall():
+                self._index_row(conn, row[0])
+            conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    def _index_row(self, conn: sqlite3.Connection, report_id: str):
+        """从已保存的报告行重建索引（回填用）"""
+        row = conn.execute(
+            "SELECT transcript, soap, drug_check FROM reports WHERE id = ?", (report_id,)
+        ).fetchone()
+        diagnoses = [r[0] for r in conn.execute(
+            "SELECT diagnosis FROM report_diagnoses WHERE report_id = ?", (report_id,)
+        )]
+        self.index(conn, {
+            'id': report_id,
+            'transcript': row[0],
+            'soap_data': json.loads(row[1] or '{}'),
+            'drug_check': json.loads(row[2] or '{}'),
+            'diagnoses': diagnoses,
+        })
+
+    def index(self, conn: sqlite3.Connection, record: Dict):
+        """
+        将一份报告加入索引，需在保存报告的同一事务中调用
+
+        Args:
+            conn: 数据库连接
+            record: ReportStore.build_record 生成的记录
+        """
+        if not self.available:
+            return
+        fields = document_fields(record)
+        conn.execute(
+            "INSERT INTO reports_fts (report_id, transcript, soap, diagnosis, drugs) VALUES (?, ?, ?, ?, ?)",
+            (record['id'], fields['transcript'], fields['soap'], fields['diagnosis'], fields['drugs'])
+        )
+
+    def search(self, conn: sqlite3.Connection, query: str, limit: int = 20, offset: int = 0) -> List[str]:
+        """
+        按相关度检索报告
+
+        Args:
+            conn: 数据库连接
+            query: 检索词
+            limit: 返回条数
+            offset: 跳过条数
+
+        Returns:
+            报告 ID 列表，按相关度排序
+        """
+        if not self.available:
+            raise RuntimeError("当前 SQLite 不支持 FTS5，无法检索")
+        match = build_match_query(query)
+        if match is None:
+            return []
+        # 诊断、药物字段权重更高
+        rows = conn.execute(
+            "SELECT report_id FROM reports_fts WHERE reports_fts MATCH ? "
+            "ORDER BY bm25(reports_fts, 0, 1.0, 2.0, 5.0, 5.0) LIMIT ? OFFSET ?",
+            (match, limit, offset)
+        ).fetchall()
+        return [row[0] for row in rows]
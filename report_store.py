@@ -0,0 +1,326 @@
+"""
+报告存储模块
+基于 SQLite 的结构化报告库，按患者、日期、诊断建立索引并支持分页查询，
+保存时同步维护全文检索索引
+"""
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import json_codec
+from report_search import ReportSearchIndex
+
+# 表示"未填写"的患者姓名，不参与患者索引
+_ANONYMOUS_NAMES = {'', '未提供', '未知', 'not provided', 'non fourni', 'non renseigné'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    patient_key TEXT,
+    patient_name TEXT,
+    chief_complaint TEXT,
+    patient_info TEXT,
+    transcript TEXT,
+    soap TEXT,
+    examinations TEXT,
+    drug_check TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reports_patient ON reports (patient_key, id);
+CREATE TABLE IF NOT EXISTS report_diagnoses (
+    diagnosis_key TEXT NOT NULL,
+    report_id TEXT NOT NULL,
+    diagnosis TEXT NOT NULL,
+    PRIMARY KEY (diagnosis_key, report_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_report_diagnoses_report ON report_diagnoses (report_id);
+"""
+
+
+def normalize_key(value: Optional[str]) -> Optional[str]:
+    """归一化患者姓名、诊断等索引键"""
+    if value is None:
+        return None
+    key = ''.join(str(value).split()).lower()
+    return key or None
+
+
+def _patient_key(patient_info: Dict) -> Optional[str]:
+    """优先使用患者编号，否则使用姓名"""
+    if patient_info.get('patient_id'):
+        return normalize_key(patient_info['patient_id'])
+    name = normalize_key(patient_info.get('name'))
+    if name is None or name in _ANONYMOUS_NAMES:
+        return None
+    return name
+
+
+# 落盘策略 -> SQLite synchronous 级别
+FSYNC_POLICIES = {
+    'always': 'FULL',    # 每个事务提交都 fsync
+    'normal': 'NORMAL',  # WAL 模式下仅在检查点 fsync，断电可能丢失最近的事务但不会损坏
+    'off': 'OFF',        # 交给操作系统，速度最快
+}
+
+
+def _new_report_id(created_at: datetime) -> str:
+    """生成按时间排序且不会重复的报告 ID"""
+    return f"{created_at.strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+
+def _date_bound(value: str) -> str:
+    """将 YYYY-MM-DD 日期转换为报告 ID 前缀"""
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y%m%d')
+
+
+class ReportStore:
+    """结构化报告库"""
+
+    def __init__(self, db_path: str, fsync_policy: str = 'always'):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"不支持的落盘策略: {fsync_policy}")
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.synchronous = FSYNC_POLICIES[fsync_policy]
+        self._local = threading.local()
+        self.search_index = ReportSearchIndex()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        self.search_index.ensure_schema(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程复用一个连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def build_record(report: Dict) -> Dict:
+        """
+        规范化待保存的报告，并分配报告 ID
+
+        Args:
+            report: 包含 patient_info、transcript、soap_data、examinations、drug_check、content 的字典
+
+        Returns:
+            可直接写入的记录
+        """
+        created_at = datetime.now()
+        patient_info = report.get('patient_info') or {}
+        soap_data = report.get('soap_data') or {}
+        diagnoses = soap_data.get('preliminary_diagnosis') or []
+        if isinstance(diagnoses, str):
+            diagnoses = [diagnoses]
+        diagnoses = [str(d) for d in diagnoses if normalize_key(d)]
+        return {
+            'id': report.get('id') or _new_report_id(created_at),
+            'created_at': created_at.isoformat(timespec='seconds'),
+            'patient_key': _patient_key(patient_info),
+            'patient_name': patient_info.get('name'),
+            'chief_complaint': soap_data.get('chief_complaint'),
+            'patient_info': patient_info,
+            'transcript': report.get('transcript') or '',
+            'soap_data': soap_data,
+            'examinations': report.get('examinations') or [],
+            'drug_check': report.get('drug_check') or {},
+            'content': report.get('content') or '',
+            'diagnoses': diagnoses,
+        }
+
+    def _insert(self, conn: sqlite3.Connection, record: Dict):
+        conn.execute(
+            "INSERT INTO reports (id, created_at, patient_key, patient_name, chief_complaint, "
+            "patient_info, transcript, soap, examinations, drug_check, content) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record['id'], record['created_at'], record['patient_key'], record['patient_name'],
+                record['chief_complaint'],
+                json_codec.dumps(record['patient_info']),
+                record['transcript'],
+                json_codec.dumps(record['soap_data']),
+                json_codec.dumps(record['examinations']),
+                json_codec.dumps(record['drug_check']),
+                record['content'],
+            )
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO report_diagnoses (diagnosis_key, report_id, diagnosis) VALUES (?, ?, ?)",
+            [(normalize_key(d), record['id'], d) for d in record['diagnoses']]
+        )
+        self.search_index.index(conn, record)
+
+    def save(self, report: Dict) -> str:
+        """
+        保存一份报告
+
+        Args:
+            report: 报告字典，见 build_record
+
+        Returns:
+            报告 ID
+        """
+        return self.save_many([report])[0]
+
+    def save_many(self, reports: List[Dict]) -> List[str]:
+        """在一个事务中保存多份报告"""
+        records = [r if 'diagnoses' in r else self.build_record(r) for r in reports]
+        conn = self._connect()
+        with conn:
+            for record in records:
+                self._insert(conn, record)
+        return [r['id'] for r in records]
+
+    @staticmethod
+    def _row_summary(row: sqlite3.Row, diagnoses: List[str]) -> Dict:
+        return {
+            'id': row['id'],
+            'created_at': row['created_at'],
+            'patient_name': row['patient_name'],
+            'chief_complaint': row['chief_complaint'],
+            'diagnoses': diagnoses,
+        }
+
+    def _diagnoses_for(self, conn: sqlite3.Connection, report_ids: List[str]) -> Dict[str, List[str]]:
+        if not report_ids:
+            return {}
+        placeholders = ','.join('?' * len(report_ids))
+        result = {rid: [] for rid in report_ids}
+        for row in conn.execute(
+            f"SELECT report_id, diagnosis FROM report_diagnoses WHERE report_id IN ({placeholders})",
+            report_ids
+        ):
+            result[row['report_id']].append(row['diagnosis'])
+        return result
+
+    def get(self, report_id: str) -> Optional[Dict]:
+        """
+        获取完整报告
+
+        Args:
+            report_id: 报告 ID
+
+        Returns:
+            报告字典，不存在返回None
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
+        if row is None:
+            return None
+        report = self._row_summary(row, self._diagnoses_for(conn, [report_id])[report_id])
+        report.update({
+            'patient_info': json_codec.loads(row['patient_info'] or '{}'),
+            'transcript': row['transcript'],
+            'soap_data': json_codec.loads(row['soap'] or '{}'),
+            'examinations': json_codec.loads(row['examinations'] or '[]'),
+            'drug_check': json_codec.loads(row['drug_check'] or '{}'),
+            'content': row['content'],
+        })
+        return report
+
+    def query(self,
+              patient: Optional[str] = None,
+              diagnosis: Optional[str] = None,
+              date_from: Optional[str] = None,
+              date_to: Optional[str] = None,
+              cursor: Optional[str] = None,
+              limit: int = 20) -> Dict:
+        """
+        分页查询报告摘要，按时间倒序
+
+        使用游标（上一页最后一条的报告 ID）分页，查询代价不随页码增长
+
+        Args:
+            patient: 患者编号或姓名
+            diagnosis: 诊断
+            date_from: 起始日期（YYYY-MM-DD，含）
+            date_to: 截止日期（YYYY-MM-DD，含）
+            cursor: 上一页返回的 next_cursor
+            limit: 每页条数
+
+        Returns:
+            包含 items 和 next_cursor 的字典
+        """
+        limit = max(1, min(int(limit), 100))
+        conditions = []
+        params = []
+
+        if diagnosis:
+            sql = ("SELECT r.* FROM report_diagnoses d JOIN reports r ON r.id = d.report_id "
+                   "WHERE d.diagnosis_key = ?")
+            params.append(normalize_key(diagnosis))
+            id_column = 'd.report_id'
+        else:
+            sql = "SELECT r.* FROM reports r WHERE 1 = 1"
+            id_column = 'r.id'
+
+        if patient:
+            conditions.append("r.patient_key = ?")
+            params.append(normalize_key(patient))
+        if date_from:
+            conditions.append(f"{id_column} >= ?")
+            params.append(_date_bound(date_from))
+        if date_to:
+            # 报告 ID 以日期开头，截止日期的下一个前缀之前的 ID 都属于该日
+            conditions.append(f"{id_column} < ?")
+            params.append(_date_bound(date_to) + '~')
+        if cursor:
+            conditions.append(f"{id_column} < ?")
+            params.append(cursor)
+
+        for condition in conditions:
+            sql += f" AND {condition}"
+        sql += f" ORDER BY {id_column} DESC LIMIT ?"
+        params.append(limit + 1)
+
+        conn = self._connect()
+        rows = conn.execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        diagnoses = self._diagnoses_for(conn, [row['id'] for row in rows])
+
+        return {
+            'items': [self._row_summary(row, diagnoses[row['id']]) for row in rows],
+            'next_cursor': rows[-1]['id'] if has_more else None,
+        }
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        """
+        全文检索问诊记录、SOAP、诊断和药物
+
+        Args:
+            query: 检索词
+            limit: 每页条数
+            offset: 跳过条数
+
+        Returns:
+            包含 items（报告摘要，按相关度排序）和 next_offset 的字典
+        """
+        limit = max(1, min(int(limit), 100))
+        offset = max(0, int(offset))
+        conn = self._connect()
+        report_ids = self.search_index.search(conn, query, limit + 1, offset)
+        has_more = len(report_ids) > limit
+        report_ids = report_ids[:limit]
+        if not report_ids:
+            return {'items': [], 'next_offset': None}
+
+        placeholders = ','.join('?' * len(report_ids))
+        rows = {row['id']: row for row in conn.execute(
+            f"SELECT * FROM reports WHERE id IN ({placeholders})", report_ids
+        )}
+        diagnoses = self._diagnoses_for(conn, report_ids)
+        return {
+            'items': [self._row_summary(rows[rid], diagnoses[rid]) for rid in report_ids if rid in rows],
+            'next_offset': offset + limit if has_more else None,
+        }
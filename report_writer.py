@@ -0,0 +1,211 @@
+"""
+报告异步写入模块
+后台线程批量写入报告库（组提交）：并发的保存请求合并到同一个事务，
+调用方可等待所在批次提交后再确认；写入失败的报告返回给等待的调用方，
+未等待的报告保留在内存中随后续批次重试
+"""
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from report_store import ReportStore
+
+
+class ReportQueueFull(Exception):
+    """写入队列已满"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("报告写入队列已满，请稍后重试")
+        self.retry_after = retry_after
+
+
+class ReportWriteFailed(Exception):
+    """报告写入报告库失败"""
+
+
+class _Ticket:
+    """等待写入结果的调用方持有的凭据"""
+
+    __slots__ = ('done', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class ReportWriter:
+    """报告后台写入器"""
+
+    def __init__(self,
+                 store: ReportStore,
+                 queue_size: int = 1000,
+                 batch_size: int = 64,
+                 flush_interval: float = 0.05,
+                 enqueue_timeout: float = 0.5,
+                 retry_interval: float = 5.0):
+        """
+        Args:
+            store: 报告库
+            queue_size: 队列容量，写满后 submit 会等待 enqueue_timeout 后拒绝
+            batch_size: 单个事务最多写入的报告数
+            flush_interval: 凑批的最长等待时间（秒）
+            enqueue_timeout: 队列满时入队的最长等待时间（秒）
+            retry_interval: 未等待结果的报告写入失败后，重试的最短间隔（秒）
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending: Dict[str, Dict] = {}
+        self._pending_lock = threading.Lock()
+        # 写入失败、等待重试的报告（调用方未等待结果）
+        self._failed: Dict[str, Dict] = {}
+        self._last_retry = 0.0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="report-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, report: Dict, wait: bool = False) -> str:
+        """
+        提交一份报告
+
+        Args:
+            report: 报告字典，见 ReportStore.build_record
+            wait: 是否等待所在批次提交后再返回（保存病历时应等待，进程退出不会丢失已确认的报告）
+
+        Returns:
+            报告 ID
+
+        Raises:
+            ReportQueueFull: 队列已满
+            ReportWriteFailed: wait=True 且写入失败
+        """
+        if self._stopped:
+            raise RuntimeError("报告写入器已关闭")
+        record = self.store.build_record(report)
+        ticket = _Ticket() if wait else None
+        with self._pending_lock:
+            self._pending[record['id']] = record
+        try:
+            self._queue.put((record, ticket), timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._pending_lock:
+                self._pending.pop(record['id'], None)
+            raise ReportQueueFull(retry_after=max(1.0, self.flush_interval * 10))
+        if ticket is not None:
+            ticket.done.wait()
+            if ticket.error is not None:
+                raise ReportWriteFailed(f"报告写入失败: {ticket.error}") from ticket.error
+        return record['id']
+
+    def get_pending(self, report_id: str) -> Optional[Dict]:
+        """获取已入队但尚未写入（含写入失败等待重试）的报告记录"""
+        with self._pending_lock:
+            return self._pending.get(report_id) or self._failed.get(report_id)
+
+    def stats(self) -> Dict:
+        with self._pending_lock:
+            return {'queued': len(self._pending), 'failed': len(self._failed)}
+
+    def _next_batch(self, timeout: Optional[float] = None) -> List:
+        """
+        阻塞取出第一项，再在 flush_interval 内凑满一批
+
+        Raises:
+            queue.Empty: timeout 内没有新的报告
+        """
+        batch = [self._queue.get(timeout=timeout)]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, records: List[Dict]) -> Dict[str, BaseException]:
+        """
+        写入一批报告，整批失败时逐条重试以隔离坏数据
+
+        Returns:
+            写入失败的报告 ID -> 异常
+        """
+        try:
+            self.store.save_many(records)
+            return {}
+        except Exception as e:
+            print(f"批量写入报告失败，逐条重试: {e}")
+        errors = {}
+        for record in records:
+            try:
+                self.store.save_many([record])
+            except Exception as item_error:
+                errors[record['id']] = item_error
+        return errors
+
+    def _retry_failed(self, force: bool = False):
+        """重试之前写入失败的报告（按 retry_interval 限频）"""
+        now = time.monotonic()
+        with self._pending_lock:
+            if not self._failed or (not force and now - self._last_retry < self.retry_interval):
+                return
+            records = list(self._failed.values())
+        self._last_retry = now
+        errors = self._write(records)
+        with self._pending_lock:
+            for record in records:
+                if record['id'] not in errors:
+                    self._failed.pop(record['id'], None)
+        if errors:
+            print(f"⚠️  {len(errors)} 份报告仍未写入，稍后重试")
+
+    def _run(self):
+        while True:
+            try:
+                # 有待重试的报告时，空闲期间也定期重试
+                batch = self._next_batch(self.retry_interval if self._failed else None)
+            except queue.Empty:
+                self._retry_failed()
+                continue
+            items = [item for item in batch if item is not None]
+            if items:
+                errors = self._write([record for record, _ in items])
+                with self._pending_lock:
+                    for record, ticket in items:
+                        self._pending.pop(record['id'], None)
+                        if record['id'] in errors and ticket is None:
+                            # 调用方已收到确认，不能丢弃，保留并重试
+                            self._failed[record['id']] = record
+                for record, ticket in items:
+                    error = errors.get(record['id'])
+                    if error is not None:
+                        print(f"写入报告 {record['id']} 失败: {error}")
+                    if ticket is not None:
+                        ticket.error = error
+                        ticket.done.set()
+            self._retry_failed()
+            for _ in batch:
+                self._queue.task_done()
+            if len(items) < len(batch):
+                self._retry_failed(force=True)
+                return
+
+    def flush(self):
+        """等待队列中已有的报告全部写入"""
+        self._queue.join()
+
+    def close(self):
+        """写完剩余报告后停止后台线程"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+        if self._failed:
+            print(f"❌ 退出时仍有 {len(self._failed)} 份报告未能写入: {', '.join(self._failed)}")
@@ -14,7 +14,7 @@ except ImportError:
     sys.exit(1)
 
 # 检查 API Key
-from config import GOOGLE_API_KEY
+from config import GOOGLE_API_KEY, FLASK_DEBUG
 
 if not GOOGLE_API_KEY or GOOGLE_API_KEY == "your_google_api_key_here":
     print("错误: 未设置有效的 GOOGLE_API_KEY")
@@ -87,7 +87,7 @@ if __name__ == '__main__':
     print("=" * 60)
     
     try:
-        app.run(debug=True, host='0.0.0.0', port=port)
+        app.run(debug=FLASK_DEBUG, host='0.0.0.0', port=port)
     except KeyboardInterrupt:
         print("\n\n服务器已停止")
     except Exception as e:
@@ -0,0 +1,145 @@
+"""
+语义相似缓存模块
+对问诊记录做本地向量化，相似度超过阈值时复用历史结果
+"""
+from __future__ import annotations
+
+import re
+import threading
+import zlib
+from typing import Any, List, Optional, Tuple
+
+from lazy_import import lazy_import
+
+# numpy 在第一次向量化时才加载，不计入 Web 工作进程的启动时间
+np = lazy_import("numpy")
+
+# 去除空白和标点后再做 n-gram
+_STRIP_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+class HashingEmbedder:
+    """字符 n-gram 哈希向量化，无需下载模型，适合 CPU"""
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        将文本转换为 L2 归一化的向量
+
+        Args:
+            text: 文本
+
+        Returns:
+            float32 向量
+        """
+        normalized = _STRIP_PATTERN.sub('', (text or '').lower())
+        vector = np.zeros(self.dim, dtype=np.float32)
+        low, high = self.ngram_range
+        hashes = [
+            zlib.crc32(normalized[i:i + n].encode('utf-8'))
+            for n in range(low, high + 1)
+            for i in range(len(normalized) - n + 1)
+        ]
+        if not hashes:
+            return vector
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        # 最高位决定符号，减少哈希冲突带来的偏差
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dim, signs)
+        # 次线性词频
+        vector = np.sign(vector) * np.sqrt(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceTransformerEmbedder:
+    """基于 sentence-transformers 的向量化（可选依赖）"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.model.encode(text or '', normalize_embeddings=True).astype(np.float32)
+
+
+def create_embedder(model_name: Optional[str] = None):
+    """创建向量化器，未指定模型或模型不可用时使用哈希向量化"""
+    if model_name:
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except Exception as e:
+            print(f"⚠️  加载向量模型 {model_name} 失败，改用哈希向量化: {e}")
+    return HashingEmbedder()
+
+
+class SemanticCache:
+    """
+    语义相似缓存
+
+    向量存放在预分配的矩阵中，查询为一次矩阵-向量乘法（余弦相似度）；
+    写满后按先进先出覆盖最旧的条目
+    """
+
+    def __init__(self, embedder=None, threshold: float = 0.85, capacity: int = 5000):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.capacity = capacity
+        self._vectors = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self._values: List[Any] = [None] * capacity
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _nearest(self, vector: np.ndarray) -> Tuple[int, float]:
+        if self._size == 0:
+            return -1, 0.0
+        scores = self._vectors[:self._size] @ vector
+        index = int(np.argmax(scores))
+        return index, float(scores[index])
+
+    def lookup(self, text: str) -> Optional[Tuple[Any, float]]:
+        """
+        查找最相似的缓存条目
+
+        Args:
+            text: 查询文本
+
+        Returns:
+            (缓存值, 相似度)，低于阈值时返回None
+        """
+        vector = self.embedder.embed(text)
+        with self._lock:
+            index, score = self._nearest(vector)
+            if index >= 0 and score >= self.threshold:
+                self.hits += 1
+                return self._values[index], score
+            self.misses += 1
+            return None
+
+    def add(self, text: str, value: Any):
+        """
+        加入缓存，与已有条目几乎相同时覆盖该条目
+
+        Args:
+            text: 文本
+            value: 缓存值
+        """
+        vector = self.embedder.embed(text)
+        with self._lock:
+            index, score = self._nearest(vector)
+            if index < 0 or score < 0.999:
+                index = self._next
+                self._next = (self._next + 1) % self.capacity
+                self._size = min(self._size + 1, self.capacity)
+            self._vectors[index] = vector
+            self._values[index] = value
+
+    def __len__(self) -> int:
+        return self._size
@@ -0,0 +1,436 @@
+"""
+问诊会话模块
+服务器按问诊 ID 保存问诊记录、患者信息和各阶段结果，后续请求只引用 ID 并发送增量：
+- 问诊记录按"保留前 offset 个字符 + 追加 delta"更新，并用校验和确认双方内容一致
+- SOAP 病历由服务器生成后保存，之后的请求用 soap_id 引用
+- 检查推荐和药物检查结果记录计算时的 soap_id，期间 SOAP 已变化的结果不保存
+- 内存中的会话数和总大小有上限，按最近使用淘汰
+- 配置会话目录时每次更新都写入该目录（多个工作进程共享，过期后删除），
+  内存中的副本比目录中的旧时重新读取；未配置时会话只在当前进程中，只能使用单个工作进程
+- 所有修改都通过 SessionStore.update 在会话锁内完成"读取最新内容 - 修改 - 写回"，
+  配置目录时是会话锁文件上的 flock，不同工作进程的并发请求不会丢失彼此的修改
+会话缺失或与客户端不一致时返回冲突，由客户端重新发送完整内容
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，会话锁只在进程内有效
+    fcntl = None
+
+import json_codec
+from models import Examination, SOAPNote
+
+
+class SessionConflict(Exception):
+    """服务器上的会话缺失或与客户端不一致，需要客户端重新发送完整内容"""
+
+
+def transcript_checksum(text: str) -> int:
+    """问诊记录的 32 位 FNV-1a 校验和（按 Unicode 码点计算，与前端的实现一致）"""
+    h = 2166136261
+    for ch in text:
+        h = ((h ^ ord(ch)) * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def stale_results(previous_soap: Dict, soap_data: Dict) -> Dict[str, bool]:
+    """SOAP 病历变化后哪些阶段结果需要重新计算：诊断或计划变化时重新推荐检查，计划变化时重新检查药物"""
+    plan_changed = previous_soap.get('plan') != soap_data.get('plan')
+    diagnosis_changed = previous_soap.get('preliminary_diagnosis') != soap_data.get('preliminary_diagnosis')
+    return {'examinations': plan_changed or diagnosis_changed, 'drug_check': plan_changed}
+
+
+# 依赖 SOAP 病历的阶段结果
+STAGES = ('examinations', 'drug_check')
+
+
+def soap_id(soap_data: Dict) -> str:
+    """SOAP 病历内容的标识"""
+    payload = json_codec.dumps(soap_data, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class ConsultationSession:
+    """一次问诊的服务器端状态"""
+
+    __slots__ = ('consultation_id', 'transcript', 'patient_info', 'soap_data', 'soap_id', 'soap_transcript',
+                 'examinations', 'examinations_soap_id', 'drug_check', 'drug_check_soap_id', 'updated_at', 'size')
+
+    def __init__(self, consultation_id: Optional[str] = None):
+        self.consultation_id = consultation_id
+        self.transcript = ''
+        self.patient_info: Dict = {}
+        self.soap_data: Dict = {}
+        self.soap_id: Optional[str] = None
+        # 生成当前 SOAP 时的问诊记录，用于判断能否增量更新
+        self.soap_transcript: Optional[str] = None
+        self.examinations: List[Examination] = []
+        self.drug_check: Dict = {}
+        # 阶段结果对应的 soap_id，与当前 soap_id 不同的结果视为不存在
+        self.examinations_soap_id: Optional[str] = None
+        self.drug_check_soap_id: Optional[str] = None
+        self.updated_at = time.time()
+        self.size = 0
+
+    def set_soap(self, soap_data: Dict, transcript: Optional[str] = None):
+        """
+        保存新的 SOAP 病历，诊断或计划变化时依赖它们的阶段结果随之作废
+
+        Args:
+            soap_data: SOAP 病历（客户端发送的字典在这里校验并转换为 SOAPNote）
+            transcript: 生成该病历时的问诊记录，未知时为 None（下次只能完整生成）
+        """
+        soap_data = SOAPNote.from_dict(soap_data) if soap_data else {}
+        stale = stale_results(self.soap_data, soap_data)
+        previous_id = self.soap_id
+        self.soap_data = soap_data
+        self.soap_id = soap_id(self.soap_data) if self.soap_data else None
+        self.soap_transcript = transcript
+        for stage in STAGES:
+            if stale[stage]:
+                self._clear(stage)
+            elif getattr(self, f'{stage}_soap_id') == previous_id:
+                # 诊断和计划未变，结果对新病历仍然有效
+                setattr(self, f'{stage}_soap_id', self.soap_id)
+
+    def _clear(self, stage: str):
+        setattr(self, stage, [] if stage == 'examinations' else {})
+        setattr(self, f'{stage}_soap_id', None)
+
+    def stage_result(self, stage: str):
+        """当前 SOAP 病历对应的阶段结果（'examinations' 或 'drug_check'），没有时为空"""
+        if getattr(self, f'{stage}_soap_id') != self.soap_id:
+            return [] if stage == 'examinations' else {}
+        return getattr(self, stage)
+
+    def set_stage_result(self, stage: str, value, for_soap_id: Optional[str]) -> bool:
+        """
+        保存阶段结果
+
+        Args:
+            stage: 'examinations' 或 'drug_check'
+            value: 结果
+            for_soap_id: 计算结果时的 soap_id
+
+        Returns:
+            是否保存（计算期间 SOAP 病历已变化时丢弃）
+        """
+        if for_soap_id != self.soap_id:
+            return False
+        setattr(self, stage, value)
+        setattr(self, f'{stage}_soap_id', for_soap_id)
+        return True
+
+    def apply(self, data: Dict):
+        """
+        应用请求中的完整内容或增量
+
+        Args:
+            data: 请求体，可包含 transcript（完整问诊记录）或 transcript_offset / transcript_delta /
+                  transcript_checksum（增量），patient_info，soap_data（完整 SOAP）或 soap_id（引用）
+
+        Raises:
+            SessionConflict: 增量无法应用，或引用的 SOAP 与服务器上的不一致
+            SchemaError: soap_data 不是 JSON 对象
+        """
+        # 先校验，冲突时会话保持不变
+        transcript = self.transcript
+        if 'transcript' in data:
+            transcript = data.get('transcript') or ''
+        elif 'transcript_delta' in data:
+            offset = int(data.get('transcript_offset', 0))
+            if offset > len(self.transcript):
+                raise SessionConflict("问诊记录增量的起始位置超出服务器上的记录")
+            transcript = self.transcript[:offset] + (data.get('transcript_delta') or '')
+            if transcript_checksum(transcript) != data.get('transcript_checksum'):
+                raise SessionConflict("问诊记录与服务器上的不一致")
+        if not data.get('soap_data') and data.get('soap_id') and data['soap_id'] != self.soap_id:
+            raise SessionConflict("SOAP 病历与服务器上的不一致")
+
+        self.transcript = transcript
+        if data.get('patient_info') is not None and data['patient_info'] != self.patient_info:
+            # 过敏史、用药等变化后阶段结果不再可靠，SOAP 病历也需要按新的患者信息重新生成
+            self.patient_info = data['patient_info']
+            self.soap_transcript = None
+            for stage in STAGES:
+                self._clear(stage)
+        if data.get('soap_data') and data['soap_data'] != self.soap_data:
+            self.set_soap(data['soap_data'])
+        self.updated_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'size'}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ConsultationSession':
+        session = cls(data.get('consultation_id'))
+        for name in cls.__slots__:
+            if name in data and name != 'size':
+                setattr(session, name, data[name])
+        if session.soap_data:
+            session.soap_data = SOAPNote.from_dict(session.soap_data)
+        session.examinations = Examination.list_from(session.examinations)
+        return session
+
+
+class SessionStore:
+    """按最近使用淘汰的会话存储，可用目录在多个工作进程之间共享"""
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 directory: Optional[str] = None, ttl: float = 12 * 3600):
+        """
+        Args:
+            max_sessions: 内存中保留的会话数上限
+            max_bytes: 内存中会话的总大小上限（按 JSON 序列化后的字节数估算）
+            directory: 会话目录（含患者信息，权限设为仅属主可访问），None 表示只保存在内存中
+            ttl: 目录中的会话超过该时间（秒）未更新时删除
+        """
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.ttl = ttl
+        self._sessions: 'OrderedDict[str, ConsultationSession]' = OrderedDict()
+        # 内存中的会话对应的文件版本（inode 和修改时间，每次写入都替换文件），不同时说明其他进程改过该会话
+        self._versions: Dict[str, Tuple[int, int]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 没有会话目录（或没有 fcntl）时代替会话锁文件
+        self._update_lock = threading.Lock()
+        self._last_sweep = 0.0
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            os.chmod(directory, 0o700)
+
+    def _path(self, consultation_id: str) -> str:
+        # 问诊 ID 来自客户端，哈希后作为文件名
+        digest = hashlib.sha256(consultation_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{digest}.json')
+
+    def _lock_path(self, consultation_id: str) -> str:
+        return self._path(consultation_id)[:-len('.json')] + '.lock'
+
+    @staticmethod
+    def _lock_file(path: str, blocking: bool = True) -> Optional[int]:
+        """
+        打开并锁住锁文件（每次调用单独打开，同一进程的线程之间也互斥）
+
+        Returns:
+            文件描述符，关闭即释放；不阻塞且锁被占用时返回 None
+        """
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                # 等待期间锁文件可能被删除（会话结束或过期），锁住的是旧文件时重新打开
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    @contextmanager
+    def _locked(self, consultation_id: str):
+        """会话的读-改-写期间持有的锁，锁文件无法使用时退回进程内的锁"""
+        fd = None
+        if self.directory and fcntl is not None:
+            try:
+                fd = self._lock_file(self._lock_path(consultation_id))
+            except OSError as e:
+                print(f"⚠️  会话锁文件不可用，只在进程内加锁: {e}")
+        if fd is not None:
+            try:
+                yield
+            finally:
+                os.close(fd)
+        else:
+            with self._update_lock:
+                yield
+
+    def _version(self, consultation_id: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._path(consultation_id))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def get(self, consultation_id: str, create: bool = False) -> Optional[ConsultationSession]:
+        """
+        取会话，内存中没有或比目录中的旧时从目录读取
+
+        Args:
+            consultation_id: 问诊 ID
+            create: 不存在时是否新建
+        """
+        version = self._version(consultation_id) if self.directory else None
+        with self._lock:
+            session = self._sessions.get(consultation_id)
+            if session is not None and (version is None or version == self._versions.get(consultation_id)):
+                self._sessions.move_to_end(consultation_id)
+                return session
+        loaded = self._load(consultation_id) if version is not None else None
+        if loaded is not None:
+            session = loaded
+        elif session is None and create:
+            session = ConsultationSession(consultation_id)
+        if session is not None:
+            self._remember(session, version if loaded is not None else None)
+        return session
+
+    def _remember(self, session: ConsultationSession, version: Optional[Tuple[int, int]]):
+        """放入内存并按上限淘汰最久未使用的会话（目录中的副本保留）"""
+        size = len(json_codec.dumps(session.to_dict()).encode('utf-8'))
+        with self._lock:
+            previous = self._sessions.get(session.consultation_id)
+            if previous is not None:
+                self._bytes -= previous.size
+            session.size = size
+            self._sessions[session.consultation_id] = session
+            self._sessions.move_to_end(session.consultation_id)
+            self._versions[session.consultation_id] = version
+            self._bytes += size
+            while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions
+                                               or self._bytes > self.max_bytes):
+                oldest_id, oldest = self._sessions.popitem(last=False)
+                self._versions.pop(oldest_id, None)
+                self._bytes -= oldest.size
+
+    def _save(self, session: ConsultationSession):
+        """保存会话，配置了目录时同时写入目录（调用方持有会话锁）"""
+        version = self._write(session) if self.directory else None
+        self._remember(session, version)
+
+    def update(self, consultation_id: str, change: Union[Dict, Callable[[ConsultationSession], object]],
+               create: bool = True) -> Optional[ConsultationSession]:
+        """
+        在会话锁内取最新的会话、修改并写回，同一问诊的并发请求（包括其他工作进程上的）依次修改
+
+        Args:
+            consultation_id: 问诊 ID
+            change: 请求体（按 ConsultationSession.apply 应用），或以会话为参数的修改函数，
+                    修改函数返回 False 表示没有修改、不写回
+            create: 会话不存在时是否新建；为 False 且会话不存在（问诊已结束）时不修改，返回 None
+
+        Raises:
+            SessionConflict: 增量无法应用，会话保持不变
+        """
+        with self._locked(consultation_id):
+            session = self.get(consultation_id, create=create)
+            if session is None:
+                return None
+            if callable(change):
+                changed = change(session) is not False
+            else:
+                session.apply(change)
+                changed = True
+            if changed:
+                self._save(session)
+        if self.directory:
+            self._sweep()
+        return session
+
+    def save_stage_result(self, consultation_id: str, stage: str, value, for_soap_id: Optional[str]) -> bool:
+        """
+        保存阶段结果并写回会话，计算期间 SOAP 病历已变化或问诊已结束时丢弃
+
+        Returns:
+            是否保存
+        """
+        saved = False
+
+        def change(session: ConsultationSession) -> bool:
+            nonlocal saved
+            saved = session.set_stage_result(stage, value, for_soap_id)
+            return saved
+
+        self.update(consultation_id, change, create=False)
+        return saved
+
+    def discard(self, consultation_id: str):
+        """问诊结束或清空时删除会话"""
+        with self._locked(consultation_id):
+            with self._lock:
+                session = self._sessions.pop(consultation_id, None)
+                self._versions.pop(consultation_id, None)
+                if session is not None:
+                    self._bytes -= session.size
+            if self.directory:
+                for path in (self._path(consultation_id), self._lock_path(consultation_id)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _write(self, session: ConsultationSession) -> Optional[Tuple[int, int]]:
+        """写入目录，返回文件版本，失败时返回 None"""
+        path = self._path(session.consultation_id)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w', encoding='utf-8') as f:
+                f.write(json_codec.dumps(session.to_dict()))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  会话写入磁盘失败: {e}")
+            return None
+        return self._version(session.consultation_id)
+
+    def _load(self, consultation_id: str) -> Optional[ConsultationSession]:
+        try:
+            with open(self._path(consultation_id), 'rb') as f:
+                data = json_codec.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        return ConsultationSession.from_dict(data)
+
+    def _sweep(self):
+        """删除目录中过期的会话（每分钟最多扫描一次）"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < 60:
+                return
+            self._last_sweep = now
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) <= self.ttl:
+                    continue
+                if not name.endswith(('.json', '.lock')) or fcntl is None:
+                    os.remove(path)
+                    continue
+                # 会话和锁文件在锁内删除，正在修改的会话跳过
+                stem = path[:-len('.json')]
+                fd = self._lock_file(stem + '.lock', blocking=False)
+                if fd is None:
+                    continue
+                try:
+                    if not os.path.exists(stem + '.json') or now - os.path.getmtime(stem + '.json') > self.ttl:
+                        for stale in (stem + '.json', stem + '.lock'):
+                            try:
+                                os.remove(stale)
+                            except FileNotFoundError:
+                                pass
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': self._bytes}
@@ -0,0 +1,248 @@
+"""
+请求合并（single-flight）模块
+相同输入的并发 LLM 调用只执行一次，其余调用等待并共享结果：
+- 进程内：按 key 记录进行中的调用，后到的线程等待同一个结果
+- 跨进程（同一台机器上的多个 gunicorn 工作进程）：每个 key 一个锁文件（仅属主可读写），
+  持锁的进程执行调用，把结果写入锁文件后删除该文件再释放锁；等待锁的进程从已打开的文件读取结果，
+  最后一个等待方关闭文件后内容即被系统回收，结果不会留在磁盘上
+等待方被取消时只是不再等待；所有等待方都取消后，实际调用才会被取消
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cancellation import CancelToken, RequestCancelled, current_token, use_token, wait_event
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只做进程内合并
+    fcntl = None
+
+
+# 锁文件中结果的标记
+_RESULT_MARK = b'\x01'
+
+
+def make_key(*parts) -> str:
+    """由调用输入生成 key，字符串中的连续空白视为相同"""
+    normalized = [' '.join(p.split()) if isinstance(p, str) else p for p in parts]
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    __slots__ = ('listeners', 'value', 'error', 'waiters', 'token')
+
+    def __init__(self):
+        # 各等待方独占的完成事件（取消时 wait_event 会 set 等待方自己的事件）
+        self.listeners: List[threading.Event] = []
+        self.value: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        # 仍在等待结果的调用方数量（含执行方），降为 0 时取消实际调用
+        self.waiters = 1
+        self.token = CancelToken()
+
+
+class _FileLockWait:
+    """在辅助线程中阻塞等待文件锁；等待方取消后不再使用该文件，由拿到锁的一方关闭"""
+
+    __slots__ = ('fd', 'event', 'granted', 'abandoned', 'error', 'guard')
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.event = threading.Event()
+        self.granted = False
+        self.abandoned = False
+        self.error: Optional[OSError] = None
+        self.guard = threading.Lock()
+
+    def run(self):
+        error = None
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except OSError as e:
+            error = e
+        with self.guard:
+            if self.abandoned:
+                os.close(self.fd)
+                return
+            self.granted = True
+            self.error = error
+        self.event.set()
+
+    def abandon(self):
+        with self.guard:
+            self.abandoned = True
+            granted = self.granted
+        if granted:
+            os.close(self.fd)
+
+
+class SingleFlight:
+    """合并相同 key 的并发调用，结果为字符串（各调用方自行解析，互不共享可变对象）"""
+
+    def __init__(self, lock_dir: Optional[str] = None):
+        """
+        Args:
+            lock_dir: 跨进程锁文件目录（会设置为仅属主可访问），None 表示只在进程内合并
+        """
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, mode=0o700, exist_ok=True)
+            os.chmod(self.lock_dir, 0o700)
+
+    def do(self, key: str, fn: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        执行 fn，或等待进行中的相同调用
+
+        Args:
+            key: 调用的 key（make_key 生成）
+            fn: 实际调用，返回字符串
+
+        Returns:
+            (结果, 是否共享了其他调用的结果)
+
+        Raises:
+            进程内的等待方会收到执行方抛出的同一个异常；
+            当前上下文被取消时抛出 RequestCancelled
+        """
+        token = current_token()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None or call.token.cancelled
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+                done = threading.Event()
+                call.listeners.append(done)
+
+        if not leader:
+            try:
+                wait_event(done)
+            except RequestCancelled:
+                self._detach(key, call)
+                raise
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        # 执行方的请求被取消时同样只减少等待方计数，其他等待方仍能拿到结果
+        detach = lambda: self._detach(key, call)
+        if token is not None:
+            token.add_callback(detach)
+        try:
+            with use_token(call.token):
+                call.value, shared = self._do_across_processes(key, fn)
+            return call.value, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            if token is not None:
+                token.remove_callback(detach)
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                listeners, call.listeners = call.listeners, []
+            for done in listeners:
+                done.set()
+
+    def _detach(self, key: str, call: _Call):
+        """一个等待方不再等待，全部离开时取消实际调用"""
+        with self._lock:
+            call.waiters -= 1
+            abandoned = call.waiters == 0
+            if abandoned and self._calls.get(key) is call:
+                del self._calls[key]
+        if abandoned:
+            call.token.cancel('all waiters cancelled')
+
+    def _do_across_processes(self, key: str, fn: Callable[[], str]) -> Tuple[str, bool]:
+        if not self.lock_dir:
+            return fn(), False
+        lock_path = os.path.join(self.lock_dir, f'{key}.lock')
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            # 其他进程正在执行相同调用时等待其释放锁；等待期间可被取消
+            self._lock_file(fd)
+            try:
+                if os.fstat(fd).st_nlink == 0:
+                    # 上一个持锁方已结束并删除了锁文件：写入了结果则共享，否则（调用失败）重新竞争
+                    value = self._read_result(fd)
+                    if value is not None:
+                        return value, True
+                    continue
+                # 持锁期间执行，其他进程在该 key 的锁上等待；清除异常退出的进程可能留下的内容
+                try:
+                    os.ftruncate(fd, 0)
+                    value = fn()
+                    self._write_result(fd, value)
+                finally:
+                    try:
+                        os.unlink(lock_path)
+                    except OSError:
+                        pass
+                return value, False
+            finally:
+                # 关闭文件时释放锁
+                os.close(fd)
+
+    @staticmethod
+    def _lock_file(fd: int):
+        """
+        获取文件锁，锁被占用时在辅助线程中阻塞等待（不轮询）
+
+        Raises:
+            RequestCancelled: 等待期间当前上下文被取消，fd 交由辅助线程关闭
+            OSError: 加锁失败，fd 已关闭
+        """
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+        except OSError:
+            os.close(fd)
+            raise
+        wait = _FileLockWait(fd)
+        threading.Thread(target=wait.run, name='singleflight-lock', daemon=True).start()
+        try:
+            wait_event(wait.event)
+        except RequestCancelled:
+            wait.abandon()
+            raise
+        if wait.error is not None:
+            os.close(fd)
+            raise wait.error
+
+    @staticmethod
+    def _read_result(fd: int) -> Optional[str]:
+        """读取已删除的锁文件中的结果，没有完整结果时返回None"""
+        try:
+            data = os.pread(fd, os.fstat(fd).st_size, 0)
+        except OSError:
+            return None
+        # 首字节为结果标记，区分空结果与未写入
+        if not data.startswith(_RESULT_MARK):
+            return None
+        return data[len(_RESULT_MARK):].decode('utf-8')
+
+    @staticmethod
+    def _write_result(fd: int, value: str):
+        """写入结果，失败时等待方会自行执行调用"""
+        data = _RESULT_MARK + value.encode('utf-8')
+        try:
+            written = 0
+            while written < len(data):
+                written += os.pwrite(fd, data[written:], written)
+        except OSError as e:
+            os.ftruncate(fd, 0)
+            print(f"⚠️  写入合并结果失败: {e}")
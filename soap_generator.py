@@ -1,20 +1,30 @@
 """
 SOAP病历生成模块
 """
-import google.generativeai as genai
-from typing import Dict, Optional
-import json
+from typing import Dict, List, Optional
 from datetime import datetime
+import json
+
+from llm_client import generate_json
+from compact_schema import SOAP_FORMAT, SOAP_KEYS, expand_soap
+from models import SOAPNote
+from cancellation import RequestCancelled
+from llm_scheduler import SchedulerOverloaded
+
+# 模型生成的 SOAP 字段（增量更新只允许修改这些字段）
+SOAP_FIELDS = tuple(SOAP_KEYS.values())
 
 class SOAPGenerator:
     """SOAP病历生成器"""
     
     def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
+        # google.generativeai 导入较慢，创建实例时才导入
+        import google.generativeai as genai
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
         self.model_name = model
     
-    def generate_soap(self, consultation_transcript: str, patient_info: Optional[Dict] = None) -> Dict:
+    def generate_soap(self, consultation_transcript: str, patient_info: Optional[Dict] = None) -> SOAPNote:
         """
         根据问诊记录生成SOAP病历
         
@@ -23,7 +33,7 @@ class SOAPGenerator:
             patient_info: 患者基本信息（可选）
             
         Returns:
-            包含SOAP各部分的字典
+            SOAP病历（失败时 error 为错误信息）
         """
         patient_context = ""
         if patient_info:
@@ -50,13 +60,7 @@ class SOAPGenerator:
 3. A (Assessment - 评估)：初步诊断、鉴别诊断等
 4. P (Plan - 计划)：治疗方案、检查计划、用药计划、随访计划等
 
-请以JSON格式返回，包含以下字段：
-- subjective: 主观资料
-- objective: 客观资料  
-- assessment: 评估
-- plan: 计划
-- chief_complaint: 主诉（简要）
-- preliminary_diagnosis: 初步诊断（列表）
+{SOAP_FORMAT}
 
 确保内容专业、准确、完整。
 """
@@ -73,15 +77,14 @@ class SOAPGenerator:
                 "response_mime_type": "application/json",
             }
             
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=generation_config
-            )
-            
-            result = json.loads(response.text)
-            result['generated_at'] = datetime.now().isoformat()
+            result = SOAPNote.from_dict(expand_soap(generate_json(self.model, full_prompt, generation_config,
+                                                                 stage='soap')))
+            result.generated_at = datetime.now().isoformat()
             return result
             
+        except (SchedulerOverloaded, RequestCancelled):
+            # 过载或请求已取消时交给路由处理（503 / 客户端已断开）
+            raise
         except Exception as e:
             error_msg = str(e)
             if "403" in error_msg or "leaked" in error_msg.lower() or "API key" in error_msg:
@@ -90,15 +93,63 @@ class SOAPGenerator:
                 print("   获取新 API Key: https://makersuite.google.com/app/apikey")
             else:
                 print(f"生成SOAP病历错误: {e}")
-            return {
-                "error": error_msg,
-                "subjective": "",
-                "objective": "",
-                "assessment": "",
-                "plan": "",
-                "chief_complaint": "",
-                "preliminary_diagnosis": []
+            return SOAPNote(error=error_msg)
+    
+    def update_soap(self, previous_soap: Dict, transcript_delta: str) -> Optional[SOAPNote]:
+        """
+        根据新增的问诊记录增量更新 SOAP 病历，只发送原病历和新增部分，模型只返回需要修改的字段
+        
+        Args:
+            previous_soap: 之前生成的 SOAP 病历
+            transcript_delta: 生成之后新增的问诊记录
+            
+        Returns:
+            更新后的 SOAP 病历（updated_fields 为修改过的字段），失败时返回None，由调用方改为完整生成
+        """
+        current = {short: previous_soap.get(field, '') for short, field in SOAP_KEYS.items()}
+        prompt = f"""你是一位专业的临床医生，擅长撰写规范的SOAP病历。
+
+以下是根据之前的问诊记录生成的SOAP病历（JSON，cc=主诉, s=主观资料, o=客观资料, a=评估, p=计划, dx=初步诊断列表）：
+{json.dumps(current, ensure_ascii=False)}
+
+之后问诊又新增了以下内容：
+{transcript_delta}
+
+请根据新增内容更新病历，只修改受影响的字段，未受影响的字段不要返回。
+请以JSON格式返回：{{"ch": {{短键名: 该字段更新后的完整内容}}}}；
+新增内容不影响病历时返回 {{"ch": {{}}}}。
+
+请确保返回有效的JSON格式。"""
+        
+        try:
+            generation_config = {
+                "temperature": 0.2,
+                "response_mime_type": "application/json",
             }
+            
+            result = generate_json(self.model, prompt, generation_config, stage='soap_update')
+            changes = result.get('ch', result.get('changes', {}))
+            if not isinstance(changes, dict):
+                raise ValueError("ch 不是对象")
+            returned = expand_soap(changes)
+            # 按模型的规则规范化后再比较，避免格式差异被当作修改
+            changes = SOAPNote.from_dict(returned)
+            previous = SOAPNote.from_dict(previous_soap)
+            updated_fields: List[str] = [
+                field for field in SOAP_FIELDS
+                if field in returned and getattr(changes, field) != getattr(previous, field)
+            ]
+            return previous.replace(
+                generated_at=datetime.now().isoformat(),
+                updated_fields=updated_fields,
+                **{field: getattr(changes, field) for field in updated_fields}
+            )
+            
+        except (SchedulerOverloaded, RequestCancelled):
+            raise
+        except Exception as e:
+            print(f"增量更新SOAP病历错误，改为完整生成: {e}")
+            return None
     
     def format_soap_text(self, soap_data: Dict) -> str:
         """
@@ -0,0 +1,172 @@
+"""
+推测执行模块
+医生仍在问诊时，按语句边界用已有的问诊记录提前推荐检查项目
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional
+
+import llm_scheduler
+from cancellation import CancelToken, RequestCancelled, use_token
+from models import Examination, normalize_diagnosis
+
+
+def diagnoses_match(final: List[str], speculative: List[str]) -> bool:
+    """
+    最终诊断是否都在推测诊断中（归一化后名称相同；"炎"与"肺炎"这样的包含关系不算一致）
+
+    Args:
+        final: SOAP 中的最终初步诊断
+        speculative: 推测执行得到的诊断
+    """
+    final_keys = [k for k in (normalize_diagnosis(d) for d in final) if k]
+    speculative_keys = [k for k in (normalize_diagnosis(d) for d in speculative) if k]
+    if not final_keys or not speculative_keys:
+        return False
+    return set(final_keys) <= set(speculative_keys)
+
+
+class _Session:
+    """单个问诊的推测执行状态"""
+
+    def __init__(self):
+        self.generation = 0
+        self.timer: Optional[threading.Timer] = None
+        self.future: Optional[Future] = None
+        # 执行中任务的取消标记，新的提交到来时取消已发出的 LLM 调用
+        self.token: Optional[CancelToken] = None
+        self.result: Optional[Dict] = None
+        # 产生 result 的问诊记录，最终记录以它开头时结果才可能适用
+        self.transcript: Optional[str] = None
+
+
+class SpeculativeRecommender:
+    """检查项目推测执行器"""
+
+    def __init__(self, recommender, debounce: float = 1.5, max_workers: int = 2, max_sessions: int = 1000):
+        """
+        Args:
+            recommender: ExaminationRecommender 实例
+            debounce: 最后一次提交后等待多久才真正执行（秒）
+            max_workers: 并发执行的推测任务数
+            max_sessions: 保留的问诊数量上限，超出时淘汰最久未使用的
+        """
+        self.recommender = recommender
+        self.debounce = debounce
+        self.max_sessions = max_sessions
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, consultation_id: str) -> _Session:
+        session = self._sessions.get(consultation_id)
+        if session is None:
+            session = _Session()
+            self._sessions[consultation_id] = session
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._cancel(evicted)
+        else:
+            self._sessions.move_to_end(consultation_id)
+        return session
+
+    @staticmethod
+    def _cancel(session: _Session):
+        """取消等待中的计时器、尚未开始的任务和执行中的 LLM 调用"""
+        if session.timer is not None:
+            session.timer.cancel()
+            session.timer = None
+        if session.future is not None:
+            session.future.cancel()
+        if session.token is not None:
+            session.token.cancel('superseded')
+            session.token = None
+
+    def submit(self, consultation_id: str, partial_transcript: str, patient_info: Optional[Dict] = None):
+        """
+        提交截至目前的问诊记录，防抖后执行；新的提交会取消旧的任务
+
+        Args:
+            consultation_id: 问诊 ID
+            partial_transcript: 截至目前的问诊记录
+            patient_info: 患者基本信息（可选）
+        """
+        if not partial_transcript.strip():
+            return
+        with self._lock:
+            session = self._session(consultation_id)
+            self._cancel(session)
+            # 旧记录上的结果不再代表当前问诊
+            session.result = None
+            session.transcript = None
+            session.generation += 1
+            timer = threading.Timer(
+                self.debounce, self._launch,
+                args=(consultation_id, session.generation, partial_transcript, patient_info)
+            )
+            timer.daemon = True
+            session.timer = timer
+            timer.start()
+
+    def _launch(self, consultation_id: str, generation: int, partial_transcript: str,
+                patient_info: Optional[Dict]):
+        with self._lock:
+            session = self._sessions.get(consultation_id)
+            if session is None or session.generation != generation:
+                return
+            session.timer = None
+            session.token = CancelToken()
+            session.future = self._executor.submit(
+                self._run, consultation_id, generation, partial_transcript, patient_info, session.token
+            )
+
+    def _run(self, consultation_id: str, generation: int, partial_transcript: str,
+             patient_info: Optional[Dict], token: CancelToken):
+        try:
+            with llm_scheduler.priority('speculative'), use_token(token):
+                result = self.recommender.recommend_from_partial(partial_transcript, patient_info)
+        except RequestCancelled:
+            return
+        with self._lock:
+            session = self._sessions.get(consultation_id)
+            # 已有更新的提交，丢弃过期结果
+            if session is None or session.generation != generation or not result['examinations']:
+                return
+            session.result = result
+            session.transcript = partial_transcript
+
+    def take(self, consultation_id: Optional[str], soap_data: Dict, transcript: str) -> Optional[List[Examination]]:
+        """
+        推测所用的问诊记录是最终记录的前缀、且最终 SOAP 诊断与推测诊断一致时返回推测结果
+
+        Args:
+            consultation_id: 问诊 ID
+            soap_data: 最终 SOAP 病历
+            transcript: 最终问诊记录
+
+        Returns:
+            检查项目列表（标记为临时结果，由调用方随后取回完整推荐），不可复用时返回None
+        """
+        if not consultation_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(consultation_id)
+            if session is None or session.result is None:
+                return None
+            result, partial = session.result, session.transcript
+        if partial is None or not transcript.startswith(partial):
+            return None
+        final = soap_data.get('preliminary_diagnosis', [])
+        if isinstance(final, str):
+            final = [final]
+        if not diagnoses_match(final, result['preliminary_diagnosis']):
+            return None
+        return [Examination.from_dict(dict(exam, provisional=True)) for exam in result['examinations']]
+
+    def discard(self, consultation_id: str):
+        """问诊结束或清空时释放状态"""
+        with self._lock:
+            session = self._sessions.pop(consultation_id, None)
+            if session is not None:
+                self._cancel(session)
@@ -2,19 +2,90 @@
 语音转文字模块
 支持实时转录和离线转录
 """
-import speech_recognition as sr
-from typing import Optional, List
+from __future__ import annotations
+
+from typing import Optional, List, Dict, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import os
+import time
+
+import audio_codec
+from metrics import track_stage
+from tracing import start_span
+from vad import VoiceActivityDetector
+from lazy_import import lazy_import
+from cancellation import RequestCancelled, check_cancelled, submit, wait_future
+
+sr = lazy_import("speech_recognition")
 
 class SpeechToText:
     """语音转文字处理器"""
     
-    def __init__(self, google_api_key: Optional[str] = None):
+    def __init__(self, google_api_key: Optional[str] = None,
+                 use_vad: bool = True,
+                 vad_use_model: bool = False,
+                 max_workers: int = 4,
+                 chunk_seconds: float = 20.0,
+                 max_chunk_seconds: float = 45.0):
         self.recognizer = sr.Recognizer()
         self.recognizer.energy_threshold = 300
         self.recognizer.dynamic_energy_threshold = True
         self.recognizer.pause_threshold = 0.8
         self.google_api_key = google_api_key
+        self.use_vad = use_vad
+        self.vad_use_model = vad_use_model
+        self.max_workers = max_workers
+        self.chunk_seconds = chunk_seconds
+        self.max_chunk_seconds = max_chunk_seconds
+    
+    def _recognize(self, audio: sr.AudioData, language: str = "zh-CN") -> str:
+        """调用 Google 语音识别"""
+        with start_span('asr.transcribe', language=language), track_stage('transcribe'):
+            if self.google_api_key:
+                return self.recognizer.recognize_google(audio, language=language, key=self.google_api_key)
+            return self.recognizer.recognize_google(audio, language=language)
+    
+    def _recognize_utterance(self, pcm: bytes, sample_rate: int, language: str) -> Optional[str]:
+        """识别单个语句片段，无法识别时返回None；请求已取消时不再发出识别请求"""
+        check_cancelled()
+        try:
+            return self._recognize(sr.AudioData(pcm, sample_rate, 2), language)
+        except sr.UnknownValueError:
+            return None
+    
+    def _transcribe_pcm(self, pcm: bytes, sample_rate: int, language: str) -> Optional[str]:
+        """
+        转录 16-bit 单声道 PCM，启用 VAD 时切除静音并按语句并行识别
+        
+        Raises:
+            sr.RequestError: 语音识别服务错误
+            RequestCancelled: 请求已取消（尚未开始的语句不再识别）
+        """
+        if not self.use_vad:
+            return self._recognize_utterance(pcm, sample_rate, language)
+        
+        vad = VoiceActivityDetector(sample_rate=sample_rate, use_model=self.vad_use_model)
+        utterances = vad.split_utterances(pcm)
+        if not utterances:
+            return None
+        if len(utterances) == 1:
+            return self._recognize_utterance(utterances[0], sample_rate, language)
+        
+        # 每个语句使用独立的 Recognizer 请求，结果按原顺序拼接
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(utterances))) as executor:
+            futures = [
+                submit(executor, self._recognize_utterance, chunk, sample_rate, language)
+                for chunk in utterances
+            ]
+            try:
+                texts = [wait_future(future) for future in futures]
+            except RequestCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+        texts = [t for t in texts if t]
+        return " ".join(texts) if texts else None
         
     def transcribe_file(self, audio_file: str, language: str = "zh-CN") -> Optional[str]:
         """
@@ -28,27 +99,190 @@ class SpeechToText:
             转录文本，失败返回None
         """
         try:
+            # Opus 等压缩格式流式解码后分段识别
+            if os.path.splitext(audio_file)[1].lower() not in audio_codec.NATIVE_EXTENSIONS:
+                result = self.transcribe_long_file(audio_file, language=language)
+                return result['text'] or None
+            
             with sr.AudioFile(audio_file) as source:
-                audio = self.recognizer.record(source)
+                duration = source.DURATION
+                if duration <= self.max_chunk_seconds:
+                    audio = self.recognizer.record(source)
+            
+            # 超长音频走分段并行转录
+            if duration > self.max_chunk_seconds:
+                result = self.transcribe_long_file(audio_file, language=language)
+                return result['text'] or None
             
             # 使用Google Speech Recognition
             try:
-                if self.google_api_key:
-                    text = self.recognizer.recognize_google(audio, language=language, key=self.google_api_key)
-                else:
-                    text = self.recognizer.recognize_google(audio, language=language)
+                # 统一为 16-bit 单声道 PCM 后做静音切除
+                pcm = audio.get_raw_data(convert_width=2)
+                text = self._transcribe_pcm(pcm, audio.sample_rate, language)
+                if text is None:
+                    print("无法识别音频内容")
                 return text
-            except sr.UnknownValueError:
-                print("无法识别音频内容")
-                return None
             except sr.RequestError as e:
                 print(f"语音识别服务错误: {e}")
                 return None
                 
+        except RequestCancelled:
+            raise
         except Exception as e:
             print(f"转录错误: {e}")
             return None
     
+    @staticmethod
+    def _iter_file_blocks(source: sr.AudioFile, block_frames: int = 16000) -> Iterator[bytes]:
+        """按块读取已打开的音频文件，统一转换为 16-bit PCM"""
+        while True:
+            block = source.stream.read(block_frames)
+            if not block:
+                break
+            yield sr.AudioData(block, source.SAMPLE_RATE, source.SAMPLE_WIDTH).get_raw_data(convert_width=2)
+    
+    @contextmanager
+    def _open_audio_blocks(self, audio_file: str):
+        """
+        打开音频文件并按块流式读取 16-bit 单声道 PCM
+        
+        WAV/AIFF/FLAC 使用 speech_recognition 读取，其他格式（如 Opus）使用 soundfile 解码
+        
+        Yields:
+            (采样率, PCM 字节块迭代器)
+        """
+        if os.path.splitext(audio_file)[1].lower() in audio_codec.NATIVE_EXTENSIONS:
+            with sr.AudioFile(audio_file) as source:
+                yield source.SAMPLE_RATE, self._iter_file_blocks(source)
+        else:
+            yield audio_codec.iter_pcm_blocks(audio_file)
+    
+    def _fixed_chunks(self, blocks: Iterator[bytes], sample_rate: int,
+                      overlap_s: float = 0.5) -> Iterator[tuple]:
+        """
+        不使用 VAD 时按固定时长切分（识别服务对单次请求的音频时长有限制，长音频仍需分段），
+        相邻片段重叠 overlap_s 秒，拼接时去重
+
+        Yields:
+            (片段起始采样点, 片段 PCM 字节, 是否为强制切分)
+        """
+        chunk_bytes = max(2, int(self.chunk_seconds * sample_rate)) * 2
+        overlap_bytes = min(int(overlap_s * sample_rate) * 2, chunk_bytes - 2)
+        buffer = bytearray()
+        offset = 0
+        for block in blocks:
+            buffer.extend(block)
+            while len(buffer) > chunk_bytes:
+                yield offset, bytes(buffer[:chunk_bytes]), True
+                step = chunk_bytes - overlap_bytes
+                del buffer[:step]
+                offset += step // 2
+        if buffer:
+            yield offset, bytes(buffer), False
+    
+    @staticmethod
+    def _merge_overlap(previous: str, current: str, max_chars: int = 30) -> str:
+        """去掉 current 开头与 previous 结尾重复的部分"""
+        limit = min(len(previous), len(current), max_chars)
+        for size in range(limit, 1, -1):
+            if previous.endswith(current[:size]):
+                return current[size:].lstrip()
+        return current
+    
+    def _transcribe_chunk(self, index: int, start: int, pcm: bytes, sample_rate: int,
+                          vad: Optional[VoiceActivityDetector], language: str) -> Dict:
+        """转录单个长音频片段，失败只影响本片段；vad 为 None 时整段发送"""
+        began = time.perf_counter()
+        chunk = {
+            'index': index,
+            'start': start / sample_rate,
+            'end': (start + len(pcm) // 2) / sample_rate,
+            'text': '',
+            'error': None,
+        }
+        try:
+            if vad is None:
+                chunk['text'] = self._recognize_utterance(pcm, sample_rate, language) or ''
+            else:
+                segments = vad.segments(pcm)
+                if segments:
+                    # 只发送首尾静音之间的部分
+                    trimmed = pcm[segments[0][0] * 2:segments[-1][1] * 2]
+                    chunk['text'] = self._recognize_utterance(trimmed, sample_rate, language) or ''
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            chunk['error'] = f"{type(e).__name__}: {e}"
+        chunk['elapsed'] = time.perf_counter() - began
+        return chunk
+    
+    def transcribe_long_file(self, audio_file: str, language: str = "zh-CN",
+                             max_workers: Optional[int] = None) -> Dict:
+        """
+        长音频分段并行转录
+        
+        启用 VAD 时在静音处切分音频并切除片段首尾静音，未启用时按固定时长切分；
+        边读取边提交到线程池识别，结果按顺序拼接并去除重叠
+        
+        Args:
+            audio_file: 音频文件路径
+            language: 语言代码，默认中文
+            max_workers: 并行识别的线程数，None使用初始化时的设置
+            
+        Returns:
+            包含 text（完整文本）、chunks（各片段时间范围、耗时、文本、错误）、elapsed（总耗时）的字典
+
+        Raises:
+            RequestCancelled: 请求已取消，停止读取并放弃尚未开始的片段
+        """
+        began = time.perf_counter()
+        futures = []
+        overlapped = []
+        
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            try:
+                with self._open_audio_blocks(audio_file) as (sample_rate, blocks):
+                    if self.use_vad:
+                        vad = VoiceActivityDetector(sample_rate=sample_rate, use_model=self.vad_use_model)
+                        chunks = vad.iter_chunks(
+                            blocks,
+                            target_chunk_s=self.chunk_seconds,
+                            max_chunk_s=self.max_chunk_seconds
+                        )
+                    else:
+                        vad = None
+                        chunks = self._fixed_chunks(blocks, sample_rate)
+                    for index, (start, pcm, forced) in enumerate(chunks):
+                        check_cancelled()
+                        futures.append(submit(
+                            executor, self._transcribe_chunk, index, start, pcm, sample_rate, vad, language
+                        ))
+                        overlapped.append(forced)
+                results = [wait_future(future) for future in futures]
+            except RequestCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        # 按顺序拼接，强制切分的片段与下一片段有重叠，需要去重
+        parts = []
+        for i, chunk in enumerate(results):
+            text = chunk['text']
+            if text and parts and overlapped[i - 1]:
+                text = self._merge_overlap(parts[-1], text)
+            if text:
+                parts.append(text)
+        
+        failed = [c for c in results if c['error']]
+        if failed:
+            print(f"⚠️  {len(failed)}/{len(results)} 个音频片段转录失败")
+        
+        return {
+            'text': " ".join(parts),
+            'chunks': results,
+            'elapsed': time.perf_counter() - began,
+        }
+    
     def transcribe_realtime(self, microphone_index: Optional[int] = None) -> str:
         """
         实时语音转录（使用麦克风）
@@ -69,11 +303,7 @@ class SpeechToText:
             
             try:
                 audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-                if self.google_api_key:
-                    text = self.recognizer.recognize_google(audio, language="zh-CN", key=self.google_api_key)
-                else:
-                    text = self.recognizer.recognize_google(audio, language="zh-CN")
-                return text
+                return self._recognize(audio, language="zh-CN")
             except sr.WaitTimeoutError:
                 return ""
             except sr.UnknownValueError:
@@ -94,12 +324,7 @@ class SpeechToText:
             转录文本
         """
         try:
-            audio = sr.AudioData(audio_data, sample_rate, 2)
-            if self.google_api_key:
-                text = self.recognizer.recognize_google(audio, language="zh-CN", key=self.google_api_key)
-            else:
-                text = self.recognizer.recognize_google(audio, language="zh-CN")
-            return text
+            return self._transcribe_pcm(audio_data, sample_rate, "zh-CN")
         except sr.UnknownValueError:
             return None
         except sr.RequestError as e:
@@ -3,6 +3,158 @@
 let recognition = null;
 let isRecording = false;
 let soapData = null;
+let examinationsData = null;
+let drugCheckData = null;
+let consultationId = newConsultationId();
+let speculateTimer = null;
+// 服务器会话中已确认的问诊记录和 SOAP 标识，请求只发送与之不同的部分
+let syncedTranscript = '';
+let soapId = null;
+
+// 推测执行的防抖间隔（毫秒）
+const SPECULATE_DEBOUNCE_MS = 1500;
+
+// 服务器过载（503）时的重试：优先使用 Retry-After，否则指数退避，均加随机抖动
+const OVERLOAD_MAX_RETRIES = 3;
+const OVERLOAD_BASE_DELAY_MS = 1000;
+const OVERLOAD_MAX_DELAY_MS = 30000;
+
+// 各类请求进行中的 AbortController：同类的新请求会中止旧请求，服务器检测到断开后取消对应的 LLM 调用
+const pendingRequests = {};
+
+function newConsultationId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+// 生成 32 位十六进制请求 ID，服务器将其作为 trace id
+function newRequestId() {
+    const bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function sleep(ms, signal) {
+    return new Promise((resolve, reject) => {
+        if (signal && signal.aborted) {
+            reject(new DOMException('Aborted', 'AbortError'));
+            return;
+        }
+        const timer = setTimeout(resolve, ms);
+        if (signal) {
+            signal.addEventListener('abort', () => {
+                clearTimeout(timer);
+                reject(new DOMException('Aborted', 'AbortError'));
+            }, { once: true });
+        }
+    });
+}
+
+function beginRequest(name) {
+    abortRequest(name);
+    const controller = new AbortController();
+    pendingRequests[name] = controller;
+    return controller;
+}
+
+// 请求结束时调用，返回该请求是否仍是同类中最新的（被中止或被取代时返回 false）
+function endRequest(name, controller) {
+    if (pendingRequests[name] !== controller) return false;
+    delete pendingRequests[name];
+    return true;
+}
+
+function abortRequest(name) {
+    const controller = pendingRequests[name];
+    if (controller) {
+        delete pendingRequests[name];
+        controller.abort();
+    }
+}
+
+function isAbortError(error) {
+    return error && error.name === 'AbortError';
+}
+
+function overloadDelay(response, attempt) {
+    const retryAfter = parseFloat(response.headers.get('Retry-After'));
+    const base = Number.isFinite(retryAfter)
+        ? retryAfter * 1000
+        : OVERLOAD_BASE_DELAY_MS * Math.pow(2, attempt);
+    // 抖动避免所有被拒绝的客户端同时重试
+    return Math.min(OVERLOAD_MAX_DELAY_MS, base * (1 + Math.random() * 0.5));
+}
+
+// 所有 API 请求都带上请求 ID，便于在服务器追踪中定位；503 时按 Retry-After 退避重试
+async function apiFetch(url, options = {}) {
+    for (let attempt = 0; ; attempt++) {
+        const headers = Object.assign({ 'X-Request-ID': newRequestId() }, options.headers);
+        const response = await fetch(url, Object.assign({}, options, { headers }));
+        if (response.status !== 503 || attempt >= OVERLOAD_MAX_RETRIES) {
+            return response;
+        }
+        const p = document.querySelector('#loading p');
+        if (p) p.textContent = t('serverBusyRetrying');
+        await sleep(overloadDelay(response, attempt), options.signal);
+    }
+}
+
+// 问诊记录的 FNV-1a 校验和（按码点计算，与服务器的实现一致）
+function transcriptChecksum(text) {
+    let h = 2166136261;
+    for (const ch of text) {
+        h = Math.imul(h ^ ch.codePointAt(0), 16777619) >>> 0;
+    }
+    return h;
+}
+
+function sessionPayload(transcript, full) {
+    const payload = { consultation_id: consultationId, patient_info: getPatientInfo() };
+    if (full) {
+        payload.transcript = transcript;
+        if (soapData) payload.soap_data = soapData;
+        // 保存报告时服务器会话中可能已没有这些结果
+        if (examinationsData) payload.examinations = examinationsData;
+        if (drugCheckData) payload.drug_check = drugCheckData;
+        return payload;
+    }
+    // 与已同步内容的公共前缀之后的部分即为增量（支持追加，也支持修改）
+    const current = Array.from(transcript);
+    const synced = Array.from(syncedTranscript);
+    let offset = 0;
+    while (offset < current.length && offset < synced.length && current[offset] === synced[offset]) {
+        offset++;
+    }
+    payload.transcript_offset = offset;
+    payload.transcript_delta = current.slice(offset).join('');
+    payload.transcript_checksum = transcriptChecksum(transcript);
+    if (soapId) payload.soap_id = soapId;
+    return payload;
+}
+
+// 基于服务器会话的 API 请求：只发送增量，会话缺失或不一致（409）时发送完整内容重试一次
+async function sessionFetch(url, extra, signal) {
+    const transcript = document.getElementById('consultation-text').value.trim();
+    const id = consultationId;
+    for (const full of [false, true]) {
+        const response = await apiFetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(Object.assign(sessionPayload(transcript, full), extra)),
+            signal
+        });
+        if (response.status === 409 && !full) continue;
+        if (response.ok && id === consultationId) syncedTranscript = transcript;
+        return response.json();
+    }
+}
+
+// 离开页面时中止进行中的请求（保存报告不在其中，不会被中止）
+window.addEventListener('pagehide', () => {
+    Object.keys(pendingRequests).forEach(abortRequest);
+});
 
 // 初始化
 document.addEventListener('DOMContentLoaded', function() {
@@ -69,6 +221,9 @@ function initializeSpeechRecognition() {
             const textarea = document.getElementById('consultation-text');
             textarea.value = textarea.value + finalTranscript;
             updateCharCount();
+            if (finalTranscript) {
+                scheduleSpeculation();
+            }
         };
         
         recognition.onerror = function(event) {
@@ -134,14 +289,43 @@ function updateRecordingStatus(message, isRecordingStatus) {
     statusEl.className = 'status-message' + (isRecordingStatus ? ' recording' : '');
 }
 
+// 通知服务器问诊已结束，释放其会话和推测执行状态（失败不影响前端）
+function endConsultation(id) {
+    fetch('/api/end-consultation', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ consultation_id: id }),
+        keepalive: true
+    }).catch(() => {});
+}
+
 function clearText() {
     if (confirm(t('confirmClear'))) {
+        endConsultation(consultationId);
+        consultationId = newConsultationId();
+        syncedTranscript = '';
+        soapId = null;
+        clearTimeout(speculateTimer);
+        abortRequest('speculate');
         document.getElementById('consultation-text').value = '';
         updateCharCount();
         updateButtonStates();
     }
 }
 
+// 语句结束时提交当前问诊记录，让服务器提前推荐检查项目
+function scheduleSpeculation() {
+    clearTimeout(speculateTimer);
+    speculateTimer = setTimeout(() => {
+        const transcript = document.getElementById('consultation-text').value.trim();
+        if (!transcript) return;
+        const controller = beginRequest('speculate');
+        sessionFetch('/api/speculate-examinations', {}, controller.signal).catch(error => {
+            if (!isAbortError(error)) console.error('Speculation failed:', error);
+        }).finally(() => endRequest('speculate', controller));
+    }, SPECULATE_DEBOUNCE_MS);
+}
+
 function updateCharCount() {
     const text = document.getElementById('consultation-text').value;
     document.getElementById('char-count').textContent = text.length;
@@ -186,16 +370,23 @@ async function generateSOAP() {
         alert(t('enterTranscript'));
         return;
     }
+    const controller = beginRequest('soap');
+    // 旧 SOAP 的检查推荐和药物检查结果已无用
+    ['exams', 'examsRefresh', 'drugs'].forEach(abortRequest);
+    let rerunExams = false;
+    let rerunDrugs = false;
     showLoading();
     try {
-        const response = await fetch('/api/generate-soap', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ transcript, patient_info: getPatientInfo() })
-        });
-        const result = await response.json();
+        const result = await sessionFetch('/api/generate-soap', {}, controller.signal);
         if (result.success) {
+            // 问诊记录追加后服务器增量更新病历，诊断和计划未变时保留已有结果
+            const rerun = result.rerun || { examinations: true, drug_check: true };
+            rerunExams = rerun.examinations && examinationsData !== null;
+            rerunDrugs = rerun.drug_check && drugCheckData !== null;
             soapData = result.data;
+            soapId = result.soap_id;
+            if (rerun.examinations) examinationsData = null;
+            if (rerun.drug_check) drugCheckData = null;
             displaySOAP(result.data);
             document.getElementById('recommend-exams').disabled = false;
             document.getElementById('check-drugs').disabled = false;
@@ -203,11 +394,15 @@ async function generateSOAP() {
             alert(t('generateSOAPFailed') + result.error);
         }
     } catch (error) {
+        if (isAbortError(error)) return;
         console.error('Error:', error);
         alert(t('requestFailed') + error.message);
     } finally {
-        hideLoading();
+        if (endRequest('soap', controller)) hideLoading();
     }
+    // 之前已展示的结果受病历变化影响时自动重新计算
+    if (rerunExams) await recommendExaminations();
+    if (rerunDrugs) await checkDrugConflicts();
 }
 
 function displaySOAP(data) {
@@ -235,34 +430,57 @@ function displaySOAP(data) {
     }
 }
 
+function requestExaminations(fresh, signal) {
+    return sessionFetch('/api/recommend-examinations', { fresh }, signal);
+}
+
 async function recommendExaminations() {
     if (!soapData) {
         alert(t('generateFirst'));
         return;
     }
+    const controller = beginRequest('exams');
+    abortRequest('examsRefresh');
     showLoading();
     try {
-        const transcript = document.getElementById('consultation-text').value.trim();
-        const response = await fetch('/api/recommend-examinations', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ soap_data: soapData, transcript })
-        });
-        const result = await response.json();
+        const result = await requestExaminations(false, controller.signal);
         if (result.success) {
-            displayExaminations(result.data);
+            examinationsData = result.data;
+            displayExaminations(result.data, result.provisional, result.source);
+            // 模型调用失败时只有基础检查（fallback），不再自动刷新
+            if (result.provisional && result.source !== 'fallback') {
+                refreshExaminations();
+            }
         } else {
             alert(t('recommendFailed') + result.error);
         }
     } catch (error) {
+        if (isAbortError(error)) return;
         console.error('Error:', error);
         alert(t('requestFailed') + error.message);
     } finally {
-        hideLoading();
+        if (endRequest('exams', controller)) hideLoading();
     }
 }
 
-function displayExaminations(examinations) {
+// 临时推荐展示后，在后台取回最新结果
+async function refreshExaminations() {
+    const requestedFor = soapData;
+    const controller = beginRequest('examsRefresh');
+    try {
+        const result = await requestExaminations(true, controller.signal);
+        if (result.success && soapData === requestedFor) {
+            examinationsData = result.data;
+            displayExaminations(result.data, result.provisional, result.source);
+        }
+    } catch (error) {
+        if (!isAbortError(error)) console.error('Refresh examinations failed:', error);
+    } finally {
+        endRequest('examsRefresh', controller);
+    }
+}
+
+function displayExaminations(examinations, provisional, source) {
     const reason = t('reason');
     const noExams = t('noExams');
     if (!examinations || examinations.length === 0) {
@@ -272,7 +490,10 @@ function displayExaminations(examinations) {
         const high = examinations.filter(e => e.priority === '高');
         const medium = examinations.filter(e => e.priority === '中');
         const low = examinations.filter(e => e.priority === '低');
-        let html = '';
+        // 临时结果来自检查项目目录（诊断对应的基础检查）、问诊过程中的推测或相似病例
+        const notes = { catalog: 'catalogExams', speculative: 'speculativeExams', fallback: 'fallbackExams' };
+        const note = notes[source] || 'provisionalExams';
+        let html = provisional ? `<p class="provisional-note">${t(note)}</p>` : '';
         [high, medium, low].forEach((arr, i) => {
             const key = ['priorityHigh', 'priorityMedium', 'priorityLow'][i];
             if (arr.length > 0) {
@@ -293,25 +514,25 @@ async function checkDrugConflicts() {
         alert(t('generateFirst'));
         return;
     }
+    const controller = beginRequest('drugs');
     showLoading();
     try {
-        const response = await fetch('/api/check-drug-conflicts', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ plan_text: soapData.plan, patient_info: getPatientInfo() })
-        });
-        const result = await response.json();
+        const result = await sessionFetch('/api/check-drug-conflicts', {}, controller.signal);
         if (result.success) {
+            // 检查失败的结果只展示，不写入报告
+            drugCheckData = result.data.error ? null
+                : Object.assign({ prescribed_drugs: result.prescribed_drugs || [] }, result.data);
             displayDrugCheck(result.data, result.prescribed_drugs);
             document.getElementById('save-report').disabled = false;
         } else {
             alert(t('checkFailed') + result.error);
         }
     } catch (error) {
+        if (isAbortError(error)) return;
         console.error('Error:', error);
         alert(t('requestFailed') + error.message);
     } finally {
-        hideLoading();
+        if (endRequest('drugs', controller)) hideLoading();
     }
 }
 
@@ -383,14 +604,10 @@ async function saveReport() {
             report += `Assessment:\n${soapData.assessment || ''}\n\nPlan:\n${soapData.plan || ''}\n\n`;
             report += `${t('reportDiagnosis')}: ${(soapData.preliminary_diagnosis || []).join(', ')}\n\n`;
         }
-        const response = await fetch('/api/save-report', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ content: report })
-        });
-        const result = await response.json();
+        // 问诊记录、SOAP 和各阶段结果已在服务器会话中
+        const result = await sessionFetch('/api/save-report', { content: report });
         if (result.success) {
-            alert(t('reportSaved') + result.filename);
+            alert(t('reportSaved') + result.report_id);
         } else {
             alert(t('saveFailed') + result.error);
         }
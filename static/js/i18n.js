@@ -33,6 +33,7 @@ const translations = {
     checkDrugs: 'Check Drug Conflicts',
     saveReport: 'Save Report',
     loading: 'Processing, please wait...',
+    serverBusyRetrying: 'Server is busy, retrying shortly...',
     soapNote: 'SOAP Note',
     recommendedExams: 'Recommended Examinations',
     drugCheck: 'Drug Conflict Check',
@@ -74,6 +75,10 @@ const translations = {
     confirmClear: 'Clear consultation record?',
     reportSaved: 'Report saved: ',
     noExams: 'No examinations recommended',
+    provisionalExams: 'Based on a similar previous case, updating...',
+    catalogExams: 'Standard workup for this diagnosis, adding case-specific tests...',
+    speculativeExams: 'Prepared during the consultation, confirming...',
+    fallbackExams: 'AI recommendation unavailable, showing the standard workup only. Try again later.',
     error: 'Error: ',
     notProvided: 'Not provided',
     none: 'None',
@@ -119,6 +124,7 @@ const translations = {
     checkDrugs: '检查药物冲突',
     saveReport: '保存报告',
     loading: '处理中，请稍候...',
+    serverBusyRetrying: '服务器繁忙，稍后自动重试...',
     soapNote: 'SOAP 病历',
     recommendedExams: '推荐检查项目',
     drugCheck: '药物冲突检查',
@@ -160,6 +166,10 @@ const translations = {
     confirmClear: '确定要清空问诊记录吗？',
     reportSaved: '报告已保存: ',
     noExams: '未推荐检查项目',
+    provisionalExams: '基于相似病例的临时推荐，正在更新...',
+    catalogExams: '该诊断的基础检查，正在补充针对本病例的检查...',
+    speculativeExams: '问诊过程中预先生成的推荐，正在确认...',
+    fallbackExams: 'AI 推荐暂不可用，仅显示该诊断的基础检查，请稍后重试',
     error: '错误: ',
     notProvided: '未提供',
     none: '无',
@@ -205,6 +215,7 @@ const translations = {
     checkDrugs: 'Vérifier interactions médicamenteuses',
     saveReport: 'Enregistrer le rapport',
     loading: 'Traitement en cours...',
+    serverBusyRetrying: 'Serveur occupé, nouvelle tentative sous peu...',
     soapNote: 'Note SOAP',
     recommendedExams: 'Examens recommandés',
     drugCheck: 'Vérification des interactions',
@@ -246,6 +257,10 @@ const translations = {
     confirmClear: 'Effacer le compte-rendu ?',
     reportSaved: 'Rapport enregistré: ',
     noExams: 'Aucun examen recommandé',
+    provisionalExams: 'Basé sur un cas similaire, mise à jour en cours...',
+    catalogExams: 'Bilan standard pour ce diagnostic, ajout des examens spécifiques en cours...',
+    speculativeExams: 'Préparé pendant la consultation, vérification en cours...',
+    fallbackExams: 'Recommandation IA indisponible, bilan standard uniquement. Réessayez plus tard.',
     error: 'Erreur: ',
     notProvided: 'Non fourni',
     none: 'Aucun',
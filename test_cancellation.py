@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+测试取消传播：调度器排队中取消、请求合并等待中取消、所有等待方取消后取消实际调用，
+以及跨进程合并时在文件锁上等待的取消（取消应立即生效，不依赖轮询间隔）
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cancellation import CancelToken, RequestCancelled, current_token, use_token, wait_event
+from llm_scheduler import LLMScheduler
+from singleflight import SingleFlight
+
+# 取消后等待方应在该时间内返回（秒）
+PROMPT = 0.02
+
+
+def run_with_token(token: CancelToken, fn, results: dict, name: str) -> threading.Thread:
+    """在后台线程中以指定的取消标记执行 fn，结果或异常记录到 results[name]"""
+    def target():
+        with use_token(token):
+            try:
+                results[name] = fn()
+            except BaseException as e:
+                results[name] = e
+            results[name + '_at'] = time.monotonic()
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until_cancelled():
+    """模拟一次只在被取消时结束的模型调用"""
+    wait_event(threading.Event())
+    raise AssertionError('未被取消')
+
+
+def test_wait_event():
+    token = CancelToken()
+    results = {}
+    thread = run_with_token(token, lambda: wait_event(threading.Event()), results, 'wait')
+    time.sleep(0.05)
+    cancelled_at = time.monotonic()
+    token.cancel()
+    thread.join(1)
+    assert isinstance(results.get('wait'), RequestCancelled), results
+    assert results['wait_at'] - cancelled_at < PROMPT, '取消后没有立即返回'
+    # 不带取消标记时超时返回 False
+    assert wait_event(threading.Event(), 0.01) is False
+
+
+def test_cancel_while_queued():
+    scheduler = LLMScheduler(max_concurrency=1, reserved_interactive=0, adaptive=False)
+    release = threading.Event()
+    results = {}
+    holder = run_with_token(CancelToken(), lambda: hold_slot(scheduler, release), results, 'holder')
+    time.sleep(0.05)
+
+    token = CancelToken()
+    queued = run_with_token(token, lambda: hold_slot(scheduler, threading.Event()), results, 'queued')
+    time.sleep(0.05)
+    assert scheduler.stats()['interactive']['queued'] == 1
+    cancelled_at = time.monotonic()
+    token.cancel()
+    queued.join(1)
+    assert isinstance(results.get('queued'), RequestCancelled), results
+    assert results['queued_at'] - cancelled_at < PROMPT, '取消后没有立即出队'
+    assert scheduler.stats()['interactive']['queued'] == 0
+
+    # 槽位释放后新的调用可以执行，取消的调用没有占用槽位
+    release.set()
+    holder.join(1)
+    with scheduler.slot():
+        assert scheduler.stats()['interactive']['running'] == 1
+    assert scheduler.stats()['interactive']['running'] == 0
+
+
+def hold_slot(scheduler: LLMScheduler, release: threading.Event):
+    with scheduler.slot():
+        release.wait(1)
+    return 'done'
+
+
+def test_cancel_while_coalesced():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(1)
+        return 'result'
+
+    results = {}
+    leader = run_with_token(CancelToken(), lambda: flight.do('k', fn), results, 'leader')
+    time.sleep(0.05)
+    token = CancelToken()
+    waiter = run_with_token(token, lambda: flight.do('k', fn), results, 'waiter')
+    time.sleep(0.05)
+    cancelled_at = time.monotonic()
+    token.cancel()
+    waiter.join(1)
+    assert isinstance(results.get('waiter'), RequestCancelled), results
+    assert results['waiter_at'] - cancelled_at < PROMPT, '取消后没有立即停止等待'
+
+    # 执行方仍在等待，实际调用继续并返回结果
+    release.set()
+    leader.join(1)
+    assert results['leader'] == ('result', False), results
+    assert len(calls) == 1
+
+
+def test_last_waiter_cancels_call():
+    flight = SingleFlight()
+    call_tokens = []
+
+    def fn():
+        call_tokens.append(current_token())
+        wait_until_cancelled()
+
+    results = {}
+    tokens = [CancelToken(), CancelToken()]
+    leader = run_with_token(tokens[0], lambda: flight.do('k', fn), results, 'leader')
+    time.sleep(0.05)
+    waiter = run_with_token(tokens[1], lambda: flight.do('k', fn), results, 'waiter')
+    time.sleep(0.05)
+
+    # 只有一方取消时实际调用继续
+    tokens[0].cancel()
+    time.sleep(0.05)
+    assert not call_tokens[0].cancelled, '还有等待方时实际调用被取消'
+    assert 'leader' not in results
+
+    tokens[1].cancel()
+    leader.join(1)
+    waiter.join(1)
+    assert call_tokens[0].cancelled
+    assert isinstance(results.get('leader'), RequestCancelled), results
+    assert isinstance(results.get('waiter'), RequestCancelled), results
+    assert len(call_tokens) == 1
+
+
+def test_cancel_while_waiting_for_file_lock():
+    # 同一进程中两个实例各自打开锁文件，与两个工作进程的情况相同
+    lock_dir = os.path.join(tempfile.mkdtemp(), 'singleflight')
+    first, second = SingleFlight(lock_dir), SingleFlight(lock_dir)
+    release = threading.Event()
+
+    def fn():
+        release.wait(1)
+        return 'result'
+
+    results = {}
+    leader = run_with_token(CancelToken(), lambda: first.do('k', fn), results, 'leader')
+    time.sleep(0.05)
+    token = CancelToken()
+    cancelled = run_with_token(token, lambda: second.do('k', fn), results, 'cancelled')
+    time.sleep(0.05)
+    cancelled_at = time.monotonic()
+    token.cancel()
+    cancelled.join(1)
+    assert isinstance(results.get('cancelled'), RequestCancelled), results
+    assert results['cancelled_at'] - cancelled_at < PROMPT, '取消后没有立即停止等待文件锁'
+
+    waiter = run_with_token(CancelToken(), lambda: second.do('k', fn), results, 'waiter')
+    time.sleep(0.05)
+    release.set()
+    leader.join(1)
+    waiter.join(1)
+    assert results['leader'] == ('result', False), results
+    assert results['waiter'] == ('result', True), results
+    # 结果不留在磁盘上
+    assert os.listdir(lock_dir) == [], os.listdir(lock_dir)
+    assert os.stat(lock_dir).st_mode & 0o777 == 0o700
+
+
+TESTS = [
+    ('等待事件时取消', test_wait_event),
+    ('调度器排队中取消', test_cancel_while_queued),
+    ('合并等待中取消', test_cancel_while_coalesced),
+    ('所有等待方取消后取消实际调用', test_last_waiter_cancels_call),
+    ('跨进程等待文件锁时取消', test_cancel_while_waiting_for_file_lock),
+]
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("测试取消传播")
+    print("=" * 60)
+    failed = 0
+    for name, test in TESTS:
+        try:
+            test()
+            print(f"  ✅ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"  ❌ {name}: {type(e).__name__}: {e}")
+    print("=" * 60)
+    if failed:
+        print(f"❌ {failed}/{len(TESTS)} 项失败")
+        sys.exit(1)
+    print("✅ 全部通过")
@@ -1,9 +1,57 @@
 #!/usr/bin/env python3
 """
 测试应用启动
+包括导入耗时分析和启动时间预算检查：
+    python test_startup.py
+    STARTUP_BUDGET_APP_MS=800 python test_startup.py
 """
 import sys
 import os
+import json
+import subprocess
+
+# 启动时间预算（毫秒，冷启动子进程中导入模块的耗时），可用环境变量覆盖
+STARTUP_BUDGETS = {
+    'app': float(os.getenv('STARTUP_BUDGET_APP_MS', '1500')),
+    'ehr_agent': float(os.getenv('STARTUP_BUDGET_CLI_MS', '1000')),
+}
+
+# 导入入口模块时不应加载的重量级依赖（应在首次使用时加载）
+DEFERRED_MODULES = ['google.generativeai', 'pyaudio', 'speech_recognition', 'numpy']
+
+
+def profile_imports(module: str):
+    """
+    在新的解释器中以 -X importtime 导入模块
+
+    Returns:
+        (总耗时毫秒, [(累计耗时毫秒, 模块名)], 已真正加载的重量级依赖)
+    """
+    code = (
+        "import sys, json\n"
+        f"import {module}\n"
+        "from lazy_import import is_loaded\n"
+        f"print(json.dumps([m for m in {DEFERRED_MODULES!r} if is_loaded(m)]))\n"
+    )
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    entries = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 缩进表示被其他模块导入，顶层条目之和即总耗时
+        if not name.startswith('  '):
+            total_us += int(cumulative)
+        entries.append((int(cumulative) / 1000, name.strip()))
+    entries.sort(reverse=True)
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return total_us / 1000, entries, loaded
+
 
 print("=" * 60)
 print("测试 EHR Agent 应用启动")
@@ -64,6 +112,28 @@ with app.test_client() as client:
     except Exception as e:
         print(f"   ❌ 路由测试失败: {e}")
 
+# 6. 导入耗时与启动时间预算
+print("\n6. 导入耗时:")
+over_budget = False
+for module, budget in STARTUP_BUDGETS.items():
+    try:
+        total_ms, entries, loaded = profile_imports(module)
+    except Exception as e:
+        print(f"   ⚠️  {module} 无法导入，跳过: {e}")
+        continue
+    status = "✅" if total_ms <= budget else "❌"
+    print(f"   {status} {module}: {total_ms:.0f}ms（预算 {budget:.0f}ms）")
+    for cumulative_ms, name in entries[:8]:
+        print(f"      {cumulative_ms:8.1f}ms  {name}")
+    if total_ms > budget:
+        over_budget = True
+    for name in loaded:
+        print(f"   ❌ 导入 {module} 时加载了 {name}，应改为首次使用时导入")
+        over_budget = True
+if over_budget:
+    print("\n❌ 启动时间超出预算")
+    sys.exit(1)
+
 print("\n" + "=" * 60)
 print("✅ 测试完成！应用可以启动")
 print("=" * 60)
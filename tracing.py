@@ -0,0 +1,284 @@
+"""
+请求追踪模块
+基于 span 的轻量追踪：请求 ID 从浏览器经由 Flask 路由传递到各生成器调用，
+span 以 OpenTelemetry（OTLP JSON）兼容的格式写入本地文件，
+并保留最近的请求用于查看其中最慢请求的火焰图式耗时分解
+"""
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+# 合法的外部请求 ID：32 位十六进制（W3C trace id）或 UUID
+_REQUEST_ID_PATTERN = re.compile(r'^[0-9a-fA-F-]{16,36}$')
+
+
+def normalize_trace_id(request_id: Optional[str]) -> str:
+    """将浏览器传入的请求 ID 转换为 32 位十六进制 trace id，无效时生成新的"""
+    if request_id and _REQUEST_ID_PATTERN.match(request_id):
+        hex_id = request_id.replace('-', '').lower()
+        if len(hex_id) >= 16:
+            return hex_id.rjust(32, '0')[:32]
+    return secrets.token_hex(16)
+
+
+class Span:
+    """一个计时区间"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns',
+                 'attributes', 'status', 'children')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict = {}
+        self.status = 'OK'
+        self.children: List['Span'] = []
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict:
+        """OTLP JSON 中的单个 span"""
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [
+                {'key': k, 'value': {'stringValue': str(v)}} for k, v in self.attributes.items()
+            ],
+            'status': {'code': 'STATUS_CODE_ERROR' if self.status == 'ERROR' else 'STATUS_CODE_OK'},
+        }
+
+    def breakdown(self) -> Dict:
+        """火焰图式的耗时分解：每个节点包含总耗时和自身耗时"""
+        children = [child.breakdown() for child in self.children]
+        # 并发子 span 可能使自身耗时为负，取 0
+        self_ms = max(0.0, self.duration_ms - sum(c['duration_ms'] for c in children))
+        node = {
+            'name': self.name,
+            'duration_ms': round(self.duration_ms, 1),
+            'self_ms': round(self_ms, 1),
+            'status': self.status,
+        }
+        if self.attributes:
+            node['attributes'] = dict(self.attributes)
+        if children:
+            node['children'] = children
+        return node
+
+
+class FileSpanExporter:
+    """
+    将每个完成的 trace 以一行 OTLP JSON（resourceSpans）追加写入文件
+
+    请求线程只把 trace 放入队列，由后台线程批量序列化并写入；队列满时丢弃新的 trace。
+    文件超过 max_bytes 时轮转为 <path>.1（只保留一份旧文件）
+    """
+
+    def __init__(self, path: str, service_name: str = 'ehr-agent', max_bytes: int = 50 * 1024 * 1024,
+                 queue_size: int = 1000, flush_interval: float = 1.0):
+        """
+        Args:
+            path: 导出文件路径
+            service_name: OTLP resource 中的服务名
+            max_bytes: 文件轮转的大小上限，0 表示不轮转
+            queue_size: 等待写入的 trace 数量上限
+            flush_interval: 后台线程凑批等待的时间（秒）
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.service_name = service_name
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, spans: List[Span]):
+        """放入写入队列，不阻塞请求线程"""
+        if self._stopped:
+            return
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1:
+                print("⚠️  追踪数据写入队列已满，丢弃新的 trace")
+
+    def _line(self, spans: List[Span]) -> str:
+        payload = {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'ehr_agent.tracing'},
+                    'spans': [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+        return json.dumps(payload, ensure_ascii=False)
+
+    def _rotate_if_needed(self):
+        if not self.max_bytes:
+            return
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+        except FileNotFoundError:
+            pass
+
+    def _write(self, batch: List[List[Span]]):
+        lines = ''.join(self._line(spans) + '\n' for spans in batch)
+        try:
+            self._rotate_if_needed()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except OSError as e:
+            print(f"⚠️  写入追踪数据失败: {e}")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def close(self, timeout: float = 5.0):
+        """写完队列中的 trace 后停止后台线程"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+class Tracer:
+    """追踪器：管理当前 span、导出完成的 trace，并保留最近的请求"""
+
+    def __init__(self, exporter: Optional[FileSpanExporter] = None, keep_recent: int = 500):
+        self.exporter = exporter
+        self._recent = deque(maxlen=keep_recent)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def start_span(self, name: str, trace_id: Optional[str] = None, **attributes):
+        """
+        开始一个 span；没有父 span 时作为根 span，结束时导出整个 trace
+
+        Args:
+            name: span 名称
+            trace_id: 根 span 的 trace id（通常来自请求 ID）
+            attributes: span 属性
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            span = Span(name, parent.trace_id, parent.span_id)
+            parent.children.append(span)
+        else:
+            span = Span(name, trace_id or secrets.token_hex(16))
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'ERROR'
+            span.set_attribute('error.type', type(e).__name__)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if parent is None:
+                self._finish(span)
+
+    def _finish(self, root: Span):
+        if self.exporter is not None:
+            spans = []
+            stack = [root]
+            while stack:
+                span = stack.pop()
+                spans.append(span)
+                stack.extend(span.children)
+            self.exporter.export(spans)
+        with self._lock:
+            self._recent.append(root)
+
+    def slowest(self, limit: int = 10) -> List[Dict]:
+        """最近的请求中最慢的几个及其耗时分解"""
+        with self._lock:
+            roots = sorted(self._recent, key=lambda span: span.duration_ms, reverse=True)[:limit]
+        return [
+            {
+                'trace_id': root.trace_id,
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(root.start_ns / 1e9)),
+                'duration_ms': round(root.duration_ms, 1),
+                'breakdown': root.breakdown(),
+            }
+            for root in roots
+        ]
+
+
+def current_span() -> Optional[Span]:
+    """当前 span"""
+    return _current_span.get()
+
+
+tracer = Tracer()
+
+
+def configure(export_path: Optional[str] = None, keep_recent: int = 500, max_bytes: int = 50 * 1024 * 1024):
+    """配置全局追踪器的导出文件（超过 max_bytes 时轮转）和保留的最近请求数量"""
+    previous = tracer.exporter
+    tracer.exporter = FileSpanExporter(export_path, max_bytes=max_bytes) if export_path else None
+    if previous is not None:
+        previous.close()
+    with tracer._lock:
+        tracer._recent = deque(tracer._recent, maxlen=keep_recent)
+
+
+def start_span(name: str, **attributes):
+    """在全局追踪器上开始一个 span"""
+    return tracer.start_span(name, **attributes)
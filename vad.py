@@ -0,0 +1,244 @@
+"""
+语音活动检测（VAD）模块
+基于帧能量的本地语音检测，可选 webrtcvad 轻量模型辅助判定，
+用于在识别前切除静音并切分出语句级音频片段
+"""
+from __future__ import annotations
+
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+try:
+    import webrtcvad
+except ImportError:  # 可选依赖
+    webrtcvad = None
+
+
+class VoiceActivityDetector:
+    """语音活动检测器（16-bit 单声道 PCM）"""
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 frame_ms: int = 30,
+                 energy_ratio: float = 3.0,
+                 min_energy: float = 200.0,
+                 max_threshold_ratio: float = 0.5,
+                 hangover_ms: int = 300,
+                 min_speech_ms: int = 250,
+                 min_silence_ms: int = 500,
+                 padding_ms: int = 200,
+                 max_utterance_s: float = 30.0,
+                 use_model: bool = False,
+                 model_aggressiveness: int = 2):
+        """
+        Args:
+            sample_rate: 采样率
+            frame_ms: 帧长（毫秒），使用模型时必须为 10/20/30
+            energy_ratio: 语音帧能量相对噪声底的倍数阈值
+            min_energy: 能量绝对下限（RMS），避免安静环境下阈值过低
+            max_threshold_ratio: 阈值相对高分位（90%）能量的上限，音频几乎全是语音时噪声底会被高估
+            hangover_ms: 语音结束后延续判定为语音的时长
+            min_speech_ms: 短于该时长的语音段视为噪声丢弃
+            min_silence_ms: 短于该时长的静音不切分语句
+            padding_ms: 每个语句前后保留的静音
+            max_utterance_s: 单个语句的最长时长，超过则强制切分
+            use_model: 是否使用 webrtcvad 模型与能量判定联合检测
+            model_aggressiveness: webrtcvad 灵敏度（0-3）
+        """
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.energy_ratio = energy_ratio
+        self.min_energy = min_energy
+        self.max_threshold_ratio = max_threshold_ratio
+        self.hangover_frames = max(0, hangover_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.padding_frames = max(0, padding_ms // frame_ms)
+        self.max_utterance_frames = max(1, int(max_utterance_s * 1000 / frame_ms))
+
+        self.model = None
+        if use_model:
+            if webrtcvad is None:
+                print("⚠️  未安装 webrtcvad，VAD 将仅使用能量检测")
+            else:
+                self.model = webrtcvad.Vad(model_aggressiveness)
+
+    def _frames(self, pcm: bytes) -> np.ndarray:
+        """将 PCM 字节转换为 (帧数, 帧长) 的 int16 矩阵，丢弃不足一帧的尾部"""
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        n_frames = len(samples) // self.frame_len
+        return samples[:n_frames * self.frame_len].reshape(n_frames, self.frame_len)
+
+    def frame_energies(self, pcm: bytes) -> np.ndarray:
+        """计算每帧 RMS 能量"""
+        frames = self._frames(pcm).astype(np.float32)
+        if frames.size == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.sqrt(np.mean(frames * frames, axis=1))
+
+    def _energy_threshold(self, energies: np.ndarray) -> float:
+        """以低分位能量估计噪声底，得到语音判定阈值"""
+        noise_floor, loud = np.percentile(energies, [10, 90])
+        threshold = min(float(noise_floor) * self.energy_ratio, float(loud) * self.max_threshold_ratio)
+        return max(self.min_energy, threshold)
+
+    def speech_mask(self, pcm: bytes) -> np.ndarray:
+        """
+        逐帧语音判定
+
+        Returns:
+            布尔数组，True 表示该帧为语音
+        """
+        energies = self.frame_energies(pcm)
+        if energies.size == 0:
+            return np.zeros(0, dtype=bool)
+
+        mask = energies > self._energy_threshold(energies)
+
+        if self.model is not None:
+            frame_bytes = self.frame_len * 2
+            model_mask = np.fromiter(
+                (self.model.is_speech(pcm[i * frame_bytes:(i + 1) * frame_bytes], self.sample_rate)
+                 for i in range(len(mask))),
+                dtype=bool, count=len(mask)
+            )
+            mask &= model_mask
+
+        # 拖尾：语音帧之后 hangover_frames 帧仍视为语音
+        if self.hangover_frames and mask.any():
+            kernel = np.ones(self.hangover_frames + 1, dtype=np.int32)
+            mask = np.convolve(mask.astype(np.int32), kernel)[:len(mask)] > 0
+
+        return mask
+
+    @staticmethod
+    def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 mask 中连续 True 区间的起止帧（左闭右开）"""
+        padded = np.concatenate(([False], mask, [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        return edges[0::2], edges[1::2]
+
+    def segments(self, pcm: bytes) -> List[Tuple[int, int]]:
+        """
+        检测语音段
+
+        Args:
+            pcm: 16-bit 单声道 PCM 字节
+
+        Returns:
+            语音段列表，每项为 (起始采样点, 结束采样点)
+        """
+        mask = self.speech_mask(pcm)
+        if not mask.any():
+            return []
+
+        starts, ends = self._runs(mask)
+
+        # 合并间隔过短的相邻语音段
+        if len(starts) > 1:
+            gaps = starts[1:] - ends[:-1]
+            keep = np.concatenate(([True], gaps >= self.min_silence_frames))
+            merged_starts = starts[keep]
+            merged_ends = np.concatenate((ends[np.flatnonzero(keep[1:])], ends[-1:]))
+            starts, ends = merged_starts, merged_ends
+
+        # 丢弃过短的语音段
+        long_enough = (ends - starts) >= self.min_speech_frames
+        starts, ends = starts[long_enough], ends[long_enough]
+
+        n_frames = len(mask)
+        result = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            start = max(0, start - self.padding_frames)
+            end = min(n_frames, end + self.padding_frames)
+            # 超长语句强制切分
+            for chunk_start in range(start, end, self.max_utterance_frames):
+                chunk_end = min(end, chunk_start + self.max_utterance_frames)
+                result.append((chunk_start * self.frame_len, chunk_end * self.frame_len))
+        return result
+
+    def split_utterances(self, pcm: bytes) -> List[bytes]:
+        """
+        切除静音并按语句切分
+
+        Args:
+            pcm: 16-bit 单声道 PCM 字节
+
+        Returns:
+            语句级 PCM 片段列表
+        """
+        return [pcm[start * 2:end * 2] for start, end in self.segments(pcm)]
+
+    def speech_ratio(self, pcm: bytes) -> Optional[float]:
+        """语音帧占比，无完整帧时返回 None"""
+        mask = self.speech_mask(pcm)
+        if mask.size == 0:
+            return None
+        return float(mask.mean())
+
+    def _find_cut(self, energies: np.ndarray, min_frame: int, max_frame: int,
+                  threshold: float) -> Tuple[int, bool]:
+        """
+        在 [min_frame, max_frame) 内寻找能量最低的位置作为切分点
+
+        Returns:
+            (切分帧号, 是否落在静音处)
+        """
+        window = min(self.min_silence_frames, max(1, max_frame - min_frame))
+        # 滑动平均后取最小值，优先切在一段静音的中间
+        smoothed = np.convolve(energies, np.ones(window, dtype=np.float32) / window, mode="same")
+        search = smoothed[min_frame:max_frame]
+        cut = min_frame + int(np.argmin(search))
+        return cut, bool(search[cut - min_frame] <= threshold)
+
+    def iter_chunks(self,
+                    blocks: Iterable[bytes],
+                    target_chunk_s: float = 20.0,
+                    max_chunk_s: float = 45.0,
+                    overlap_s: float = 0.5) -> Iterator[Tuple[int, bytes, bool]]:
+        """
+        将连续的 PCM 数据流在静音处切分为长音频片段
+
+        片段长度在 target_chunk_s 与 max_chunk_s 之间，优先切在静音处；
+        找不到静音时在最大长度处强制切分，并与下一片段重叠 overlap_s 秒，
+        便于拼接转录文本时去重。
+
+        Args:
+            blocks: 16-bit 单声道 PCM 字节块的迭代器
+            target_chunk_s: 目标片段时长（秒）
+            max_chunk_s: 最大片段时长（秒）
+            overlap_s: 强制切分时的重叠时长（秒）
+
+        Yields:
+            (片段起始采样点, 片段 PCM 字节, 是否为强制切分)
+        """
+        frame_bytes = self.frame_len * 2
+        target_frames = max(1, int(target_chunk_s * 1000 / self.frame_ms))
+        max_frames = max(target_frames + 1, int(max_chunk_s * 1000 / self.frame_ms))
+        overlap_frames = int(overlap_s * 1000 / self.frame_ms)
+
+        buffer = bytearray()
+        offset = 0  # buffer 起点对应的采样点
+        noise_floor = None  # 整个数据流上的噪声底估计
+        for block in blocks:
+            buffer.extend(block)
+            while len(buffer) >= max_frames * frame_bytes:
+                energies = self.frame_energies(bytes(buffer[:max_frames * frame_bytes]))
+                window_floor = float(np.percentile(energies, 10))
+                noise_floor = window_floor if noise_floor is None else min(noise_floor, window_floor)
+                threshold = max(self.min_energy, noise_floor * self.energy_ratio)
+                cut, at_silence = self._find_cut(energies, target_frames, max_frames, threshold)
+                forced = not at_silence
+                chunk = bytes(buffer[:cut * frame_bytes])
+                yield offset, chunk, forced
+
+                next_start = max(1, cut - overlap_frames) if forced else cut
+                del buffer[:next_start * frame_bytes]
+                offset += next_start * self.frame_len
+
+        if buffer:
+            yield offset, bytes(buffer), False
@@ -1,7 +1,6 @@
 """
 实时语音录制模块
 """
-import pyaudio
 import wave
 import os
 from datetime import datetime
@@ -9,24 +8,47 @@ from typing import Optional
 import threading
 import queue
 
+import audio_codec
+from lazy_import import lazy_import
+
+pyaudio = lazy_import("pyaudio")
+
 class VoiceRecorder:
     """实时语音录制器"""
     
-    def __init__(self, sample_rate=16000, chunk_size=1024, channels=1):
+    def __init__(self, sample_rate=16000, chunk_size=1024, channels=1, storage_format='wav'):
         self.sample_rate = sample_rate
         self.chunk_size = chunk_size
         self.channels = channels
         self.audio_format = pyaudio.paInt16
+        self.storage_format = audio_codec.resolve_format(storage_format)
         self.frames = []
         self.is_recording = False
         self.audio_queue = queue.Queue()
         self.audio = pyaudio.PyAudio()
+        self.encoder = None
+        self.encoder_thread = None
         
-    def start_recording(self):
-        """开始录制"""
+    def start_recording(self, filepath: Optional[str] = None):
+        """
+        开始录制
+        
+        Args:
+            filepath: 指定时边录制边编码写入该文件（扩展名按存储格式调整），
+                      否则录音保留在内存中，由 save_recording 保存
+        """
         self.is_recording = True
         self.frames = []
         
+        if filepath:
+            self.encoder = audio_codec.StreamEncoder(
+                audio_codec.with_extension(filepath, self.storage_format),
+                self.sample_rate, self.channels, self.storage_format
+            ) if audio_codec.is_available() else None
+            if self.encoder is not None:
+                self.encoder_thread = threading.Thread(target=self._encode_loop, daemon=True)
+                self.encoder_thread.start()
+        
         def audio_callback(in_data, frame_count, time_info, status):
             if self.is_recording:
                 self.audio_queue.put(in_data)
@@ -43,35 +65,75 @@ class VoiceRecorder:
         
         self.stream.start_stream()
         
-    def stop_recording(self):
-        """停止录制"""
+    def _encode_loop(self):
+        """后台线程：从队列取出音频块并写入编码器"""
+        while self.is_recording or not self.audio_queue.empty():
+            try:
+                data = self.audio_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.encoder.write(data)
+    
+    def stop_recording(self) -> Optional[str]:
+        """
+        停止录制
+        
+        Returns:
+            流式编码时返回已写入的文件路径，否则返回None
+        """
         self.is_recording = False
         if hasattr(self, 'stream'):
             self.stream.stop_stream()
             self.stream.close()
+        
+        if self.encoder is None:
+            return None
+        self.encoder_thread.join()
+        self.encoder.close()
+        filepath = self.encoder.filepath
+        self.encoder = None
+        self.encoder_thread = None
+        return filepath
     
-    def save_recording(self, filepath: str):
-        """保存录制的音频"""
+    def save_recording(self, filepath: str) -> Optional[str]:
+        """
+        保存录制的音频
+        
+        Args:
+            filepath: 目标路径，压缩格式（flac/opus）下扩展名按存储格式调整
+            
+        Returns:
+            实际写入的文件路径，没有录音数据或写入失败时返回None
+        """
         # 收集所有音频数据
         frames = []
         while not self.audio_queue.empty():
             frames.append(self.audio_queue.get())
         
         if not frames:
-            return False
-            
-        # 确保目录存在
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            return None
         
-        # 保存为WAV文件
-        wf = wave.open(filepath, 'wb')
-        wf.setnchannels(self.channels)
-        wf.setsampwidth(self.audio.get_sample_size(self.audio_format))
-        wf.setframerate(self.sample_rate)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-        
-        return True
+        try:
+            # 确保目录存在
+            os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+            
+            if self.storage_format != 'wav':
+                return audio_codec.save_pcm(filepath, b''.join(frames), self.sample_rate,
+                                            self.channels, self.storage_format)
+            
+            # 保存为WAV文件
+            wf = wave.open(filepath, 'wb')
+            try:
+                wf.setnchannels(self.channels)
+                wf.setsampwidth(self.audio.get_sample_size(self.audio_format))
+                wf.setframerate(self.sample_rate)
+                wf.writeframes(b''.join(frames))
+            finally:
+                wf.close()
+            return filepath
+        except Exception as e:
+            print(f"保存录音失败: {e}")
+            return None
     
     def cleanup(self):
         """清理资源"""